@@ -4,6 +4,11 @@
 #include "wavearray.hh"
 #include "wseries.hh"
 #include "WDM.hh"
+#include "netcluster.hh"
+#include "sseries.hh"
+#include "skymap.hh"
+#include "network.hh"
+#include <algorithm>
 using namespace std;
 
 void inline pycwb_copy_to_wavearray(double *value, wavearray<double> *wave, int size) {
@@ -46,4 +51,573 @@ std::pair<int, std::vector<double>> inline pycwb_get_base_wave(WDM<double> *pwdm
     return {j ,pycwb_get_wavearray_data(&wave)};
 };
 
+// bulk netcluster <-> columnar buffers, the pixels are stored in cList order, cluster c holds the rows
+// cluster_offsets[c]:cluster_offsets[c+1]. Column blocks:
+//   pixel_int   (3, n_pix)        time, frequency, layers
+//   pixel_float (7, n_pix)        rate, likelihood, null, theta, phi, ellipticity, polarisation
+//   ifo_float   (5, n_pix, n_ifo) noiserms, wave, w_90, asnr, a_90
+//   c_data      (n_cluster, 31)   clusterdata fields in the order of pycwb_cdata_values
+
+std::vector<long> inline pycwb_netcluster_layout(netcluster *wc) {
+    // n_pix, n_ifo, n_cluster, td_amp size, neighbors size
+    long n_pix = 0, n_td = 0, n_nb = 0;
+    long n_ifo = wc->pList.size() ? wc->pList[0].data.size() : 0;
+    for (auto &c : wc->cList) {
+        n_pix += c.size();
+        for (int id : c) {
+            netpixel &p = wc->pList[id];
+            for (auto &a : p.tdAmp) n_td += a.size();
+            n_nb += p.neighbors.size();
+        }
+    }
+    return {n_pix, n_ifo, (long) wc->cList.size(), n_td, n_nb};
+};
+
+void inline pycwb_cdata_values(clusterdata &d, double *v) {
+    double x[31] = {d.energy, d.enrgsky, d.likenet, d.netecor, d.normcor, d.netnull, d.netED, d.Gnoise,
+                    d.likesky, d.skycc, d.netcc, d.skyChi2, d.subnet, d.SUBNET, d.skyStat, d.netRHO, d.netrho,
+                    d.theta, d.phi, d.iota, d.psi, d.ellipticity, d.cTime, d.cFreq, d.gNET, d.aNET, d.iNET,
+                    d.norm, d.nDoF, (double) d.skySize, (double) d.skyIndex};
+    std::copy(x, x + 31, v);
+};
+
+void inline pycwb_set_cdata_values(clusterdata &d, const double *v) {
+    d.energy = v[0]; d.enrgsky = v[1]; d.likenet = v[2]; d.netecor = v[3]; d.normcor = v[4];
+    d.netnull = v[5]; d.netED = v[6]; d.Gnoise = v[7]; d.likesky = v[8]; d.skycc = v[9]; d.netcc = v[10];
+    d.skyChi2 = v[11]; d.subnet = v[12]; d.SUBNET = v[13]; d.skyStat = v[14]; d.netRHO = v[15];
+    d.netrho = v[16]; d.theta = v[17]; d.phi = v[18]; d.iota = v[19]; d.psi = v[20]; d.ellipticity = v[21];
+    d.cTime = v[22]; d.cFreq = v[23]; d.gNET = v[24]; d.aNET = v[25]; d.iNET = v[26]; d.norm = v[27];
+    d.nDoF = v[28]; d.skySize = (int) v[29]; d.skyIndex = (int) v[30];
+};
+
+void inline pycwb_export_netcluster(netcluster *wc, long *cluster_offsets,
+                                    long *pixel_int, double *pixel_float, unsigned char *core,
+                                    double *ifo_float, float *rank, long *index,
+                                    float *td_amp, long *td_offsets, long *neighbors, long *neighbor_offsets,
+                                    int *s_cuts, float *c_time, float *c_freq, double *c_data) {
+    std::vector<long> layout = pycwb_netcluster_layout(wc);
+    long n_pix = layout[0], n_ifo = layout[1];
+    long k = 0, t = 0, b = 0;
+    cluster_offsets[0] = 0; td_offsets[0] = 0; neighbor_offsets[0] = 0;
+    for (size_t c = 0; c < wc->cList.size(); c++) {
+        for (int id : wc->cList[c]) {
+            netpixel &p = wc->pList[id];
+            pixel_int[k] = p.time;
+            pixel_int[n_pix + k] = p.frequency;
+            pixel_int[2 * n_pix + k] = p.layers;
+            float x[7] = {p.rate, p.likelihood, p.null, p.theta, p.phi, p.ellipticity, p.polarisation};
+            for (int j = 0; j < 7; j++) pixel_float[j * n_pix + k] = x[j];
+            core[k] = p.core;
+            for (long n = 0; n < n_ifo; n++) {
+                long i = k * n_ifo + n;
+                pixdata &d = p.data[n];
+                ifo_float[i] = d.noiserms;
+                ifo_float[n_pix * n_ifo + i] = d.wave;
+                ifo_float[2 * n_pix * n_ifo + i] = d.w_90;
+                ifo_float[3 * n_pix * n_ifo + i] = d.asnr;
+                ifo_float[4 * n_pix * n_ifo + i] = d.a_90;
+                rank[i] = d.rank;
+                index[i] = d.index;
+                if ((size_t) n < p.tdAmp.size()) {
+                    wavearray<float> &a = p.tdAmp[n];
+                    std::copy(a.data, a.data + a.size(), td_amp + t);
+                    t += a.size();
+                }
+                td_offsets[i + 1] = t;
+            }
+            for (int j : p.neighbors) neighbors[b++] = j;
+            neighbor_offsets[k + 1] = b;
+            k++;
+        }
+        cluster_offsets[c + 1] = k;
+        s_cuts[c] = wc->sCuts[c];
+        c_time[c] = wc->cTime[c];
+        c_freq[c] = wc->cFreq[c];
+        pycwb_cdata_values(wc->cData[c], c_data + 31 * c);
+    }
+};
+
+long inline pycwb_export_core_pixels(netcluster *wc, float *rate, long *index) {
+    // rate and detector indices (n_pix, n_ifo) of the pixels of the clusters which are not rejected,
+    // the arrays are sized with pycwb_netcluster_layout, returns the number of exported pixels
+    long n_ifo = wc->pList.size() ? wc->pList[0].data.size() : 0;
+    long k = 0;
+    for (size_t c = 0; c < wc->cList.size(); c++) {
+        if (wc->sCuts[c] == 1) continue;
+        for (int id : wc->cList[c]) {
+            netpixel &p = wc->pList[id];
+            rate[k] = p.rate;
+            for (long n = 0; n < n_ifo; n++) index[k * n_ifo + n] = p.data[n].index;
+            k++;
+        }
+    }
+    return k;
+};
+
+void inline pycwb_import_netcluster(netcluster *wc, long n_pix, long n_ifo, long n_cluster, const long *cluster_offsets,
+                                    const long *pixel_int, const double *pixel_float, const unsigned char *core,
+                                    const double *ifo_float, const float *rank, const long *index,
+                                    const float *td_amp, const long *td_offsets,
+                                    const long *neighbors, const long *neighbor_offsets,
+                                    const int *s_cuts, const float *c_time, const float *c_freq, const double *c_data) {
+    wc->pList.clear(); wc->cList.clear(); wc->cData.clear(); wc->sCuts.clear();
+    wc->cTime.clear(); wc->cFreq.clear();
+    wc->pList.reserve(n_pix);
+    netpixel p;
+    p.data.resize(n_ifo);
+    for (long c = 0; c < n_cluster; c++) {
+        std::vector<int> ids;
+        for (long k = cluster_offsets[c]; k < cluster_offsets[c + 1]; k++) {
+            p.clusterID = c + 1;
+            p.time = pixel_int[k];
+            p.frequency = pixel_int[n_pix + k];
+            p.layers = pixel_int[2 * n_pix + k];
+            p.rate = pixel_float[k];
+            p.likelihood = pixel_float[n_pix + k];
+            p.null = pixel_float[2 * n_pix + k];
+            p.theta = pixel_float[3 * n_pix + k];
+            p.phi = pixel_float[4 * n_pix + k];
+            p.ellipticity = pixel_float[5 * n_pix + k];
+            p.polarisation = pixel_float[6 * n_pix + k];
+            p.core = core[k];
+            p.tdAmp.clear();
+            bool has_td = td_offsets[(k + 1) * n_ifo] > td_offsets[k * n_ifo];
+            for (long n = 0; n < n_ifo; n++) {
+                long i = k * n_ifo + n;
+                pixdata &d = p.data[n];
+                d.noiserms = ifo_float[i];
+                d.wave = ifo_float[n_pix * n_ifo + i];
+                d.w_90 = ifo_float[2 * n_pix * n_ifo + i];
+                d.asnr = ifo_float[3 * n_pix * n_ifo + i];
+                d.a_90 = ifo_float[4 * n_pix * n_ifo + i];
+                d.rank = rank[i];
+                d.index = index[i];
+                if (has_td) {
+                    wavearray<float> a(td_offsets[i + 1] - td_offsets[i]);
+                    std::copy(td_amp + td_offsets[i], td_amp + td_offsets[i + 1], a.data);
+                    p.tdAmp.push_back(a);
+                }
+            }
+            p.neighbors.assign(neighbors + neighbor_offsets[k], neighbors + neighbor_offsets[k + 1]);
+            ids.push_back(wc->pList.size());
+            wc->pList.push_back(p);
+        }
+        wc->cList.push_back(ids);
+        clusterdata cd;
+        pycwb_set_cdata_values(cd, c_data + 31 * c);
+        wc->cData.push_back(cd);
+        wc->sCuts.push_back(s_cuts[c]);
+        wc->cTime.push_back(c_time[c]);
+        wc->cFreq.push_back(c_freq[c]);
+    }
+};
+
+size_t inline pycwb_append_netcluster(netcluster *out, netcluster *in, int c = -1, bool rejected = true) {
+    // append cluster c of in (all the clusters if c < 0) to out, the rejected clusters are skipped unless
+    // rejected is true. The relative neighbour links are remapped to the new pixel positions.
+    if (in->cList.empty()) {
+        for (auto &p : in->pList) {
+            out->pList.push_back(p);
+            out->pList.back().clusterID = 0;
+        }
+        return out->pList.size();
+    }
+    std::vector<long> remap(in->pList.size(), -1);
+    size_t first = c < 0 ? 0 : c;
+    size_t last = c < 0 ? in->cList.size() : c + 1;
+    for (size_t i = first; i < last; i++) {
+        if (!rejected && in->sCuts[i] > 0) continue;
+        std::vector<int> ids;
+        for (int id : in->cList[i]) {
+            remap[id] = out->pList.size();
+            ids.push_back(out->pList.size());
+            out->pList.push_back(in->pList[id]);
+            out->pList.back().clusterID = out->cList.size() + 1;
+        }
+        for (int id : in->cList[i]) {
+            netpixel &p = out->pList[remap[id]];
+            std::vector<int> neighbors;
+            for (int l : p.neighbors) {
+                long j = id + l;
+                if (j >= 0 && j < (long) remap.size() && remap[j] >= 0) neighbors.push_back(remap[j] - remap[id]);
+            }
+            p.neighbors.swap(neighbors);
+        }
+        out->cList.push_back(ids);
+        out->cData.push_back(in->cData[i]);
+        out->sCuts.push_back(in->sCuts[i]);
+        out->cRate.push_back(in->cRate[i]);
+        out->cTime.push_back(in->cTime[i]);
+        out->cFreq.push_back(in->cFreq[i]);
+        out->sArea.push_back(in->sArea[i]);
+        out->p_Map.push_back(in->p_Map[i]);
+        out->p_Ind.push_back(in->p_Ind[i]);
+        out->nTofF.push_back(in->nTofF[i]);
+    }
+    return out->pList.size();
+};
+
+size_t inline pycwb_copy_netcluster(netcluster *out, netcluster *in, int c = -1, bool rejected = true) {
+    // exact copy of in (or of its cluster c) into out, unlike netcluster::cpf the cluster flags and the
+    // neighbour links are preserved
+    out->clear();
+    out->rate = in->rate;
+    out->start = in->start;
+    out->stop = in->stop;
+    out->bpp = in->bpp;
+    out->shift = in->shift;
+    out->flow = in->flow;
+    out->fhigh = in->fhigh;
+    out->nPIX = in->nPIX;
+    out->run = in->run;
+    out->pair = in->pair;
+    out->nSUB = in->nSUB;
+    return pycwb_append_netcluster(out, in, c, rejected);
+};
+
+void inline pycwb_set_sparse_table(SSeries<double> *ss, int n_lookup, const int *lookup, int n,
+                                   const int *index, const float *map_00, const float *map_90) {
+    // bulk copy of the CSR sparse table (layer-major) into the SSeries arrays
+    ss->sparseLookup.resize(n_lookup);
+    ss->sparseIndex.resize(n);
+    ss->sparseMap00.resize(n);
+    ss->sparseMap90.resize(n);
+    std::copy(lookup, lookup + n_lookup, ss->sparseLookup.data);
+    std::copy(index, index + n, ss->sparseIndex.data);
+    std::copy(map_00, map_00 + n, ss->sparseMap00.data);
+    std::copy(map_90, map_90 + n, ss->sparseMap90.data);
+};
+
+std::vector<long> inline pycwb_td_amp_layout(netcluster *wc) {
+    // {number of clusters, number of pixels, TD amplitude size} of the clusters loaded by loadTDampSSE
+    // (sCuts == -2), only the pixels with TD amplitudes are counted
+    long n_cluster = 0, n_pix = 0, td_size = 0;
+    for (size_t c = 0; c < wc->cList.size(); c++) {
+        if (wc->sCuts[c] != -2) continue;
+        n_cluster++;
+        for (int id : wc->cList[c]) {
+            netpixel &p = wc->pList[id];
+            if (!p.tdAmp.size()) continue;
+            n_pix++;
+            td_size = p.tdAmp[0].size();
+        }
+    }
+    return {n_cluster, n_pix, td_size};
+};
+
+void inline pycwb_export_td_amp(netcluster *wc, long n_pix, int *cluster_ids, long *pixel_offsets, int *layers,
+                                int *time, float *rms, float *td_amp) {
+    // bulk copy of the TD amplitudes of the clusters loaded by loadTDampSSE, rms is (n_pix, n_ifo) and
+    // td_amp is (td_size, n_ifo, n_pix) with the 00 amplitudes in the first half of td_size and the 90 in
+    // the second, so that the amplitudes of a detector at one delay are contiguous over the pixels
+    long k = 0, c_out = 0;
+    size_t n_ifo = 0;
+    pixel_offsets[0] = 0;
+    for (size_t c = 0; c < wc->cList.size(); c++) {
+        if (wc->sCuts[c] != -2) continue;
+        for (int id : wc->cList[c]) {
+            netpixel &p = wc->pList[id];
+            if (!p.tdAmp.size()) continue;
+            n_ifo = p.tdAmp.size();
+            layers[k] = p.layers;
+            time[k] = p.time;
+            for (size_t n = 0; n < n_ifo; n++) {
+                rms[k * n_ifo + n] = p.data[n].noiserms;
+                wavearray<float> &a = p.tdAmp[n];
+                for (size_t t = 0; t < a.size(); t++) td_amp[(t * n_ifo + n) * n_pix + k] = a.data[t];
+            }
+            k++;
+        }
+        cluster_ids[c_out] = c + 1;
+        pixel_offsets[++c_out] = k;
+    }
+};
+
+void inline pycwb_set_subnet_cut(netcluster *wc, int n, const int *cluster_ids, const int *sky_index,
+                                 const double *theta, const double *phi, const float *likenet, const float *energy,
+                                 const unsigned char *mra, const float *submra, const float *submra_null,
+                                 const float *suball, const float *suball_null, const unsigned char *rejected) {
+    // store the subNetCut results as done in network::subNetCut and release the TD amplitudes
+    for (int k = 0; k < n; k++) {
+        int c = cluster_ids[k] - 1;
+        wc->sCuts[c] = rejected[k] ? 1 : -1;
+        wc->cData[c].likenet = likenet[k];
+        wc->cData[c].energy = energy[k];
+        wc->cData[c].theta = theta[k];
+        wc->cData[c].phi = phi[k];
+        wc->cData[c].skyIndex = sky_index[k];
+        if (mra[k]) wc->p_Ind[c].push_back(sky_index[k]);
+        std::vector<int> &ids = wc->cList[c];
+        for (size_t j = 0; j < ids.size(); j++) {
+            netpixel &p = wc->pList[ids[j]];
+            if (mra[k]) {
+                p.theta = theta[k];
+                p.phi = phi[k];
+                if (j == 0) { p.ellipticity = submra[k]; p.polarisation = submra_null[k]; }
+                if (j == 1) { p.ellipticity = suball[k]; p.polarisation = suball_null[k]; }
+            }
+            p.core = true;
+            if (p.tdAmp.size()) p.clean();
+        }
+    }
+};
+
+std::vector<double> inline pycwb_get_skymap_data(skymap *sm) {
+    size_t n = sm->size();
+    std::vector<double> v(n);
+    for (size_t i = 0; i < n; i++) v[i] = sm->get(i);
+    return v;
+};
+
+void inline pycwb_set_sky_tables(network *net, int healpix_order, int m_ifo,
+                                 const double *fp, const double *fx, const double *tau) {
+    // same as network::setSkyMaps(healpix_order), network::setAntenna() and network::setDelay(refIFO)
+    // with precomputed antenna patterns and delays, the arrays are (n_ifo, n_sky)
+    skymap temp(healpix_order);
+    size_t m = temp.size();
+    size_t n = net->ifoList.size();
+
+    net->nSensitivity = temp;
+    net->nAlignment = temp;
+    net->nCorrelation = temp;
+    net->nLikelihood = temp;
+    net->nNullEnergy = temp;
+    net->nPenalty = temp;
+    net->nCorrEnergy = temp;
+    net->nNetIndex = temp;
+    net->nDisbalance = temp;
+    net->nSkyStat = temp;
+    net->nEllipticity = temp;
+    net->nProbability = temp;
+    net->nPolarisation = temp;
+    net->nAntenaPrior = temp;
+
+    for (size_t i = 0; i < n; i++) {
+        detector *d = net->ifoList[i];
+        d->tau = temp;
+        d->mFp = temp;
+        d->mFx = temp;
+        for (size_t l = 0; l < m; l++) {
+            d->tau.set(l, tau[i * m + l]);
+            d->mFp.set(l, fp[i * m + l]);
+            d->mFx.set(l, fx[i * m + l]);
+        }
+        net->setAntenna(d);
+    }
+    net->skyProb.resize(m);
+    net->skyENRG.resize(m);
+    net->skyMask.resize(m); net->skyMask = 1;
+    net->skyMaskCC.resize(0);
+    net->skyHole.resize(m); net->skyHole = 1.;
+    net->index.resize(m);
+    for (size_t l = 0; l < m; l++) net->index.data[l] = l;
+    net->mIFO = m_ifo;
+};
+
+void inline pycwb_set_delay_index(network *net, double rate, const short *ml, const double *penalty) {
+    // same as network::setDelayIndex(rate) with precomputed delay indices (n_ifo, n_sky)
+    size_t n = net->ifoList.size();
+    size_t m = net->ifoList[0]->tau.size();
+    net->rTDF = rate;
+    net->nPenalty = net->ifoList[0]->tau;
+    net->nNetIndex = net->ifoList[0]->tau;
+    for (size_t l = 0; l < m; l++) net->nPenalty.set(l, penalty[l]);
+    for (size_t i = 0; i < n; i++) {
+        wavearray<short> &index = net->ifoList[i]->index;
+        index.resize(m);
+        std::copy(ml + i * m, ml + (i + 1) * m, index.data);
+    }
+};
+
+void inline pycwb_set_sky_statistics(network *net, int n_sky, int n_loc, const int *locations, const double *stat,
+                                     bool maps) {
+    // store the sky loop statistics of network::likelihoodWP for the n_loc sky locations which passed the
+    // netCC threshold, stat is (14, n_loc) with the rows skyProb, nAntenaPrior, nSensitivity, nAlignment,
+    // nLikelihood, nNullEnergy, nCorrEnergy, nCorrelation, nSkyStat, nProbability, nDisbalance, nNetIndex,
+    // nEllipticity, nPolarisation. All the sky maps are reset as in network::likelihoodWP, nAntenaPrior is
+    // set for every cluster and the maps after it only if maps is true (cluster ID selected in
+    // network::likelihoodWP)
+    skymap *sm[13] = {&net->nAntenaPrior, &net->nSensitivity, &net->nAlignment, &net->nLikelihood,
+                      &net->nNullEnergy, &net->nCorrEnergy, &net->nCorrelation, &net->nSkyStat,
+                      &net->nProbability, &net->nDisbalance, &net->nNetIndex, &net->nEllipticity,
+                      &net->nPolarisation};
+    for (int l = 0; l < n_sky; l++) net->skyProb.data[l] = -1.e12;
+    for (int k = 0; k < n_loc; k++) net->skyProb.data[locations[k]] = stat[k];
+    for (int m = 0; m < (maps ? 13 : 1); m++) {
+        *sm[m] = 0.;
+        for (int k = 0; k < n_loc; k++) sm[m]->set(locations[k], stat[(m + 1) * n_loc + k]);
+    }
+};
+
+void inline pycwb_export_sky_maps(network *net, float *out) {
+    // sky maps of the likelihood statistics, out is (12, n_sky) in the order nSensitivity, nAlignment,
+    // nLikelihood, nNullEnergy, nCorrEnergy, nCorrelation, nSkyStat, nProbability, nDisbalance, nNetIndex,
+    // nEllipticity, nPolarisation
+    skymap *sm[12] = {&net->nSensitivity, &net->nAlignment, &net->nLikelihood, &net->nNullEnergy,
+                      &net->nCorrEnergy, &net->nCorrelation, &net->nSkyStat, &net->nProbability,
+                      &net->nDisbalance, &net->nNetIndex, &net->nEllipticity, &net->nPolarisation};
+    size_t n_sky = net->nProbability.size();
+    for (int m = 0; m < 12; m++) {
+        for (size_t l = 0; l < n_sky; l++) out[m * n_sky + l] = sm[m]->get(l);
+    }
+};
+
+void inline pycwb_sky_hierarchy(skymap *sm, int order, int *parent, int *representative) {
+    // cells of the HEALPix map of a lower order: parent is the cell of each sky location of sm and
+    // representative is the sky location of sm at the center of each cell
+    skymap cells(order);
+    for (size_t l = 0; l < sm->size(); l++) parent[l] = cells.getSkyIndex(sm->getTheta(l), sm->getPhi(l));
+    for (size_t c = 0; c < cells.size(); c++)
+        representative[c] = sm->getSkyIndex(cells.getTheta(c), cells.getPhi(c));
+};
+
+void inline pycwb_set_likelihood_wp(network *net, int lag, int id, int lm, int n_pix, const float *amp,
+                                    const unsigned char *core, const float *likelihood, const float *null,
+                                    const double *stat) {
+    // store the pixel statistics computed at the selected sky location lm, reconstruct the waveforms and
+    // fill in the cluster data as done at the end of network::likelihoodWP.
+    // amp is (4, n_ifo, n_pix) with the data (W, U) and signal (S, P) packet amplitudes of the pixels
+    // with TD amplitudes, stat is {Mo, Mw, Eo, Eh, Em, Gn, Ec, Dc, Rc, N, rho, xrho, Co, CH, ff, FF, subnet}
+    netcluster *pwc = net->getwc(lag);
+    size_t nIFO = net->ifoList.size();
+    size_t i;
+    float Mw = stat[1], Eo = stat[2], Eh = stat[3], Em = stat[4], Gn = stat[5], Ec = stat[6], Dc = stat[7];
+    float Rc = stat[8], N = stat[9], rho = stat[10], xrho = stat[11], Co = stat[12], CH = stat[13];
+    float ff = stat[14], FF = stat[15], subnet = stat[16];
+
+    std::vector<int> &pIndex = pwc->cList[id - 1];
+    int j = 0;
+    for (size_t k = 0; k < pIndex.size(); k++) {
+        netpixel *pix = pwc->getPixel(id, k);
+        pix->core = false;
+        pix->likelihood = 0.;
+        pix->null = 0;
+        if (!pix->tdAmp.size() || j >= n_pix) continue;
+        pix->core = core[j];
+        pix->likelihood = likelihood[j];
+        pix->null = null[j];
+        for (i = 0; i < nIFO; i++) {
+            pix->setdata(double(amp[(0 * nIFO + i) * n_pix + j]), 'W', i);   // 00 whitened
+            pix->setdata(double(amp[(1 * nIFO + i) * n_pix + j]), 'U', i);   // 90 whitened
+            pix->setdata(double(amp[(2 * nIFO + i) * n_pix + j]), 'S', i);   // 00 reconstructed whitened response
+            pix->setdata(double(amp[(3 * nIFO + i) * n_pix + j]), 'P', i);   // 90 reconstructed whitened response
+        }
+        j++;
+    }
+
+    // backward delay configuration
+    std::vector<int> *vtof = &(pwc->nTofF[id - 1]);
+    vtof->clear();
+    for (i = 0; i < XIFO; i++) vtof->push_back(net->getifo(i < nIFO ? i : 0)->index.data[lm]);
+
+    if ((net->wfsave) || (net->mdcListSize() && !lag)) {   // if wfsave=false only simulated wf are saved
+        if (net->getMRAwave(id, lag, 'S', 0, true)) {       // reconstruct whitened shifted pd->waveForm
+            for (i = 0; i < nIFO; i++) {
+                detector *pd = net->getifo(i);
+                pd->RWFID.push_back(id);
+                WSeries<double> *wf = new WSeries<double>;
+                *wf = pd->waveForm;
+                wf->start(pwc->start + pd->waveForm.start());
+                pd->RWFP.push_back(wf);
+            }
+        }
+        if (net->getMRAwave(id, lag, 's', 0, true)) {       // reconstruct strain shifted pd->waveForm
+            for (i = 0; i < nIFO; i++) {
+                detector *pd = net->getifo(i);
+                pd->RWFID.push_back(-id);
+                WSeries<double> *wf = new WSeries<double>;
+                *wf = pd->waveForm;
+                wf->start(pwc->start + pd->waveForm.start());
+                pd->RWFP.push_back(wf);
+            }
+        }
+    }
+
+    float Lw = 0, Ew = 0, To = 0, Fo = 0, Nw = 0;
+    for (i = 0; i < nIFO; i++) {
+        detector *d = net->getifo(i);
+        d->sSNR = d->xSNR = d->null = d->enrg = 0.;
+    }
+    net->getMRAwave(id, lag, 'W', 0);
+    net->getMRAwave(id, lag, 'S', 0);
+    for (i = 0; i < nIFO; i++) {
+        detector *d = net->getifo(i);
+        d->waveNull = d->waveBand;
+        d->waveNull -= d->waveForm;
+        float sSNR = d->get_SS();
+        float xSNR = d->get_XS();
+        float null = d->get_NN();
+        float enrg = d->get_XX();
+        d->sSNR += sSNR;
+        d->xSNR += xSNR;
+        d->null += null;
+        d->enrg += enrg;
+        To += sSNR * d->getWFtime();
+        Fo += sSNR * d->getWFfreq();
+        Lw += sSNR;
+        Ew += enrg;
+        Nw += null;
+    }
+    To /= Lw;
+    Fo /= Lw;
+    float ch = (Nw + Gn) / (N * nIFO);                                      // chi2
+    float cc = ch > 1 ? 1 + (ch - 1) * 2 * (1 - Rc) : 1;                    // Cr correction factor
+    float Cr = Ec * Rc / (Ec * Rc + (Dc + Nw + Gn) * cc - N * (nIFO - 1));  // reduced network correlation coefficient
+    cc = ch > 1 ? ch : 1;                                                   // rho correction factor
+    float Cp = Ec * Rc / (Ec * Rc + (Dc + Nw + Gn) - N * (nIFO - 1));      // network correlation coefficient
+    float norm = (Eo - Eh) / Ew;
+
+    clusterdata &cd = pwc->cData[id - 1];
+    cd.norm = norm * 2;
+    cd.skyStat = 0;
+    cd.skySize = Mw;
+    cd.netcc = Cp;
+    cd.skycc = Cr;
+    cd.subnet = subnet;
+    cd.SUBNET = Co;
+    cd.likenet = Lw;
+    cd.netED = Nw + Gn + Dc - N * nIFO;
+    cd.netnull = Nw + Gn;
+    cd.energy = Ew;
+    cd.likesky = Em;
+    cd.enrgsky = Eo;
+    cd.netecor = Ec;
+    cd.normcor = Ec * Rc;
+    if (net->netRHO >= 0) {
+        cd.netRHO = rho / sqrt(cc);
+        cd.netrho = rho;
+    } else {
+        cd.netRHO = -rho;
+        cd.netrho = xrho / sqrt(cc);
+    }
+    cd.cTime = To;
+    cd.cFreq = Fo;
+    cd.theta = net->nLikelihood.getTheta(lm);
+    cd.phi = net->nLikelihood.getPhi(lm);
+    cd.gNET = sqrt(ff + FF);
+    cd.aNET = sqrt(FF / ff);
+    cd.iNET = 0;
+    cd.nDoF = N;
+    cd.skyChi2 = CH;
+    cd.Gnoise = Gn;
+    cd.iota = 0;
+    cd.psi = 0;
+    cd.ellipticity = 0.;
+};
+
+void inline pycwb_reconstructed_waveform_count(network *net, long *count) {
+    // number of reconstructed waveforms stored in each detector (detector::RWFP)
+    for (size_t i = 0; i < net->ifoListSize(); i++) count[i] = long(net->getifo(i)->RWFP.size());
+};
+
+void inline pycwb_truncate_reconstructed_waveforms(network *net, const long *count) {
+    // delete the reconstructed waveforms stored after pycwb_reconstructed_waveform_count
+    for (size_t i = 0; i < net->ifoListSize(); i++) {
+        detector *pd = net->getifo(i);
+        for (size_t k = size_t(count[i]); k < pd->RWFP.size(); k++) delete (wavearray<double> *) pd->RWFP[k];
+        if (pd->RWFP.size() > size_t(count[i])) pd->RWFP.resize(count[i]);
+        if (pd->RWFID.size() > size_t(count[i])) pd->RWFID.resize(count[i]);
+    }
+};
+
 #endif //PYCWB_H
\ No newline at end of file
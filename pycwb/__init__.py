@@ -1,7 +1,13 @@
 from ._version import version, __version__, version_tuple, __version_tuple__
 
-import ROOT
-from pycwb.utils.check_ROOT import check_and_load_wavelet
+try:
+    import ROOT
+except ImportError:
+    # ROOT is needed by the search, the numba kernels and the catalog tools can be used without it
+    ROOT = None
 
-# load wavelet library if not loaded
-check_and_load_wavelet(ROOT)
+if ROOT is not None:
+    from pycwb.utils.check_ROOT import check_and_load_wavelet
+
+    # load wavelet library if not loaded
+    check_and_load_wavelet(ROOT)
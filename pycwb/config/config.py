@@ -180,7 +180,9 @@ class Config:
         FileNotFoundError: if MRAcatalog does not exist
         """
         logger.info("Checking MRA catalog")
-        wdm_MRA = WDMXTalkCatalog(self.MRAcatalog)
+        if not os.path.exists(self.MRAcatalog):
+            raise FileNotFoundError(f"MRA catalog {self.MRAcatalog} does not exist")
+        wdm_MRA = WDMXTalkCatalog.from_header(self.MRAcatalog)
 
         # check layers
         wdm_MRA.check_layers_with_MRAcatalog(self.l_low, self.l_high, self.nRES)
@@ -27,6 +27,129 @@ schema = {
             "default": 4,
             "cwb": False
         },
+        "max_energy_backend": {
+            "enum": ["root", "numba"],
+            "description": "implementation of the max over the sky energy maps in coherence (WSeries<double>::maxEnergy), "
+                           "numba runs the wave packet and the Gamma to Gaussian conversion with numba "
+                           "and processes the detectors in threads",
+            "default": "root",
+            "cwb": False
+        },
+        "max_energy_validate": {
+            "type": "boolean",
+            "description": "compare the numba max energy maps with WSeries<double>::maxEnergy, only for validation",
+            "default": False,
+            "cwb": False
+        },
+        "lag_batch_selection": {
+            "type": "boolean",
+            "description": "select the coherence pixels of all lags from candidate pixels found once per resolution "
+                           "instead of scanning the full TF maps for every lag, recommended for large lagSize",
+            "default": False,
+            "cwb": False
+        },
+        "supercluster_lag_parallel": {
+            "type": "boolean",
+            "description": "process the supercluster lags in nproc forked workers, each with its own copy of the "
+                           "network, recommended for background runs with many lags",
+            "default": False,
+            "cwb": False
+        },
+        "likelihood_cluster_parallel": {
+            "type": "boolean",
+            "description": "process the likelihood clusters in nproc forked workers, the largest clusters first, "
+                           "recommended for loud segments with many clusters",
+            "default": False,
+            "cwb": False
+        },
+        "likelihood_backend": {
+            "enum": ["root", "numba"],
+            "description": "implementation of the likelihood (network::likelihoodWP), numba runs the sky loop in "
+                           "parallel over the sky locations and computes the detection statistics with numba, "
+                           "the waveforms, sky error regions and chirp mass are still computed by ROOT",
+            "default": "root",
+            "cwb": False
+        },
+        "likelihood_validate": {
+            "type": "boolean",
+            "description": "compare the numba likelihood events with network::likelihoodWP, only for validation",
+            "default": False,
+            "cwb": False
+        },
+        "likelihood_precision": {
+            "enum": ["float32", "float64"],
+            "description": "floating point precision of the numba sky loops (likelihood and subNetCut), float32 "
+                           "halves the memory traffic of the TD amplitudes and doubles the SIMD width",
+            "default": "float32",
+            "cwb": False
+        },
+        "likelihood_precision_validate": {
+            "type": "boolean",
+            "description": "compare the numba likelihood events with the float64 sky loop and report the drift "
+                           "of rho, netcc, likelihood and sky location, only for validation",
+            "default": False,
+            "cwb": False
+        },
+        "sky_search_order": {
+            "type": "integer",
+            "description": "HEALPix order of the first level of the coarse-to-fine sky search of the numba "
+                           "likelihood and subNetCut, the top regions of each level are refined down to healpix, "
+                           "the sky maps and error regions of the selected events are computed from all the sky "
+                           "locations, 0 - scan all the sky locations",
+            "default": 0,
+            "cwb": False
+        },
+        "sky_search_top": {
+            "type": "integer",
+            "description": "number of sky regions refined at each level of the coarse-to-fine sky search",
+            "default": 8,
+            "cwb": False
+        },
+        "sky_search_margin": {
+            "type": "number",
+            "description": "the sky regions with a statistic within sky_search_margin * (max - median) of the "
+                           "top regions are also refined",
+            "default": 0.1,
+            "cwb": False
+        },
+        "sky_search_validate": {
+            "type": "boolean",
+            "description": "compare the coarse-to-fine sky search with the scan of all the sky locations, "
+                           "only for validation",
+            "default": False,
+            "cwb": False
+        },
+        "subnet_cut_backend": {
+            "enum": ["root", "numba"],
+            "description": "implementation of the sub-network cut in supercluster (network::subNetCut), "
+                           "numba processes all the clusters of a loadTDampSSE batch in one call, "
+                           "parallel over clusters and sky locations",
+            "default": "root",
+            "cwb": False
+        },
+        "sky_table_cache": {
+            "type": "string",
+            "description": "directory of the antenna pattern and delay tables of each HEALPix order, the tables are "
+                           "computed once and memory mapped by the following jobs, an empty string keeps them "
+                           "only in memory, None computes the sky maps in every network",
+            "default": None,
+            "cwb": False
+        },
+        "skymap_top_n": {
+            "type": "integer",
+            "description": "number of sky pixels with the largest probability saved in the skymap statistics of "
+                           "each event, 0 - save the full sky maps",
+            "default": 0,
+            "cwb": False
+        },
+        "xtalk_catalog_cache": {
+            "type": "string",
+            "description": "directory of the MRA catalogs converted for the numba likelihood and subNetCut, "
+                           "a catalog is converted once and memory mapped by the following jobs, None keeps "
+                           "the converted catalogs only in memory",
+            "default": None,
+            "cwb": False
+        },
         "injection": {
             "type": "object",
             "description": "injection parameters",
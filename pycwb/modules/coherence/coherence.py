@@ -1,16 +1,18 @@
 import time
-from multiprocessing import Pool
 import ROOT
 import logging
 from pycwb.config import Config
 from pycwb.types.network import Network
-from pycwb.modules.cwb_conversions import convert_to_wavearray, convert_netcluster_to_fragment_clusters
+from pycwb.types.netcluster_handle import NetClusterHandle
 from pycwb.modules.multi_resolution_wdm import create_wdm_for_level
+from .scheduler import get_coherence_scheduler
+from .max_energy import max_energy_maps, wdm_as_array
+from .pixel_selection import select_network_lags
 
 logger = logging.getLogger(__name__)
 
 
-def coherence(config, tf_maps, nRMS_list, net=None):
+def coherence(config, tf_maps, nRMS_list, net=None, tf_map_cache=None):
     """
     Select the significant pixels
 
@@ -35,11 +37,14 @@ def coherence(config, tf_maps, nRMS_list, net=None):
         List of noise RMS
     net : pycwb.types.network.Network, optional
         Network object, by default None
+    tf_map_cache : pycwb.modules.multi_resolution_wdm.TFMapCache, optional
+        Segment-scoped cache of forward transformed maps, filled by the coherence workers with nproc > 1 and
+        read by the numba max energy otherwise, by default None
 
     Returns
     -------
-    fragment_clusters: list of pycwb.types.network_cluster.FragmentCluster
-        List of fragment clusters
+    fragment_clusters: list of pycwb.types.network_cluster.FragmentCluster or NetClusterHandle
+        List of fragment clusters, the single process path keeps the native netclusters in handles
     """
     # calculate upsample factor
     timer_start = time.perf_counter()
@@ -51,16 +56,16 @@ def coherence(config, tf_maps, nRMS_list, net=None):
         up_n = 1
 
     if config.nproc > 1:
-        with Pool(processes=min(config.nproc, config.nRES)) as pool:
-            fragment_clusters_multi_res = pool.starmap(_coherence_single_res,
-                                                       [(i, config, tf_maps, nRMS_list, up_n) for i in
-                                                        range(config.nRES)])
+        # split the work in (resolution, lag chunk) units to use more than nRES workers,
+        # the workers also compute the transforms of the cache shared with supercluster
+        fragment_clusters = get_coherence_scheduler(config.nproc).run(config, tf_maps, nRMS_list, up_n,
+                                                                      tf_map_cache)
     else:
-        fragment_clusters_multi_res = [_coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net) for i in
-                                       range(config.nRES)]
+        fragment_clusters_multi_res = [_coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net, tf_map_cache)
+                                       for i in range(config.nRES)]
 
-    # flat the array
-    fragment_clusters = [item for sublist in fragment_clusters_multi_res for item in sublist]
+        # flat the array
+        fragment_clusters = [item for sublist in fragment_clusters_multi_res for item in sublist]
 
     logger.info("----------------------------------------")
     logger.info("Coherence time totally: %f s", time.perf_counter() - timer_start)
@@ -69,7 +74,7 @@ def coherence(config, tf_maps, nRMS_list, net=None):
     return fragment_clusters
 
 
-def _coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net=None):
+def _coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net=None, tf_map_cache=None):
     """
     Calculate the coherence for a single resolution
 
@@ -85,8 +90,10 @@ def _coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net=None):
     :type wdm: WDM
     :param up_n: upsample factor
     :type up_n: int
+    :param tf_map_cache: cache of forward transformed maps, the zero delay maps are reused by the numba max energy
+    :type tf_map_cache: TFMapCache
     :return: (sparse_table, fragment_clusters)
-    :rtype: (ROOT.SSeries, list[ROOT.netcluster])
+    :rtype: (ROOT.SSeries, list[FragmentCluster or NetClusterHandle])
     """
     # timer
     timer_start = time.perf_counter()
@@ -112,17 +119,21 @@ def _coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net=None):
     ###############################
 
     # produce TF maps with max over the sky energy
-    alp = 0.0
-    for n in range(len(config.ifo)):
-        ts = convert_to_wavearray(tf_maps[n])
-        ts.Edge = config.segEdge
-        # TODO: WSeries.putLayer is updated internally, here requires the wave packet pattern
-        # https://gwburst.gitlab.io/documentation/latest/html/running.html#wave-packet-parameters
-        # The max function is not just calculate the max values, but also set the whole TF map to
-        # the max value over delayed time series, this is the most time consuming part in coherence
-        alp += net.get_ifo(n).getTFmap().maxEnergy(ts, wdm.wavelet, config.max_delay, up_n, net.pattern)
-        net.get_ifo(n).getTFmap().setlow(config.fLow)
-        net.get_ifo(n).getTFmap().sethigh(config.fHigh)
+    # TODO: WSeries.putLayer is updated internally, here requires the wave packet pattern
+    # https://gwburst.gitlab.io/documentation/latest/html/running.html#wave-packet-parameters
+    # The max function is not just calculate the max values, but also set the whole TF map to
+    # the max value over delayed time series, this is the most time consuming part in coherence
+    zero_delay_maps = None
+    if tf_map_cache is not None and config.max_energy_backend == 'numba' and net.pattern != 0:
+        # the cached transforms replace the zero delay transforms of the numba max energy,
+        # otherwise the cache is filled by supercluster
+        zero_delay_maps = [wdm_as_array(tf_map_cache.get(tf_maps, n, config.WDM_level[i]).wavelet)
+                           for n in range(config.nIFO)]
+    targets = [net.get_ifo(n).getTFmap() for n in range(config.nIFO)]
+    alp = sum(max_energy_maps(config, tf_maps, wdm, targets, up_n, zero_delay_maps=zero_delay_maps))
+    for tf_map in targets:
+        tf_map.setlow(config.fLow)
+        tf_map.sethigh(config.fHigh)
 
     logger_info += "max energy in units of noise variance: %g \n" % alp
 
@@ -145,37 +156,41 @@ def _coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net=None):
 
     logger_info += "lag | clusters | pixels \n"
 
-    # temporary storage for sparse table
-    wc = ROOT.netcluster()
-
-    # loop over time lags
-    for j in range(int(net.nLag)):
-        # select pixels above Eo
-        net.get_network_pixels(j, Eo)
-        # get pixel list
-        pwc = net.get_cluster(j)
-        if net.pattern != 0:
-            # cluster pixels
-            net.cluster(j, 2, 3)
-            wc.cpf(pwc, False)
-            # remove pixels below subrho
-            # TODO: keep in mind, subrho can be more flexible.
-            # TODO: pythonize this algorithm in network cluster
-            wc.select("subrho", config.select_subrho)
-            # remove pixels below subnet
-            wc.select("subnet", config.select_subnet)
-            # copy selected pixels back to pwc
-            pwc.cpf(wc, False)
-        else:
-            net.cluster(j, 1, 1)
-
-        fragment_cluster = convert_netcluster_to_fragment_clusters(pwc)
-        fragment_clusters.append(fragment_cluster)
-
+    if config.lag_batch_selection:
+        # the candidate pixels are found once, each lag only shifts them
+        fragment_clusters = select_network_lags(config, net, nRMS_list, Eo, range(int(net.nLag)))
+    else:
+        # temporary storage for sparse table
+        wc = ROOT.netcluster()
+
+        # loop over time lags
+        for j in range(int(net.nLag)):
+            # select pixels above Eo
+            net.get_network_pixels(j, Eo)
+            # get pixel list
+            pwc = net.get_cluster(j)
+            if net.pattern != 0:
+                # cluster pixels
+                net.cluster(j, 2, 3)
+                wc.cpf(pwc, False)
+                # remove pixels below subrho
+                # TODO: keep in mind, subrho can be more flexible.
+                # TODO: pythonize this algorithm in network cluster
+                wc.select("subrho", config.select_subrho)
+                # remove pixels below subnet
+                wc.select("subnet", config.select_subnet)
+                # copy selected pixels back to pwc
+                pwc.cpf(wc, False)
+            else:
+                net.cluster(j, 1, 1)
+
+            # keep a native copy, the view is built only when the pixels are needed
+            fragment_clusters.append(NetClusterHandle.from_netcluster(pwc))
+            pwc.clear()
+
+    for j, fragment_cluster in enumerate(fragment_clusters):
         logger_info += "%3d |%9d |%7d \n" % (j, fragment_cluster.event_count(), fragment_cluster.pixel_count())
 
-        pwc.clear()
-
     ###############################
 
     logger_info += "Coherence time for single level: %f s" % (time.perf_counter() - timer_start)
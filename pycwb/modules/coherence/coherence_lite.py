@@ -1,15 +1,15 @@
-import copy
 import time
+from functools import partial
 from multiprocessing import Pool
-import ROOT
 import logging
 from pycwb.config import Config
 from pycwb.modules.multi_resolution_wdm import create_wdm_for_level
 from pycwb.types.time_frequency_series import TimeFrequencySeries
 from pycwb.types.network_cluster import FragmentCluster
 from pycwb.types.network import Network
-from pycwb.modules.cwb_conversions import convert_to_wavearray, convert_to_wseries, \
-    convert_netcluster_to_fragment_clusters
+from pycwb.modules.cwb_conversions import convert_to_wavearray, convert_to_wseries
+from .pixel_selection import EnergyMaps, NoiseRMSMap, LagBatchSelector, threshold, select_network_pixels, \
+    cluster_lags
 
 logger = logging.getLogger(__name__)
 
@@ -129,17 +129,19 @@ def _coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net=None):
         tf.sethigh(config.fHigh)
         tf_list.append(tf)
 
-    nRMS_ws = [convert_to_wseries(nRMS) for nRMS in nRMS_list]
-
     logger_info += "max energy in units of noise variance: %g \n" % alp
 
     alp = alp / config.nIFO
 
+    # pixel selection and clustering run on numpy copies of the maps, the lags are processed in threads
+    maps = EnergyMaps.from_wseries(tf_list)
+    noise_rms = [NoiseRMSMap.from_tf_series(nRMS) for nRMS in nRMS_list]
+
     # set threshold
     if config.pattern != 0:
-        Eo = ROOT.threshold(tf_list, config.nIFO, config.segEdge, config.bpp, alp)
+        Eo = threshold(maps, config.segEdge, config.bpp, alp)
     else:
-        Eo = ROOT.threshold(tf_list, config.nIFO, config.segEdge, config.bpp)
+        Eo = threshold(maps, config.segEdge, config.bpp)
 
     logger_info += "thresholds in units of noise variance: Eo=%g Emax=%g \n" % (Eo, Eo * 2)
 
@@ -152,38 +154,21 @@ def _coherence_single_res(i, config, tf_maps, nRMS_list, up_n, net=None):
 
     logger_info += "lag | clusters | pixels \n"
 
-    # temporary storage for sparse table
-    wc = ROOT.netcluster()
+    lag_shifts = [[net.get_ifo(n).lagShift.data[j] for n in range(config.nIFO)] for j in range(int(net.nLag))]
+
+    if config.lag_batch_selection:
+        select = LagBatchSelector(maps, noise_rms, config.segEdge, Eo).select
+    else:
+        select = partial(select_network_pixels, maps, noise_rms, config.segEdge, Eo=Eo)
 
     # loop over time lags
-    for j in range(int(net.nLag)):
-        # select pixels above Eo
-        pwc = ROOT.getNetworkPixels(config.nIFO, tf_list, nRMS_ws, 1,
-                                       config.segEdge, j, Eo, 1.0, [net.get_ifo(n).lagShift.data[j] for n in range(config.nIFO)])
-
-        if config.pattern != 0:
-            # cluster pixels
-            pwc.cluster(2, 3)
-            wc.cpf(pwc, False)
-            # remove pixels below subrho
-            wc.select("subrho", config.select_subrho)
-            # remove pixels below subnet
-            wc.select("subnet", config.select_subnet)
-            # copy selected pixels back to pwc
-            pwc.cpf(wc, False)
-        else:
-            pwc.cluster(j, 1, 1)
-
-        # FIXME: why do we need to deepcopy the cluster?
-        #  If we don't, macos will crash with thread-saftey issue
-        #  Maybe because the pwc.clear() will delete the cluster?
-        fragment_cluster = copy.deepcopy(convert_netcluster_to_fragment_clusters(pwc))
+    shifts = [float(net.get_cluster(j).shift) for j in range(int(net.nLag))]
+    for j, fragment_cluster in enumerate(cluster_lags(select, lag_shifts, config.pattern, config.select_subrho,
+                                                      config.select_subnet, config.nproc, shifts=shifts,
+                                                      bpp=config.bpp)):
         fragment_clusters.append(fragment_cluster)
-
         logger_info += "%3d |%9d |%7d \n" % (j, fragment_cluster.event_count(), fragment_cluster.pixel_count())
 
-        pwc.clear()
-
     ###############################
 
     logger_info += "Coherence time for single level: %f s" % (time.perf_counter() - timer_start)
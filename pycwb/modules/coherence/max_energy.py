@@ -0,0 +1,401 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from math import sqrt, log
+
+import numpy as np
+import ROOT
+from numba import njit, prange
+
+from pycwb.modules.cwb_conversions import convert_to_wavearray
+
+logger = logging.getLogger(__name__)
+
+
+def max_energy_maps(config, tf_maps, wdm, targets, up_n, ifo_ids=None, zero_delay_maps=None):
+    """
+    Fill the max over the sky energy maps of the detectors with the backend selected by config.max_energy_backend
+
+    :param config: configuration object
+    :type config: Config
+    :param tf_maps: whitened time-frequency maps, one for each detector
+    :type tf_maps: list[TimeFrequencySeries]
+    :param wdm: wavelet of the current resolution
+    :type wdm: WDM
+    :param targets: TF maps to fill
+    :type targets: list[ROOT.WSeries]
+    :param up_n: upsample factor
+    :type up_n: int
+    :param ifo_ids: detector index of each target, by default range(len(targets))
+    :type ifo_ids: list[int], optional
+    :param zero_delay_maps: cached orthonormal transforms of the detectors, only used by the numba backend
+    :type zero_delay_maps: list[numpy.ndarray], optional
+    :return: alp of each target
+    :rtype: list[float]
+    """
+    ifo_ids = list(range(len(targets))) if ifo_ids is None else ifo_ids
+    zero_delay_maps = [None] * len(targets) if zero_delay_maps is None else zero_delay_maps
+    # a single target runs the parallel kernels, several targets run the serial kernels in threads
+    parallel = len(targets) == 1
+
+    def _single(args):
+        target, n, zero_delay_map = args
+        ts = convert_to_wavearray(tf_maps[n])
+        ts.Edge = config.segEdge
+        if config.max_energy_backend == 'numba':
+            return max_energy(target, ts, wdm, config.max_delay, up_n, config.pattern,
+                              zero_delay_map=zero_delay_map, validate=config.max_energy_validate,
+                              parallel=parallel)
+        return target.maxEnergy(ts, wdm.wavelet, config.max_delay, up_n, config.pattern)
+
+    args = list(zip(targets, ifo_ids, zero_delay_maps))
+    if config.max_energy_backend == 'numba' and len(args) > 1:
+        # the numba kernels release the GIL, each detector runs the serial kernels in its own thread
+        with ThreadPoolExecutor(max_workers=len(args)) as executor:
+            return list(executor.map(_single, args))
+    return [_single(a) for a in args]
+
+
+def max_energy(tf_map, ts, wdm, max_delay, up_n=1, pattern=0, zero_delay_map=None, validate=False, parallel=True):
+    """
+    Port of WSeries<double>::maxEnergy, put the maximum energy of the time delayed samples in tf_map
+
+    The WDM transforms of the delayed time series are still done by ROOT, the wave packet energy,
+    the max over the delays, the edge layers and the Gamma to Gaussian conversion are done with numba
+    kernels which release the GIL, so the detectors can be processed in threads.
+
+    :param tf_map: TF map to fill, the low frequency boundary is used for the wave packets
+    :type tf_map: ROOT.WSeries
+    :param ts: whitened time series with the segment edge set
+    :type ts: ROOT.wavearray
+    :param wdm: wavelet used for the transformation
+    :type wdm: WDM
+    :param max_delay: range of time delays (sec)
+    :type max_delay: float
+    :param up_n: downsample factor to obtain coarse TD steps
+    :type up_n: int
+    :param pattern: clustering pattern
+    :type pattern: int
+    :param zero_delay_map: orthonormal transform (00 phase followed by 90 phase) of ts, reused if given
+    :type zero_delay_map: numpy.ndarray, optional
+    :param validate: compare the result with WSeries<double>::maxEnergy
+    :type validate: bool
+    :param parallel: run the kernels in parallel over the time slices, use False when called from several threads
+    :type parallel: bool
+    :return: Gamma shape parameter, 1 if pattern = 0
+    :rtype: float
+    """
+    packet_kernel, max_kernel = (max_packet_energy, max_inplace) if parallel else \
+        (_max_packet_energy_serial, _max_inplace_serial)
+    n = ts.size()
+    K = int(ts.rate() * abs(max_delay))  # half number of time delays
+    ts_data = as_array(ts).copy()
+
+    # power map of the zero delay, it also sets the wavelet and the layout of tf_map
+    tf_map.Forward(ts, wdm.wavelet, 0)
+    energy = as_array(tf_map)
+    n_layer = tf_map.maxLayer() + 1
+
+    xx = ROOT.wavearray(np.double)(ts)
+    xx_data = as_array(xx)
+    tmp = ROOT.WSeries(np.double)()
+
+    if pattern != 0:
+        offsets, mean, m_low, m_high = packet_parameters(pattern, n_layer, tf_map.getlow(), tf_map.gethigh(),
+                                                         tf_map.resolution(0))
+        jb = max(int(ts.Edge * tf_map.wrate() / 4.) * n_layer, 4 * n_layer)
+
+        energy[:] = 0.
+        if zero_delay_map is None:
+            tmp.Forward(ts, wdm.wavelet, -1)
+            zero_delay_map = as_array(tmp)
+        packet_kernel(energy, zero_delay_map, offsets, mean, n_layer, m_low, m_high, jb)
+
+        for k in range(up_n, K + 1, up_n):
+            for _ in _delayed_copies(xx_data, ts_data, n, k):
+                tmp.Forward(xx, wdm.wavelet, -1)
+                packet_kernel(energy, as_array(tmp), offsets, mean, n_layer, m_low, m_high, jb)
+    else:
+        for k in range(up_n, K + 1, up_n):
+            for _ in _delayed_copies(xx_data, ts_data, n, k):
+                tmp.Forward(xx, wdm.wavelet, 0)
+                max_kernel(energy, as_array(tmp))
+
+    zero_layers(energy, n_layer, abs(pattern) in (5, 6, 9))
+
+    alp = 1. if pattern == 0 else gamma_to_gauss(energy, n_layer, ts.Edge, tf_map.wrate())
+
+    if validate:
+        validate_max_energy(energy, alp, ts, wdm, max_delay, up_n, pattern, tf_map.getlow())
+
+    return alp
+
+
+def as_array(wave):
+    """
+    numpy view of the data of a ROOT.wavearray (or WSeries), valid until the wavearray is reallocated
+
+    :param wave: wavearray
+    :type wave: ROOT.wavearray
+    :return: data
+    :rtype: numpy.ndarray
+    """
+    return _view(wave.data, wave.size())
+
+
+def wdm_as_array(wdm):
+    """
+    numpy view of the WDM sliced array, valid until the wavelet is released
+
+    :param wdm: wavelet after a forward transform
+    :type wdm: WDM
+    :return: data
+    :rtype: numpy.ndarray
+    """
+    return wdm.as_array()
+
+
+def _view(pointer, size):
+    pointer.reshape((size,))
+    return np.frombuffer(pointer, dtype=np.float64, count=size)
+
+
+def _delayed_copies(xx_data, ts_data, n, k):
+    """
+    reproduce the two delayed copies of wavearray::cpf used in maxEnergy, the samples of xx which
+    are not overwritten keep the values of the previous delay
+    """
+    # xx.cpf(ts, n-k, k)
+    xx_data[:n - k] = ts_data[k:]
+    yield k
+    # xx.cpf(ts, n-k, 0, k)
+    xx_data[k:] = ts_data[:n - k]
+    yield -k
+
+
+def packet_parameters(pattern, n_layer, f_low, f_high, df):
+    """
+    wave packet offsets and frequency range used by WSeries<double>::wdmPacket
+
+    :param pattern: clustering pattern
+    :type pattern: int
+    :param n_layer: number of layers
+    :type n_layer: int
+    :param f_low: low frequency boundary
+    :type f_low: float
+    :param f_high: high frequency boundary
+    :type f_high: float
+    :param df: frequency resolution
+    :type df: float
+    :return: (offsets of the packet pixels, mean of the packet noise, lowest layer, highest layer)
+    :rtype: (numpy.ndarray, float, int, int)
+    """
+    M = n_layer
+    p = np.zeros(9, dtype=np.int64)
+    m_low = int(f_low / df + 0.1)
+    m_high = int(f_high / df + 0.1)
+    pattern = abs(pattern)
+    shrink = 1
+
+    if pattern == 1:
+        p[1:3] = [1, -1]
+        mean = 3.
+    elif pattern == 2:
+        p[1:3] = [M, -M]
+        mean = 3.
+        shrink = 0
+    elif pattern == 3:
+        p[1:3] = [M + 1, -M - 1]
+        mean = 3.
+    elif pattern == 4:
+        p[1:3] = [-M + 1, M - 1]
+        mean = 3.
+    elif pattern == 5:
+        p[1:5] = [M + 1, -M - 1, 2 * M + 2, -2 * M - 2]
+        mean = 5.
+        shrink = 2
+    elif pattern == 6:
+        p[1:5] = [-M + 1, M - 1, -2 * M + 2, 2 * M - 2]
+        mean = 5.
+        shrink = 2
+    elif pattern == 7:
+        p[1:5] = [1, -1, M, -M]
+        mean = 5.
+    elif pattern == 8:
+        p[1:5] = [M + 1, -M + 1, M - 1, -M - 1]
+        mean = 5.
+    elif pattern == 9:
+        p[1:9] = [1, -1, M, -M, M + 1, M - 1, -M + 1, -M - 1]
+        mean = 9.
+    else:
+        mean = 1.
+        shrink = 0
+
+    return p, mean, m_low + shrink, m_high - shrink
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def max_packet_energy(energy, tf, p, mean, n_layer, m_low, m_high, jb):
+    """
+    update the energy map with the max of the wave packet energy of an orthonormal map,
+    same as WSeries<double>::wdmPacket(pattern, 'E') followed by wavearray::max
+
+    :param energy: energy map to update, size J
+    :type energy: numpy.ndarray
+    :param tf: orthonormal map, 00 phase followed by 90 phase, size 2J
+    :type tf: numpy.ndarray
+    :param p: offsets of the packet pixels
+    :type p: numpy.ndarray
+    :param mean: mean of the packet noise distribution
+    :type mean: float
+    :param n_layer: number of layers
+    :type n_layer: int
+    :param m_low: lowest layer
+    :type m_low: int
+    :param m_high: highest layer
+    :type m_high: int
+    :param jb: first pixel index out of the edge
+    :type jb: int
+    """
+    J = tf.size // 2
+    je = J - jb
+    for t in prange(J // n_layer):
+        for m in range(n_layer):
+            j = t * n_layer + m
+            if j < jb or j >= je:
+                # the pixels in the edges are not converted, the 00 amplitude is kept
+                em = tf[j]
+            elif m < m_low or m > m_high:
+                em = 0.
+            else:
+                ss = 0.
+                ee = 0.
+                EE = 0.
+                for k in range(1, 9):
+                    a = tf[j + p[k]]
+                    b = tf[j + J + p[k]]
+                    ss += a * b
+                    ee += a * a
+                    EE += b * b
+                a = tf[j]
+                b = tf[j + J]
+                ss += a * b * (mean - 8)
+                ee += a * a * (mean - 8)
+                EE += b * b * (mean - 8)
+
+                cc = ee - EE
+                ss *= 2
+                nn = sqrt(cc * cc + ss * ss)
+                if ee + EE < nn:
+                    nn = ee + EE
+                if mean == 1.:
+                    em = (ee + EE) / 2.
+                else:
+                    aa = sqrt((ee + EE + nn) / 2) + sqrt((ee + EE - nn) / 2)
+                    em = aa * aa / 4
+            if energy[j] < em:
+                energy[j] = em
+
+
+@njit(nogil=True, parallel=True, cache=True)
+def max_inplace(energy, other):
+    """
+    elementwise max of two maps, same as wavearray::max
+    """
+    for j in prange(energy.size):
+        if energy[j] < other[j]:
+            energy[j] = other[j]
+
+
+# serial versions for concurrent calls from several threads, the default numba threading layer
+# does not support parallel kernels launched from different threads
+_max_packet_energy_serial = njit(nogil=True)(max_packet_energy.py_func)
+_max_inplace_serial = njit(nogil=True)(max_inplace.py_func)
+
+
+@njit(nogil=True, cache=True)
+def zero_layers(energy, n_layer, inner):
+    """
+    zero the lowest and the highest layers, and the next ones if inner is True
+    """
+    for t in range(energy.size // n_layer):
+        j = t * n_layer
+        energy[j] = 0.
+        energy[j + n_layer - 1] = 0.
+        if inner:
+            energy[j + 1] = 0.
+            energy[j + n_layer - 2] = 0.
+
+
+@njit(nogil=True, cache=True)
+def gamma_to_gauss(data, n_layer, edge, w_rate):
+    """
+    find the shape of the Gamma noise statistic and convert the map to Gaussian statistic,
+    same as WSeries<double>::Gamma2Gauss
+
+    :param data: energy map, updated in place
+    :type data: numpy.ndarray
+    :param n_layer: number of layers
+    :type n_layer: int
+    :param edge: segment edge (sec)
+    :type edge: float
+    :param w_rate: wavelet zero layer rate
+    :type w_rate: float
+    :return: Gamma shape parameter scaled to the median
+    :rtype: float
+    """
+    size = data.size
+    nL = int(edge * w_rate * n_layer)
+    nR = size - nL - 1  # right boundary
+    fff = (nR - nL) * np.sum(data > 0.001) / size  # zero fraction
+    m = nR - int(0.5 * fff)
+    med = np.partition(data[nL:nR + 1].copy(), m - nL)[m - nL]  # distribution median
+
+    aaa = 0.
+    bbb = 0.
+    nn = 0
+    for i in range(nL, nR):  # get Gamma shape
+        amp = data[i]
+        if 0.01 < amp < 20 * med:
+            aaa += amp
+            bbb += log(amp)
+            nn += 1
+    alp = log(aaa / nn) - bbb / nn
+    alp = (3 - alp + sqrt((alp - 3) * (alp - 3) + 24 * alp)) / 12. / alp
+    avr = med * (3 * alp + 0.2) / (3 * alp - 0.8)  # get Gamma mean
+
+    ALP = med * alp / avr
+    for i in range(size):
+        amp = data[i] * alp / avr
+        if amp < ALP:
+            data[i] = 0.
+        else:
+            data[i] = amp - ALP * (1 + log(amp / ALP))
+
+    fff = np.sum(data[nL:size - nL] > 1.e-5)  # number of events excluding 0
+    m = nR - int(0.3173 * fff)
+    rms = 1. / np.partition(data[nL:nR + 1].copy(), m - nL)[m - nL]  # 1 over distribution rms
+    data *= rms
+    return ALP
+
+
+def validate_max_energy(energy, alp, ts, wdm, max_delay, up_n, pattern, f_low, rtol=1e-6):
+    """
+    Compare the max energy map with WSeries<double>::maxEnergy and log the deviation
+
+    :return: True if the maps agree within rtol
+    :rtype: bool
+    """
+    reference = ROOT.WSeries(np.double)()
+    reference.setlow(f_low)
+    reference_alp = reference.maxEnergy(ts, wdm.wavelet, max_delay, up_n, pattern)
+    reference = as_array(reference)
+
+    if reference.size != energy.size:
+        logger.warning("max energy validation: size mismatch %d != %d", energy.size, reference.size)
+        return False
+
+    deviation = np.max(np.abs(energy - reference)) / max(np.max(np.abs(reference)), 1e-30)
+    agree = deviation <= rtol and abs(alp - reference_alp) <= rtol * max(abs(reference_alp), 1.)
+    (logger.info if agree else logger.warning)(
+        "max energy validation: relative deviation %.3g, alp %.6g (ROOT %.6g)", deviation, alp, reference_alp)
+    return agree
@@ -0,0 +1,932 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+
+import numpy as np
+from numba import njit
+from scipy.special import gammainccinv
+
+from pycwb.types.network_cluster import FragmentCluster, Cluster, ClusterMeta
+from pycwb.types.network_pixel import PixelTable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EnergyMaps:
+    """
+    Max over the sky energy maps of the detectors at one resolution, stored as a numpy array
+
+    :param data: pixel energies with shape (n_ifo, n_slice, n_layer)
+    :type data: numpy.ndarray
+    :param rate: time series rate
+    :type rate: float
+    :param w_rate: pixel layer rate
+    :type w_rate: float
+    :param start: start GPS time
+    :type start: float
+    :param stop: stop GPS time
+    :type stop: float
+    :param f_low: low frequency boundary
+    :type f_low: float
+    :param f_high: high frequency boundary
+    :type f_high: float
+    """
+    data: np.ndarray
+    rate: float
+    w_rate: float
+    start: float
+    stop: float
+    f_low: float
+    f_high: float
+
+    @classmethod
+    def from_wseries(cls, tf_list):
+        """
+        Copy the power maps of a list of WSeries (one for each detector) in a numpy array
+
+        :param tf_list: power maps filled by WSeries<double>::maxEnergy
+        :type tf_list: list[ROOT.WSeries]
+        :return: energy maps
+        :rtype: EnergyMaps
+        """
+        from .max_energy import as_array
+
+        tf = tf_list[0]
+        n_layer = tf.maxLayer() + 1
+        data = np.stack([as_array(w).reshape(-1, n_layer) for w in tf_list])
+        return cls(data=data, rate=float(tf.rate()), w_rate=float(tf.wrate()), start=float(tf.start()),
+                   stop=float(tf.stop()), f_low=float(tf.getlow()), f_high=float(tf.gethigh()))
+
+    @property
+    def n_ifo(self):
+        return self.data.shape[0]
+
+    @property
+    def n_slice(self):
+        return self.data.shape[1]
+
+    @property
+    def n_layer(self):
+        return self.data.shape[2]
+
+    def frequency(self, i):
+        """
+        central frequency of the WDM layer i
+        """
+        return i * self.rate / (self.n_layer - 1) / 2.
+
+
+@dataclass
+class NoiseRMSMap:
+    """
+    Noise RMS of one detector as a numpy array
+
+    :param data: noise rms with shape (n_sample, n_layer)
+    :type data: numpy.ndarray
+    :param start: start GPS time
+    :type start: float
+    :param w_rate: rate of the noise rms measurements
+    :type w_rate: float
+    :param rate: time series rate
+    :type rate: float
+    """
+    data: np.ndarray
+    start: float
+    w_rate: float
+    rate: float
+
+    @classmethod
+    def from_tf_series(cls, nRMS):
+        """
+        :param nRMS: noise rms produced by the whitening
+        :type nRMS: TimeFrequencySeries
+        :rtype: NoiseRMSMap
+        """
+        n_layer = nRMS.wavelet.max_layer + 1
+        data = np.asarray(nRMS.data.data, dtype=np.float64).reshape(-1, n_layer)
+        return cls(data=data, start=float(nRMS.start), w_rate=float(nRMS.w_rate),
+                   rate=float(nRMS.sample_rate))
+
+
+@dataclass
+class SelectedPixels:
+    """
+    Columnar pixels selected at one resolution and one lag, port of the netcluster produced by
+    network::getNetworkPixels. Pixels are sorted by time then frequency.
+
+    :param time: time index in the reference (smallest lag shift) detector, shape (n_pix,)
+    :param frequency: frequency layer, shape (n_pix,)
+    :param likelihood: network energy, shape (n_pix,)
+    :param index: index in the TF map of each detector, shape (n_pix, n_ifo)
+    :param asnr: whitened amplitude of each detector, shape (n_pix, n_ifo)
+    :param noise_rms: noise rms of each detector, shape (n_pix, n_ifo)
+    :param rate: time series rate
+    :param w_rate: pixel layer rate
+    :param layers: number of frequency layers
+    :param start: start GPS time
+    :param stop: stop GPS time
+    :param f_low: low frequency boundary
+    :param f_high: high frequency boundary
+    :param livetime: live time of the lag
+    :param cluster_id: 1-based cluster ID of each pixel, 0 before clustering
+    :param cluster_status: selection flag of each cluster, 1 - rejected
+    :param edges: neighbour pairs (i, j), i < j, found by the clustering
+    :param subnet_threshold: subnetwork threshold for a single network pixel
+    """
+    time: np.ndarray
+    frequency: np.ndarray
+    likelihood: np.ndarray
+    index: np.ndarray
+    asnr: np.ndarray
+    noise_rms: np.ndarray
+    rate: float
+    w_rate: float
+    layers: int
+    start: float
+    stop: float
+    f_low: float
+    f_high: float
+    livetime: float
+    cluster_id: np.ndarray = None
+    cluster_status: np.ndarray = None
+    edges: np.ndarray = None
+    subnet_threshold: float = 0.
+    chained: bool = field(default=False, repr=False)
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def n_cluster(self):
+        return 0 if self.cluster_status is None else len(self.cluster_status)
+
+    def cluster(self, kt, kf):
+        """
+        Group the pixels closer than kt slices in time and kf layers in frequency, port of netcluster::cluster(kt, kf)
+
+        :param kt: time window in slices
+        :type kt: int
+        :param kf: frequency window in layers
+        :type kf: int
+        :return: number of clusters
+        :rtype: int
+        """
+        if len(self) == 0:
+            self.cluster_id = np.zeros(0, dtype=np.int64)
+            self.cluster_status = np.zeros(0, dtype=np.int32)
+            self.edges = np.zeros((0, 2), dtype=np.int64)
+            return 0
+        slices = self.time // self.layers
+        self.edges = neighbour_pairs(slices, self.frequency.astype(np.int64), max(kt, 1), max(kf, 1))
+        self.cluster_id = connected_components(len(self), self.edges)
+        self.cluster_status = np.zeros(int(self.cluster_id.max()), dtype=np.int32)
+        self.chained = False
+        return self.n_cluster
+
+    def select(self, name, thr):
+        """
+        Reject the clusters with a statistic below the threshold, port of netcluster::select
+
+        :param name: 'subrho' or 'subnet'
+        :type name: str
+        :param thr: threshold
+        :type thr: float
+        """
+        if len(self) == 0:
+            return
+        if self.cluster_id is None:
+            raise ValueError("pixels must be clustered before the selection")
+        if name not in ('subrho', 'subnet'):
+            raise ValueError(f"unknown selection {name}")
+        if not self.subnet_threshold:
+            self.subnet_threshold = 2 * igamma(self.index.shape[1] - 1, 0.314)
+        subrho, subnet = subnetwork_statistics(self.cluster_id, self.cluster_status, self.asnr, self.noise_rms,
+                                               self.subnet_threshold)
+        stat = subrho if name == 'subrho' else subnet
+        # NaN statistics are not rejected, as in the C++ comparison
+        self.cluster_status[(self.cluster_status <= 0) & (stat < thr)] = 1
+
+    def compact(self):
+        """
+        Keep only the accepted clusters with their pixels stored contiguously, port of netcluster::cpf.
+        The neighbours of the pixels are reset to a chain inside each cluster.
+        """
+        if len(self) == 0 or self.cluster_id is None:
+            return
+        accepted = self.cluster_status[self.cluster_id - 1] <= 0
+        order = np.flatnonzero(accepted)
+        order = order[np.argsort(self.cluster_id[order], kind='stable')]
+        old_ids = self.cluster_id[order]
+        _, new_ids = np.unique(old_ids, return_inverse=True)
+
+        for name in ('time', 'frequency', 'likelihood', 'index', 'asnr', 'noise_rms'):
+            setattr(self, name, getattr(self, name)[order])
+        self.cluster_id = new_ids.astype(np.int64) + 1
+        self.cluster_status = np.zeros(len(np.unique(old_ids)), dtype=np.int32)
+        self.edges = None
+        self.chained = True
+
+    def neighbors(self):
+        """
+        relative neighbour offsets of the pixels, as stored in netpixel::neighbors, in the ragged layout of
+        PixelTable: the neighbours of pixel k are ``neighbors[neighbor_offsets[k]:neighbor_offsets[k + 1]]``
+
+        :return: neighbors, neighbor_offsets
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        n = len(self)
+        if self.chained:
+            # chain inside each cluster: each pixel is linked to the previous pixel of the same cluster
+            second = np.flatnonzero(self.cluster_id[1:] == self.cluster_id[:-1]) + 1
+            edges = np.stack([second - 1, second], axis=1)
+        elif self.edges is not None:
+            edges = self.edges
+        else:
+            edges = np.zeros((0, 2), dtype=np.int64)
+        pixel = np.concatenate([edges[:, 0], edges[:, 1]]).astype(np.int64)
+        offset = np.concatenate([edges[:, 1] - edges[:, 0], edges[:, 0] - edges[:, 1]]).astype(np.int64)
+        order = np.lexsort((offset, pixel))
+        neighbor_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pixel, minlength=n), out=neighbor_offsets[1:])
+        return offset[order], neighbor_offsets
+
+    def to_fragment_cluster(self, shift=0., bpp=1., n_pix=3, run=0):
+        """
+        Convert to a FragmentCluster, one Cluster for each cluster ID, the header defaults are the ones of netcluster
+
+        :param shift: lag id of the clusters (netcluster::shift)
+        :type shift: float
+        :param bpp: black pixel probability of the selection
+        :type bpp: float
+        :param n_pix: minimum number of pixels of a cluster (netcluster::nPIX)
+        :type n_pix: int
+        :param run: run ID
+        :type run: int
+        :return: fragment cluster
+        :rtype: FragmentCluster
+        """
+        n_row, n_ifo = self.index.shape
+        neighbors, neighbor_offsets = self.neighbors()
+        table = PixelTable.from_columns(
+            n_ifo, neighbors=neighbors, neighbor_offsets=neighbor_offsets, time=self.time, frequency=self.frequency,
+            layers=np.full(n_row, self.layers), rate=np.full(n_row, self.w_rate), likelihood=self.likelihood,
+            phi=np.ones(n_row), core=np.ones(n_row, dtype=bool), index=self.index, asnr=self.asnr,
+            noise_rms=self.noise_rms)
+
+        clusters = []
+        if self.cluster_id is not None and n_row:
+            # group the rows by cluster, the clusters share the arrays of the grouped table
+            members = np.argsort(self.cluster_id, kind='stable')
+            if np.any(members != np.arange(n_row)):
+                table = table.take(members)
+            bounds = np.searchsorted(self.cluster_id[members], np.arange(1, self.n_cluster + 2))
+            for c in range(self.n_cluster):
+                clusters.append(Cluster(pixel_table=table.rows(bounds[c], bounds[c + 1]),
+                                        cluster_meta=ClusterMeta(**{f.name: 0. for f in fields(ClusterMeta)}),
+                                        cluster_status=int(self.cluster_status[c]),
+                                        cluster_rate=[], cluster_time=-1., cluster_freq=-1.,
+                                        sky_area=[], sky_pixel_map=[], sky_pixel_index=[], sky_time_delay=[]))
+
+        return FragmentCluster(rate=self.rate, start=self.start, stop=self.stop, bpp=bpp, shift=shift,
+                               f_low=self.f_low, f_high=self.f_high, n_pix=n_pix, run=run, pair=True,
+                               subnet_threshold=self.subnet_threshold, clusters=clusters)
+
+
+def igamma(r, p):
+    """
+    Inverse of the regularized upper incomplete gamma function on the 1e-5 grid used by iGamma in watfun.hh
+
+    :param r: shape
+    :type r: float
+    :param p: probability
+    :type p: float
+    :return: smallest x on the grid with Q(r, x) <= p
+    :rtype: float
+    """
+    return np.ceil(gammainccinv(r, p) / 1.e-5) * 1.e-5
+
+
+def threshold(maps, edge, bpp, shape=1.):
+    """
+    WaveBurst energy threshold for a black pixel probability, port of threshold() in coherence.cc
+
+    :param maps: energy maps
+    :type maps: EnergyMaps
+    :param edge: segment edge (sec)
+    :type edge: float
+    :param bpp: black pixel probability
+    :type bpp: float
+    :param shape: single detector Gamma distribution shape
+    :type shape: float
+    :return: threshold in units of noise variance
+    :rtype: float
+    """
+    n_ifo = maps.n_ifo
+    w = maps.data.reshape(n_ifo, -1).sum(axis=0)
+    nL = int(edge * maps.w_rate * maps.n_layer)
+    nR = w.size - nL - 1
+    amp = np.minimum(w[nL:nR], n_ifo * 100.)
+    amp = amp[amp > 0.001]
+    avr = amp.mean()
+    alp = np.log(avr) - np.log(amp).mean()
+    alp = (3 - alp + np.sqrt((alp - 3) * (alp - 3) + 24 * alp)) / 12. / alp
+    return float(avr * igamma(alp, bpp * alp / shape) / alp / 2)
+
+
+def select_network_pixels(maps, noise_rms, edge, lag_shift, Eo, veto=None):
+    """
+    Select the core pixels above the threshold for one lag, port of getNetworkPixels() in coherence.cc
+
+    :param maps: energy maps
+    :type maps: EnergyMaps
+    :param noise_rms: noise rms of each detector
+    :type noise_rms: list[NoiseRMSMap]
+    :param edge: segment edge (sec)
+    :type edge: float
+    :param lag_shift: lag shift of each detector (sec)
+    :type lag_shift: list[float]
+    :param Eo: pixel energy threshold
+    :type Eo: float
+    :param veto: veto of the time series samples, 0 - vetoed, by default no veto
+    :type veto: numpy.ndarray, optional
+    :return: selected pixels
+    :rtype: SelectedPixels
+    """
+    jB, jE, NN, start_slices = _lag_layout(maps, edge, lag_shift)
+    nM = int(np.argmin(lag_shift))
+    ib, ie = _band(maps)
+    live = _live_slices(veto, maps.n_slice, maps.rate / maps.w_rate)
+
+    return _to_selected_pixels(maps, noise_rms, *_select_pixels(maps.data, start_slices, nM, jB, jE, NN, ib, ie,
+                                                                Eo, live))
+
+
+class LagBatchSelector:
+    """
+    Pixel selection for all the lags of one resolution from sparse candidate lists.
+
+    A network pixel can only pass the threshold if at least one detector has an energy above Eo / nIFO,
+    so the candidate pixels of each detector are found once with a single scan of the maps. Each lag
+    then only shifts the candidate indices, evaluates the network energy of the shifted candidates and
+    applies the core/halo test on the resulting sparse map, giving the same pixels as
+    :func:`select_network_pixels` at a cost growing with the number of candidates instead of the map size.
+
+    :param maps: energy maps
+    :type maps: EnergyMaps
+    :param noise_rms: noise rms of each detector
+    :type noise_rms: list[NoiseRMSMap]
+    :param edge: segment edge (sec)
+    :type edge: float
+    :param Eo: pixel energy threshold
+    :type Eo: float
+    :param veto: veto of the time series samples, 0 - vetoed, by default no veto
+    :type veto: numpy.ndarray, optional
+    """
+
+    def __init__(self, maps, noise_rms, edge, Eo, veto=None):
+        self.maps = maps
+        self.noise_rms = noise_rms
+        self.edge = edge
+        self.Eo = Eo
+        self.ib, self.ie = _band(maps)
+        self.live = _live_slices(veto, maps.n_slice, maps.rate / maps.w_rate)
+
+        jB = int(edge * maps.w_rate + 0.001)
+        jE = maps.n_slice - jB
+        # single detector bound, slightly lowered to be safe against the rounding of the network sum
+        bound = Eo / maps.n_ifo * (1 - 1.e-12)
+        slices, layers, offsets = [], [], [0]
+        for n in range(maps.n_ifo):
+            s, i = np.nonzero(maps.data[n, jB:jE, self.ib:] >= bound)
+            slices.append(s + jB)
+            layers.append(i + self.ib)
+            offsets.append(offsets[-1] + len(s))
+        self.candidate_slices = np.concatenate(slices).astype(np.int64)
+        self.candidate_layers = np.concatenate(layers).astype(np.int64)
+        self.candidate_offsets = np.array(offsets, dtype=np.int64)
+
+    @property
+    def n_candidates(self):
+        return len(self.candidate_slices)
+
+    def select(self, lag_shift):
+        """
+        Select the core pixels above the threshold for one lag
+
+        :param lag_shift: lag shift of each detector (sec)
+        :type lag_shift: list[float]
+        :return: selected pixels
+        :rtype: SelectedPixels
+        """
+        jB, jE, NN, start_slices = _lag_layout(self.maps, self.edge, lag_shift)
+        nM = int(np.argmin(lag_shift))
+        return _to_selected_pixels(self.maps, self.noise_rms, *_select_pixels_sparse(
+            self.maps.data, self.candidate_slices, self.candidate_layers, self.candidate_offsets, start_slices,
+            nM, jB, jE, NN, self.ib, self.ie, self.Eo, self.live))
+
+
+def cluster_lags(select, lag_shifts, pattern, subrho, subnet, nproc=1, shifts=None, **header):
+    """
+    Select, cluster and convert the pixels of each lag, the lags are processed in threads
+
+    :param select: function returning the selected pixels of a lag from its lag shifts
+    :type select: callable
+    :param lag_shifts: lag shift of each detector (sec) for each lag
+    :type lag_shifts: list[list[float]]
+    :param pattern: clustering pattern, the subrho/subnet selections are applied if not 0
+    :type pattern: int
+    :param subrho: subrho threshold
+    :type subrho: float
+    :param subnet: subnet threshold
+    :type subnet: float
+    :param nproc: number of threads
+    :type nproc: int
+    :param shifts: lag id of each lag (netcluster::shift), by default 0
+    :type shifts: list[float], optional
+    :param header: bpp, n_pix and run of the fragment clusters, see SelectedPixels.to_fragment_cluster
+    :return: fragment cluster of each lag
+    :rtype: list[FragmentCluster]
+    """
+    if shifts is None:
+        shifts = [0.] * len(lag_shifts)
+
+    def _single_lag(lag_shift, shift):
+        # select pixels above Eo
+        pixels = select(lag_shift)
+        if pattern != 0:
+            # cluster pixels
+            pixels.cluster(2, 3)
+            # remove pixels below subrho
+            pixels.select("subrho", subrho)
+            # remove pixels below subnet
+            pixels.select("subnet", subnet)
+            # keep the selected clusters only
+            pixels.compact()
+        else:
+            pixels.cluster(1, 1)
+        return pixels.to_fragment_cluster(shift, **header)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(nproc, len(lag_shifts)))) as executor:
+        return list(executor.map(_single_lag, lag_shifts, shifts))
+
+
+def select_network_lags(config, net, nRMS_list, Eo, lags, nproc=1):
+    """
+    Lag-batched replacement of the network::getNetworkPixels and network::cluster loop over the lags,
+    the max energy maps and the veto are taken from the network
+
+    :param config: configuration object
+    :type config: Config
+    :param net: network with the max energy maps and the veto set
+    :type net: Network
+    :param nRMS_list: noise rms of each detector
+    :type nRMS_list: list[TimeFrequencySeries]
+    :param Eo: pixel energy threshold
+    :type Eo: float
+    :param lags: lag indices
+    :type lags: list[int]
+    :param nproc: number of threads
+    :type nproc: int
+    :return: fragment cluster of each lag
+    :rtype: list[FragmentCluster]
+    """
+    maps = EnergyMaps.from_wseries([net.get_ifo(n).getTFmap() for n in range(config.nIFO)])
+    noise_rms = [NoiseRMSMap.from_tf_series(nRMS) for nRMS in nRMS_list]
+    selector = LagBatchSelector(maps, noise_rms, config.segEdge, Eo, network_veto(net))
+    logger.debug("lag batch selection: %d candidates in %d pixels", selector.n_candidates, maps.data.size)
+    lag_shifts = [[net.get_ifo(n).lagShift.data[j] for n in range(config.nIFO)] for j in lags]
+    # lag ids of the netclusters of network::getNetworkPixels, nPIX and run keep the netcluster defaults
+    shifts = [float(net.get_cluster(j).shift) for j in lags]
+    return cluster_lags(selector.select, lag_shifts, net.pattern, config.select_subrho, config.select_subnet, nproc,
+                        shifts=shifts, bpp=config.bpp)
+
+
+def network_veto(net):
+    """
+    numpy copy of the veto array set by network::setVeto
+
+    :param net: network
+    :type net: Network
+    :return: veto of the time series samples, 0 - vetoed
+    :rtype: numpy.ndarray
+    """
+    veto = net.net.veto
+    if veto.size() == 0:
+        return None
+    veto.data.reshape((veto.size(),))
+    return np.frombuffer(veto.data, dtype=np.int16, count=veto.size()).copy()
+
+
+def _to_selected_pixels(maps, noise_rms, count, time, frequency, likelihood, index, asnr):
+    pixels = SelectedPixels(time=time, frequency=frequency, likelihood=likelihood, index=index, asnr=asnr,
+                            noise_rms=np.zeros_like(asnr), rate=maps.rate, w_rate=maps.w_rate, layers=maps.n_layer,
+                            start=maps.start, stop=maps.stop, f_low=maps.f_low, f_high=maps.f_high,
+                            livetime=count / maps.w_rate)
+    if len(pixels):
+        for n, rms in enumerate(noise_rms):
+            set_noise_rms(pixels, rms, n)
+    return pixels
+
+
+def set_noise_rms(pixels, noise_rms, n):
+    """
+    Set the noise rms of detector n for the selected pixels, port of setrms() in coherence.cc
+
+    :param pixels: selected pixels
+    :type pixels: SelectedPixels
+    :param noise_rms: noise rms of the detector
+    :type noise_rms: NoiseRMSMap
+    :param n: detector index
+    :type n: int
+    """
+    max_layer = noise_rms.data.shape[1] - 1
+    dF = noise_rms.rate / max_layer / 2.
+    status = _set_rms(pixels.noise_rms[:, n], pixels.index[:, n], pixels.frequency, pixels.w_rate, pixels.layers,
+                      pixels.start, noise_rms.data, noise_rms.start, noise_rms.w_rate, dF)
+    if status >= 0:
+        raise ValueError(f"setrms: invalid input for pixel {status} of detector {n}")
+
+
+def _lag_layout(maps, edge, lag_shift):
+    """
+    edge samples, last good sample, number of good samples and first slice of each detector
+    """
+    R = maps.w_rate
+    jB = int(edge * R + 0.001)
+    if jB & 1:
+        raise ValueError("getNetworkPixels: WDM parity violation")
+    if jB < 3:
+        raise ValueError("getNetworkPixels: insufficient data edge length")
+    jE = maps.n_slice - jB
+    if jE & 1:
+        raise ValueError("getNetworkPixels: WDM parity violation")
+    a = min(lag_shift)
+    shifts = [int((b - a) * R + 0.001) for b in lag_shift]
+    if any(K & 1 for K in shifts):
+        raise ValueError("getNetworkPixels: WDM parity violation")
+    return jB, jE, jE - jB, np.array([K + jB for K in shifts], dtype=np.int64)
+
+
+def _band(maps):
+    I = maps.n_layer
+    ib, ie = 1, I
+    for i in range(I):
+        if maps.frequency(i) <= maps.f_high:
+            ie = i
+        if maps.frequency(i) <= maps.f_low:
+            ib = i + 1
+    return max(ib, 1), min(ie, I - 1)
+
+
+def _live_slices(veto, n_slice, ratio):
+    """
+    live flag of each TF slice, a slice is vetoed if any of its time series samples is vetoed
+    """
+    live = np.ones(n_slice, dtype=np.bool_)
+    if veto is None:
+        return live
+    veto = np.asarray(veto)
+    for s in range(n_slice):
+        jb, je = int(s * ratio + 0.01), int((s + 1) * ratio + 0.01)
+        if jb < je and not veto[jb:je].all():
+            live[s] = False
+    return live
+
+
+@njit(nogil=True, cache=True)
+def _energy_map(data, start_slices, jB, jE, NN, ib, Eo, live):
+    """
+    network energy of the shifted maps, sub-threshold pixels are zeroed and loud pixels degraded
+    """
+    n_ifo, n_slice, I = data.shape
+    Em = 2 * Eo
+    energy = np.zeros((n_slice, I))
+    count = 0
+    for jj in range(NN):
+        row = jj + jB
+        veto = 1.
+        for n in range(n_ifo):
+            s = start_slices[n] + jj
+            if s >= jE:
+                s -= NN
+            if not live[s]:
+                veto = 0.
+            for i in range(I):
+                energy[row, i] += data[n, s, i]
+        for i in range(I):
+            v = energy[row, i] * veto
+            if v < Eo or i < ib:
+                v = 0.
+            if v > Em:
+                v = Em + 0.1
+            energy[row, i] = v
+        count += int(veto)
+    return energy, count
+
+
+@njit(nogil=True, cache=True)
+def _is_core(energy, row, i, I, Eo):
+    Em = 2 * Eo
+    Eh = Em * Em
+    E = energy[row, i]
+    if E < Eo:
+        return False
+    Ct = energy[row, i + 1] + energy[row + 1, i] + energy[row + 1, i + 1]
+    Cb = energy[row, i - 1] + energy[row - 1, i] + energy[row - 1, i - 1]
+    Ht = energy[row + 2, i + 1]
+    if i < I - 2:
+        Ht += energy[row + 2, i + 2] + energy[row + 1, i + 2]
+    Hb = energy[row - 2, i - 1]
+    if i > 1:
+        Hb += energy[row - 2, i - 2] + energy[row - 1, i - 2]
+    return not ((Ct + Cb) * E < Eh and (Ct + Ht) * E < Eh and (Cb + Hb) * E < Eh and E < Em)
+
+
+@njit(nogil=True, cache=True)
+def _select_pixels(data, start_slices, nM, jB, jE, NN, ib, ie, Eo, live):
+    n_ifo, n_slice, I = data.shape
+    energy, count = _energy_map(data, start_slices, jB, jE, NN, ib, Eo, live)
+
+    n_pix = 0
+    for jj in range(NN):
+        for i in range(ib, ie):
+            if _is_core(energy, jj + jB, i, I, Eo):
+                n_pix += 1
+
+    time = np.empty(n_pix, dtype=np.int64)
+    frequency = np.empty(n_pix, dtype=np.int64)
+    likelihood = np.empty(n_pix)
+    index = np.empty((n_pix, n_ifo), dtype=np.int64)
+    asnr = np.empty((n_pix, n_ifo))
+    slices = np.empty(n_ifo, dtype=np.int64)
+
+    k = 0
+    for jj in range(NN):
+        for n in range(n_ifo):
+            s = start_slices[n] + jj
+            slices[n] = s - NN if s >= jE else s
+        for i in range(ib, ie):
+            if not _is_core(energy, jj + jB, i, I, Eo):
+                continue
+            E = 0.
+            for n in range(n_ifo):
+                x = data[n, slices[n], i]
+                index[k, n] = slices[n] * I + i
+                asnr[k, n] = np.sqrt(x)
+                E += x
+            time[k] = slices[nM] * I + i
+            frequency[k] = i
+            likelihood[k] = E
+            k += 1
+    return count, time, frequency, likelihood, index, asnr
+
+
+@njit(nogil=True, cache=True)
+def _sparse_energy(keys, values, jj, i, NN, I):
+    """
+    value of the sparse energy map at (jj, i), zero outside the good samples or if not stored
+    """
+    if jj < 0 or jj >= NN:
+        return 0.
+    key = jj * I + i
+    k = np.searchsorted(keys, key)
+    if k < len(keys) and keys[k] == key:
+        return values[k]
+    return 0.
+
+
+@njit(nogil=True, cache=True)
+def _select_pixels_sparse(data, cand_s, cand_i, offsets, start_slices, nM, jB, jE, NN, ib, ie, Eo, live):
+    n_ifo, n_slice, I = data.shape
+    Em = 2 * Eo
+    Eh = Em * Em
+
+    # live time of the lag
+    count = 0
+    for jj in range(NN):
+        veto = 1
+        for n in range(n_ifo):
+            s = start_slices[n] + jj
+            if s >= jE:
+                s -= NN
+            if not live[s]:
+                veto = 0
+        count += veto
+
+    # time stamp of the shifted candidates, inverse of the circular shift
+    keys = np.empty(offsets[-1], dtype=np.int64)
+    for n in range(n_ifo):
+        for k in range(offsets[n], offsets[n + 1]):
+            jj = cand_s[k] - start_slices[n]
+            if jj < 0:
+                jj += NN
+            keys[k] = jj * I + cand_i[k]
+    keys = np.unique(keys)
+
+    # sparse network energy map, sub-threshold pixels are dropped and loud pixels degraded
+    values = np.empty(len(keys))
+    slices = np.empty(n_ifo, dtype=np.int64)
+    n_stored = 0
+    for k in range(len(keys)):
+        jj = keys[k] // I
+        i = keys[k] % I
+        veto = 1.
+        E = 0.
+        for n in range(n_ifo):
+            s = start_slices[n] + jj
+            if s >= jE:
+                s -= NN
+            if not live[s]:
+                veto = 0.
+            E += data[n, s, i]
+        E *= veto
+        if E < Eo or i < ib:
+            continue
+        if E > Em:
+            E = Em + 0.1
+        keys[n_stored] = keys[k]
+        values[n_stored] = E
+        n_stored += 1
+    keys = keys[:n_stored]
+    values = values[:n_stored]
+
+    # core/halo test on the sparse map
+    selected = np.zeros(n_stored, dtype=np.bool_)
+    for k in range(n_stored):
+        jj = keys[k] // I
+        i = keys[k] % I
+        if i >= ie:
+            continue
+        E = values[k]
+        Ct = _sparse_energy(keys, values, jj, i + 1, NN, I) + _sparse_energy(keys, values, jj + 1, i, NN, I) + \
+            _sparse_energy(keys, values, jj + 1, i + 1, NN, I)
+        Cb = _sparse_energy(keys, values, jj, i - 1, NN, I) + _sparse_energy(keys, values, jj - 1, i, NN, I) + \
+            _sparse_energy(keys, values, jj - 1, i - 1, NN, I)
+        Ht = _sparse_energy(keys, values, jj + 2, i + 1, NN, I)
+        if i < I - 2:
+            Ht += _sparse_energy(keys, values, jj + 2, i + 2, NN, I) + _sparse_energy(keys, values, jj + 1, i + 2, NN, I)
+        Hb = _sparse_energy(keys, values, jj - 2, i - 1, NN, I)
+        if i > 1:
+            Hb += _sparse_energy(keys, values, jj - 2, i - 2, NN, I) + _sparse_energy(keys, values, jj - 1, i - 2, NN, I)
+        selected[k] = not ((Ct + Cb) * E < Eh and (Ct + Ht) * E < Eh and (Cb + Hb) * E < Eh and E < Em)
+
+    n_pix = int(selected.sum())
+    time = np.empty(n_pix, dtype=np.int64)
+    frequency = np.empty(n_pix, dtype=np.int64)
+    likelihood = np.empty(n_pix)
+    index = np.empty((n_pix, n_ifo), dtype=np.int64)
+    asnr = np.empty((n_pix, n_ifo))
+
+    p = 0
+    for k in range(n_stored):
+        if not selected[k]:
+            continue
+        jj = keys[k] // I
+        i = keys[k] % I
+        E = 0.
+        for n in range(n_ifo):
+            s = start_slices[n] + jj
+            if s >= jE:
+                s -= NN
+            x = data[n, s, i]
+            index[p, n] = s * I + i
+            asnr[p, n] = np.sqrt(x)
+            E += x
+            slices[n] = s
+        time[p] = slices[nM] * I + i
+        frequency[p] = i
+        likelihood[p] = E
+        p += 1
+    return count, time, frequency, likelihood, index, asnr
+
+
+@njit(nogil=True, cache=True)
+def _set_rms(out, index, frequency, rate, layers, start, rms, To, Ro, dF):
+    """
+    fill out with the noise rms of the pixels, return the first invalid pixel or -1
+    """
+    K, L = rms.shape
+    max_layer = L - 1
+    for p in range(len(out)):
+        if frequency[p] > max_layer or frequency[p] == 0 or int(rate / Ro + 0.01) < 1:
+            return p
+        x = frequency[p] - 0.5
+        f = x * rate / 2.
+        n = int(f / dF + 0.6)
+        F = (x + 1) * rate / 2.
+        m = int(F / dF + 0.6)
+        if m > max_layer:
+            m = max_layer + 1
+        t = index[p] / rate / layers + start
+        k = int((t - To) * Ro)
+        if k >= K and k != 0:
+            k -= 1
+        if k < 0 or n >= m or k >= K:
+            return p
+        r = 0.
+        for j in range(n, m):
+            r += 1. / rms[k, j] / rms[k, j]
+        out[p] = np.sqrt((m - n) / r)
+    return -1
+
+
+@njit(nogil=True, cache=True)
+def neighbour_pairs(slices, frequency, kt, kf):
+    """
+    pairs of time sorted pixels closer than kt slices and kf layers
+
+    :return: pairs (i, j) with i < j, shape (n_pair, 2)
+    """
+    n = len(slices)
+    n_pair = 0
+    for i in range(n):
+        for j in range(i + 1, n):
+            if slices[j] - slices[i] > kt:
+                break
+            if abs(frequency[j] - frequency[i]) <= kf:
+                n_pair += 1
+    pairs = np.empty((n_pair, 2), dtype=np.int64)
+    k = 0
+    for i in range(n):
+        for j in range(i + 1, n):
+            if slices[j] - slices[i] > kt:
+                break
+            if abs(frequency[j] - frequency[i]) <= kf:
+                pairs[k, 0] = i
+                pairs[k, 1] = j
+                k += 1
+    return pairs
+
+
+@njit(nogil=True, cache=True)
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@njit(nogil=True, cache=True)
+def connected_components(n, pairs):
+    """
+    union-find over the neighbour pairs, the 1-based cluster IDs follow the order of the first pixel of each cluster
+    """
+    parent = np.arange(n)
+    for k in range(pairs.shape[0]):
+        a = _find(parent, pairs[k, 0])
+        b = _find(parent, pairs[k, 1])
+        if a != b:
+            if a < b:
+                parent[b] = a
+            else:
+                parent[a] = b
+    labels = np.zeros(n, dtype=np.int64)
+    root_id = np.zeros(n, dtype=np.int64)
+    n_cluster = 0
+    for i in range(n):
+        r = _find(parent, i)
+        if root_id[r] == 0:
+            n_cluster += 1
+            root_id[r] = n_cluster
+        labels[i] = root_id[r]
+    return labels
+
+
+@njit(nogil=True, cache=True)
+def subnetwork_statistics(cluster_id, cluster_status, asnr, noise_rms, nSUB):
+    """
+    subrho and subnet statistics of each cluster, port of netcluster::get('subrho'/'subnet', 0, 'S')
+    """
+    n_cluster = len(cluster_status)
+    rho = np.zeros(n_cluster)
+    esub = np.zeros(n_cluster)
+    emax = np.zeros(n_cluster)
+    total = np.zeros(n_cluster)
+    msd = np.zeros(n_cluster)
+    n_ifo = asnr.shape[1]
+    for p in range(len(cluster_id)):
+        c = cluster_id[p] - 1
+        if cluster_status[c] > 0:
+            continue
+        a = E = e = nsd = 0.
+        for n in range(n_ifo):
+            a += abs(asnr[p, n])
+            x = asnr[p, n] * asnr[p, n]
+            v = noise_rms[p, n] * noise_rms[p, n]
+            if x > E:
+                E = x
+                msd[c] = v
+            e += x
+            nsd += 1 / v if v > 0 else 0.
+        a = e / (a * a) if a > 0 else 1.
+        rho[c] += (1 - a) * (e - nSUB * 2)
+        y = e - E
+        x = y * (1 + y / (E + 1.e-5))
+        nsd -= 1. / msd[c] if msd[c] > 0 else 0.
+        v = (2 * E - e) * msd[c] * nsd / 10.
+        esub[c] += e - E
+        emax[c] += E
+        a = x / (x + nSUB)
+        total[c] += (e * x / (x + (v if v > 0 else 1.e-5))) * (a if a > 0.5 else 0.)
+    return np.sqrt(rho), total / (emax + esub + 0.01)
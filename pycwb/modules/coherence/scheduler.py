@@ -0,0 +1,311 @@
+import atexit
+import logging
+import math
+import pickle
+import time
+import uuid
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import ROOT
+
+from pycwb.types.network import Network
+from pycwb.modules.cwb_conversions import convert_to_wavearray, convert_netcluster_to_fragment_clusters
+from pycwb.modules.multi_resolution_wdm import create_wdm_for_level, forward_transform
+from .max_energy import max_energy_maps, wdm_as_array
+from .pixel_selection import select_network_lags
+
+logger = logging.getLogger(__name__)
+
+# state of the current segment in a worker process, rebuilt only when the segment token changes
+_worker_segment = {
+    'token': None,
+    'config': None,
+    'tf_maps': None,
+    'nRMS_list': None,
+    'net': None,
+    'level': None,
+}
+
+# scheduler shared by the segments analysed in this process
+_scheduler = None
+
+
+class CoherenceScheduler:
+    """
+    Coherence scheduler splitting the work of a segment into (resolution, lag chunk) units.
+
+    The work is done in two phases on a persistent process pool:
+
+    1. the max over the sky energy maps are computed for each (resolution, detector) unit
+       (WSeries<double>::maxEnergy), the maps are collected in a shared memory block. With a TF map cache
+       the units also compute the forward transforms of the cache, which are loaded in the main process
+    2. the pixels are selected and clustered for each (resolution, lag chunk) unit
+       (network::THRESHOLD, network::getNetworkPixels, network::cluster)
+
+    The segment state (config, TF maps and noise RMS) is pickled once into shared memory instead of
+    being sent with every task, each worker unpickles it and creates its Network once per segment.
+    The pool is kept alive between segments analysed in the same process, call :meth:`close` when done.
+
+    :param nproc: number of worker processes
+    :type nproc: int
+    """
+
+    def __init__(self, nproc):
+        self.nproc = nproc
+        self._pool = None
+
+    @property
+    def pool(self):
+        """
+        worker pool, created on first use
+        """
+        if self._pool is None:
+            self._pool = Pool(processes=self.nproc)
+        return self._pool
+
+    def close(self):
+        """
+        Shut down the worker pool
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def run(self, config, tf_maps, nRMS_list, up_n, tf_map_cache=None):
+        """
+        Run coherence for a segment
+
+        :param config: configuration object
+        :type config: Config
+        :param tf_maps: list of time-frequency maps
+        :type tf_maps: list[TimeFrequencySeries]
+        :param nRMS_list: list of noise RMS
+        :type nRMS_list: list[TimeFrequencySeries]
+        :param up_n: upsample factor
+        :type up_n: int
+        :param tf_map_cache: cache of forward transformed maps, filled by the phase 1 units
+        :type tf_map_cache: TFMapCache, optional
+        :return: fragment clusters ordered by resolution then lag
+        :rtype: list[FragmentCluster]
+        """
+        token = uuid.uuid4().hex
+        state = _to_shared_memory(pickle.dumps((config, tf_maps, nRMS_list)))
+        planes = None
+        try:
+            # phase 1: max energy maps, one unit for each (resolution, detector)
+            timer_start = time.perf_counter()
+            units = [(token, state.name, i, n, up_n, tf_map_cache is not None)
+                     for i in range(config.nRES) for n in range(config.nIFO)]
+            results = self.pool.map(_max_energy_unit, units, chunksize=1)
+            logger.info("Max energy maps for %d units: %.2f s", len(units), time.perf_counter() - timer_start)
+
+            if tf_map_cache is not None:
+                for (_, _, i, n, _, _), r in zip(units, results):
+                    tf_map_cache.load(tf_maps, n, config.WDM_level[i], r[3])
+
+            n_lag = results[0][2]
+            alp = [sum(results[i * config.nIFO + n][1] for n in range(config.nIFO)) for i in range(config.nRES)]
+
+            # collect the maps in a single block, the layout is (offset, size) for each (resolution, detector)
+            sizes = [len(r[0]) for r in results]
+            offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(int)
+            planes = SharedMemory(create=True, size=max(8, 8 * int(sum(sizes))))
+            view = np.ndarray((sum(sizes),), dtype=np.float64, buffer=planes.buf)
+            for r, offset, size in zip(results, offsets, sizes):
+                view[offset:offset + size] = r[0]
+            del view, results
+            layout = [[(int(offsets[i * config.nIFO + n]), sizes[i * config.nIFO + n]) for n in range(config.nIFO)]
+                      for i in range(config.nRES)]
+
+            # phase 2: pixel selection and clustering, one unit for each (resolution, lag chunk)
+            timer_start = time.perf_counter()
+            lag_chunks = _split_lags(n_lag, config.nRES, self.nproc)
+            units = [(token, state.name, planes.name, layout[i], i, alp[i], lags)
+                     for i in range(config.nRES) for lags in lag_chunks]
+            results = self.pool.map(_lag_chunk_unit, units, chunksize=1)
+            logger.info("Pixel selection for %d units: %.2f s", len(units), time.perf_counter() - timer_start)
+        finally:
+            for shm in (state, planes):
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+
+        # merge the results in (resolution, lag) order, the units are returned in submission order
+        fragment_clusters = []
+        for i in range(config.nRES):
+            chunks = [r for r in results if r[0] == i]
+            Eo, TL = chunks[0][1], chunks[0][2]
+
+            level = config.l_high - i
+            layers = 2 ** level if level > 0 else 0
+            rate = config.rateANA // 2 ** level
+            logger_info = "level : %d\t rate(hz) : %d\t layers : %d\t df(hz) : %f\t dt(ms) : %f \n" % (
+                level, rate, layers, config.rateANA / 2. / (2 ** level), 1000. / rate)
+            logger_info += "max energy in units of noise variance: %g \n" % alp[i]
+            logger_info += "thresholds in units of noise variance: Eo=%g Emax=%g \n" % (Eo, Eo * 2)
+            logger_info += "live time in zero lag: %g \n" % TL
+            logger_info += "lag | clusters | pixels \n"
+            for _, _, _, chunk in chunks:
+                for j, fragment_cluster in chunk:
+                    fragment_clusters.append(fragment_cluster)
+                    logger_info += "%3d |%9d |%7d \n" % (j, fragment_cluster.event_count(),
+                                                         fragment_cluster.pixel_count())
+            logger.info(logger_info)
+
+        return fragment_clusters
+
+
+def get_coherence_scheduler(nproc):
+    """
+    Get the coherence scheduler of this process, the workers are reused by the following segments
+
+    :param nproc: number of worker processes
+    :type nproc: int
+    :return: coherence scheduler
+    :rtype: CoherenceScheduler
+    """
+    global _scheduler
+    if _scheduler is None or _scheduler.nproc != nproc:
+        if _scheduler is not None:
+            _scheduler.close()
+        _scheduler = CoherenceScheduler(nproc)
+        atexit.register(_scheduler.close)
+    return _scheduler
+
+
+def _to_shared_memory(blob):
+    shm = SharedMemory(create=True, size=max(1, len(blob)))
+    shm.buf[:len(blob)] = blob
+    return shm
+
+
+def _split_lags(n_lag, n_res, nproc):
+    """
+    split the lags in contiguous chunks so that n_res * n_chunks covers the workers
+
+    :param n_lag: number of lags
+    :type n_lag: int
+    :param n_res: number of resolutions
+    :type n_res: int
+    :param nproc: number of workers
+    :type nproc: int
+    :return: lag chunks
+    :rtype: list[range]
+    """
+    n_chunk = min(n_lag, max(1, math.ceil(nproc / n_res)))
+    chunk_size = math.ceil(n_lag / n_chunk)
+    return [range(start, min(start + chunk_size, n_lag)) for start in range(0, n_lag, chunk_size)]
+
+
+def _segment_state(token, state_name):
+    """
+    load the segment state in the worker, only once per segment
+    """
+    if _worker_segment['token'] != token:
+        shm = SharedMemory(name=state_name)
+        try:
+            config, tf_maps, nRMS_list = pickle.loads(bytes(shm.buf))
+        finally:
+            shm.close()
+        _worker_segment.update(token=token, config=config, tf_maps=tf_maps, nRMS_list=nRMS_list,
+                               net=Network(config, tf_maps, nRMS_list, silent=True), level=None)
+    return _worker_segment
+
+
+def _max_energy_unit(args):
+    """
+    compute the max over the sky energy map for one (resolution, detector), and the forward transform of the
+    TF map cache if requested
+
+    :return: (energy map, alp, number of lags, forward transform or None)
+    :rtype: (numpy.ndarray, float, int, numpy.ndarray)
+    """
+    token, state_name, i, n, up_n, transform = args
+    segment = _segment_state(token, state_name)
+    config, tf_maps = segment['config'], segment['tf_maps']
+
+    ws = None
+    zero_delay_maps = None
+    if transform:
+        ws = forward_transform(config, tf_maps[n], config.WDM_level[i])
+        if config.max_energy_backend == 'numba' and config.pattern != 0:
+            # the numba max energy reuses the transform as its zero delay map
+            zero_delay_maps = [wdm_as_array(ws.wavelet)]
+
+    wdm = create_wdm_for_level(config, config.WDM_level[i])
+    tf_map = ROOT.WSeries(np.double)()
+    # the band limits of the detector TF map are used for the wave packets
+    tf_map.setlow(config.fLow)
+    alp, = max_energy_maps(config, tf_maps, wdm, [tf_map], up_n, ifo_ids=[n], zero_delay_maps=zero_delay_maps)
+
+    data = None
+    if ws is not None:
+        data = wdm_as_array(ws.wavelet).copy()
+        ws.wavelet.free()
+    return np.array(ROOT.pycwb_get_wseries_data(tf_map)), alp, int(segment['net'].nLag), data
+
+
+def _lag_chunk_unit(args):
+    """
+    select and cluster the pixels for one (resolution, lag chunk)
+
+    :return: (resolution index, threshold Eo, live time, [(lag, fragment cluster), ...])
+    :rtype: (int, float, float, list)
+    """
+    token, state_name, planes_name, layout, i, alp, lags = args
+    segment = _segment_state(token, state_name)
+    config, tf_maps, net = segment['config'], segment['tf_maps'], segment['net']
+    level = config.WDM_level[i]
+
+    # the power map transform sets the wavelet and the layout of the TF maps, then the
+    # max energy maps computed in phase 1 are copied in
+    if segment['level'] != level:
+        wdm = create_wdm_for_level(config, level)
+        planes = SharedMemory(name=planes_name)
+        try:
+            for n, (offset, size) in enumerate(layout):
+                plane = np.ndarray((size,), dtype=np.float64, buffer=planes.buf, offset=8 * offset).copy()
+                ts = convert_to_wavearray(tf_maps[n])
+                ts.Edge = config.segEdge
+                tf_map = net.get_ifo(n).getTFmap()
+                tf_map.Forward(ts, wdm.wavelet, 0)
+                if tf_map.size() != size:
+                    raise ValueError(f"max energy map size mismatch: {tf_map.size()} != {size}")
+                ROOT.pycwb_copy_to_wavearray(plane, tf_map, size)
+                tf_map.setlow(config.fLow)
+                tf_map.sethigh(config.fHigh)
+        finally:
+            planes.close()
+        segment['level'] = level
+
+    alp = alp / config.nIFO
+    Eo = net.threshold(config.bpp, alp) if net.pattern != 0 else net.threshold(config.bpp)
+    TL = net.set_veto(config.iwindow)
+    if TL <= 0.:
+        raise ValueError("live time is zero")
+
+    if config.lag_batch_selection:
+        # the candidate pixels are found once for the chunk, each lag only shifts them
+        return i, Eo, TL, list(zip(lags, select_network_lags(config, net, segment['nRMS_list'], Eo, lags)))
+
+    results = []
+    wc = ROOT.netcluster()
+    for j in lags:
+        net.get_network_pixels(j, Eo)
+        pwc = net.get_cluster(j)
+        if net.pattern != 0:
+            net.cluster(j, 2, 3)
+            wc.cpf(pwc, False)
+            wc.select("subrho", config.select_subrho)
+            wc.select("subnet", config.select_subnet)
+            pwc.cpf(wc, False)
+        else:
+            net.cluster(j, 1, 1)
+
+        results.append((j, convert_netcluster_to_fragment_clusters(pwc)))
+        pwc.clear()
+
+    return i, Eo, TL, results
@@ -1,14 +1,29 @@
 import ROOT
-from .pixel import convert_pixel_to_netpixel, convert_netpixel_to_pixel
+import numpy as np
+from .pixel import convert_netpixels_to_pixel_table
 from pycwb.types.network_cluster import FragmentCluster, Cluster, ClusterMeta
+from pycwb.types.network_pixel import PixelTable
+
+# column blocks of pycwb_export_netcluster / pycwb_import_netcluster (cwb-core/pycwb.hh), the order must match
+_PIXEL_FLOAT_FIELDS = ('rate', 'likelihood', 'null', 'theta', 'phi', 'ellipticity', 'polarisation')
+_IFO_FLOAT_FIELDS = ('noise_rms', 'wave', 'w_90', 'asnr', 'a_90')
+_CDATA_FIELDS = ('energy', 'energy_sky', 'like_net', 'net_ecor', 'norm_cor', 'net_null', 'net_ed', 'g_noise',
+                 'like_sky', 'sky_cc', 'net_cc', 'sky_chi2', 'sub_net', 'sub_net2', 'sky_stat', 'net_rho', 'net_rho2',
+                 'theta', 'phi', 'iota', 'psi', 'ellipticity', 'c_time', 'c_freq', 'g_net', 'a_net', 'i_net',
+                 'norm', 'ndof', 'sky_size', 'sky_index')
+
+
+def _c_array(values, dtype):
+    return np.ascontiguousarray(values, dtype=dtype)
 
 
 def convert_fragment_clusters_to_netcluster(fragment_clusters):
     """
-    Convert cluster to netcluster
+    Convert fragment clusters to netcluster, the pixels and the cluster data are copied in bulk
+    by pycwb_import_netcluster
 
-    :param cluster: cluster
-    :type cluster: Cluster
+    :param fragment_clusters: fragment clusters
+    :type fragment_clusters: FragmentCluster
     :return: netcluster
     :rtype: ROOT.netcluster
     """
@@ -27,26 +42,26 @@ def convert_fragment_clusters_to_netcluster(fragment_clusters):
     netcluster.nSUB = fragment_clusters.subnet_threshold
 
     clusters = fragment_clusters.clusters
-    # derive cList
-    i = 0
-    for cluster in clusters:
-        n = len(cluster.pixels)
-        netcluster.cList.push_back(list(range(i, i + n)))
-        i += n
-
-    # add pixels
-    netcluster.pList = [
-        convert_pixel_to_netpixel(pixel, c_index + 1)
-        for c_index, cluster in enumerate(clusters)
-        for pixel in cluster.pixels
-    ]
-
-    # add others
-    netcluster.cData = [convert_cluster_meta_to_cData(cluster.cluster_meta)
-                        for cluster in clusters]
-    netcluster.sCuts = [cluster.cluster_status for cluster in clusters]
-    netcluster.cTime = [cluster.cluster_time for cluster in clusters]
-    netcluster.cFreq = [cluster.cluster_freq for cluster in clusters]
+    table = fragment_clusters.pixel_table()
+    n_pix, n_ifo = len(table), table.n_ifo
+    pixel_int = np.ascontiguousarray([table.time, table.frequency, table.layers], dtype=np.int64)
+    pixel_float = np.ascontiguousarray([getattr(table, name) for name in _PIXEL_FLOAT_FIELDS], dtype=np.float64)
+    ifo_float = np.ascontiguousarray([getattr(table, name) for name in _IFO_FLOAT_FIELDS],
+                                     dtype=np.float64).reshape(len(_IFO_FLOAT_FIELDS), n_pix, n_ifo)
+    c_data = np.array([[getattr(c.cluster_meta, name) for name in _CDATA_FIELDS] for c in clusters],
+                      dtype=np.float64).reshape(len(clusters), len(_CDATA_FIELDS))
+
+    ROOT.pycwb_import_netcluster(
+        netcluster, n_pix, n_ifo, len(clusters), _c_array(table.cluster_offsets, np.int64),
+        pixel_int, pixel_float, _c_array(table.core, np.uint8),
+        ifo_float, _c_array(table.rank, np.float32), _c_array(table.index, np.int64),
+        _c_array(table.td_amp, np.float32), _c_array(table.td_offsets - table.td_offsets[0], np.int64),
+        _c_array(table.neighbors, np.int64), _c_array(table.neighbor_offsets - table.neighbor_offsets[0], np.int64),
+        _c_array([c.cluster_status for c in clusters], np.int32),
+        _c_array([c.cluster_time for c in clusters], np.float32),
+        _c_array([c.cluster_freq for c in clusters], np.float32), c_data)
+
+    # the per cluster ragged vectors are short, they are copied through pyROOT
     for cluster in clusters:
         netcluster.cRate.push_back(cluster.cluster_rate)
         netcluster.sArea.push_back(cluster.sky_area)
@@ -104,40 +119,73 @@ def convert_cluster_meta_to_cData(cluster_meta):
 
 
 def convert_netcluster_to_fragment_clusters(netcluster):
+    """
+    Convert netcluster to fragment clusters, the pixels and the cluster data are exported in bulk
+    by pycwb_export_netcluster into a single pixel table shared by the clusters
+
+    :param netcluster: netcluster
+    :type netcluster: ROOT.netcluster
+    :return: fragment clusters
+    :rtype: FragmentCluster
+    """
+    n_pix, n_ifo, n_cluster, n_td, n_neighbor = [int(n) for n in ROOT.pycwb_netcluster_layout(netcluster)]
+
+    cluster_offsets = np.zeros(n_cluster + 1, dtype=np.int64)
+    pixel_int = np.zeros((3, n_pix), dtype=np.int64)
+    pixel_float = np.zeros((len(_PIXEL_FLOAT_FIELDS), n_pix), dtype=np.float64)
+    core = np.zeros(n_pix, dtype=np.uint8)
+    ifo_float = np.zeros((len(_IFO_FLOAT_FIELDS), n_pix, n_ifo), dtype=np.float64)
+    rank = np.zeros((n_pix, n_ifo), dtype=np.float32)
+    index = np.zeros((n_pix, n_ifo), dtype=np.int64)
+    td_amp = np.zeros(n_td, dtype=np.float32)
+    td_offsets = np.zeros(n_pix * n_ifo + 1, dtype=np.int64)
+    neighbors = np.zeros(n_neighbor, dtype=np.int64)
+    neighbor_offsets = np.zeros(n_pix + 1, dtype=np.int64)
+    cluster_status = np.zeros(n_cluster, dtype=np.int32)
+    cluster_time = np.zeros(n_cluster, dtype=np.float32)
+    cluster_freq = np.zeros(n_cluster, dtype=np.float32)
+    c_data = np.zeros((n_cluster, len(_CDATA_FIELDS)), dtype=np.float64)
+
+    if n_cluster:
+        ROOT.pycwb_export_netcluster(netcluster, cluster_offsets, pixel_int, pixel_float, core, ifo_float, rank,
+                                     index, td_amp, td_offsets, neighbors, neighbor_offsets, cluster_status,
+                                     cluster_time, cluster_freq, c_data)
+
+    columns = dict(zip(('time', 'frequency', 'layers'), pixel_int))
+    columns.update(zip(_PIXEL_FLOAT_FIELDS, pixel_float))
+    columns.update(zip(_IFO_FLOAT_FIELDS, ifo_float))
+    table = PixelTable(**columns, core=core.view(np.bool_), rank=rank, index=index,
+                       td_amp=td_amp, td_offsets=td_offsets, neighbors=neighbors,
+                       neighbor_offsets=neighbor_offsets, cluster_offsets=cluster_offsets)
+
     cluster_list = []
-    for c_id, pixel_ids in enumerate(netcluster.cList):
-        cluster = convert_netcluster_to_cluster(netcluster, c_id)
-        cluster_list.append(cluster)
-
-    fragment_cluster = FragmentCluster(rate=netcluster.rate,
-                                        start=netcluster.start,
-                                        stop=netcluster.stop,
-                                        bpp=netcluster.bpp,
-                                        shift=netcluster.shift,
-                                        f_low=netcluster.flow,
-                                        f_high=netcluster.fhigh,
-                                        n_pix=netcluster.nPIX,
-                                        run=netcluster.run,
-                                        pair=netcluster.pair,
-                                        subnet_threshold=netcluster.nSUB,
-                                        clusters=cluster_list)
-    #
-    # fragment_cluster.rate = netcluster.rate
-    # fragment_cluster.start = netcluster.start
-    # fragment_cluster.stop = netcluster.stop
-    # fragment_cluster.bpp = netcluster.bpp
-    # fragment_cluster.shift = netcluster.shift
-    # fragment_cluster.f_low = netcluster.flow
-    # fragment_cluster.f_high = netcluster.fhigh
-    # fragment_cluster.n_pix = netcluster.nPIX
-    # fragment_cluster.run = netcluster.run
-    # fragment_cluster.pair = netcluster.pair
-    # fragment_cluster.subnet_threshold = netcluster.nSUB
-    #
-    #
-    # fragment_cluster.clusters = cluster_list
-
-    return fragment_cluster
+    for c_id in range(n_cluster):
+        meta = dict(zip(_CDATA_FIELDS, c_data[c_id].tolist()))
+        meta['sky_size'], meta['sky_index'] = int(meta['sky_size']), int(meta['sky_index'])
+        cluster_list.append(Cluster(
+            pixel_table=table.cluster(c_id),
+            cluster_meta=ClusterMeta(**meta),
+            cluster_status=int(cluster_status[c_id]),
+            cluster_rate=list(netcluster.cRate[c_id]),
+            cluster_time=float(cluster_time[c_id]),
+            cluster_freq=float(cluster_freq[c_id]),
+            sky_area=list(netcluster.sArea[c_id]),
+            sky_pixel_map=list(netcluster.p_Map[c_id]),
+            sky_pixel_index=list(netcluster.p_Ind[c_id]),
+            sky_time_delay=list(netcluster.nTofF[c_id])))
+
+    return FragmentCluster(rate=netcluster.rate,
+                           start=netcluster.start,
+                           stop=netcluster.stop,
+                           bpp=netcluster.bpp,
+                           shift=netcluster.shift,
+                           f_low=netcluster.flow,
+                           f_high=netcluster.fhigh,
+                           n_pix=netcluster.nPIX,
+                           run=netcluster.run,
+                           pair=netcluster.pair,
+                           subnet_threshold=netcluster.nSUB,
+                           clusters=cluster_list)
 
 
 def convert_netcluster_to_cluster(netcluster, c_id):
@@ -152,7 +200,7 @@ def convert_netcluster_to_cluster(netcluster, c_id):
     :rtype: Cluster
     """
     return Cluster(
-        pixels=[convert_netpixel_to_pixel(netcluster.pList[pixel_id]) for pixel_id in netcluster.cList[c_id]],
+        pixel_table=convert_netpixels_to_pixel_table([netcluster.pList[pixel_id] for pixel_id in netcluster.cList[c_id]]),
         cluster_meta=convert_cData_to_cluster_meta(netcluster.cData[c_id]),
         cluster_status=netcluster.sCuts[c_id],
         cluster_rate=list(netcluster.cRate[c_id]),
@@ -1,7 +1,7 @@
 import ROOT
 import numpy as np
 
-from pycwb.types.network_pixel import Pixel, PixelData
+from pycwb.types.network_pixel import Pixel, PixelData, PixelTable
 from .series import convert_to_wavearray, convert_wavearray_to_timeseries
 def convert_pixel_to_netpixel(pixel, c_id):
     """
@@ -53,12 +53,75 @@ def convert_netpixel_to_pixel(netpixel):
     return pixel
 
 
+def convert_netpixels_to_pixel_table(netpixels):
+    """
+    Convert netpixels to a pixel table (single cluster)
+
+    :param netpixels: netpixels
+    :type netpixels: list[ROOT.netpixel]
+    :return: pixel table
+    :rtype: PixelTable
+    """
+    if not netpixels:
+        return PixelTable.empty()
+    n_ifo = netpixels[0].data.size()
+    columns = {name: [getattr(p, name) for p in netpixels] for name in PixelTable.PIXEL_FIELDS}
+    data = [[d for d in p.data] for p in netpixels]
+    columns['noise_rms'] = [[d.noiserms for d in pd] for pd in data]
+    for name in ('wave', 'w_90', 'asnr', 'a_90', 'rank', 'index'):
+        columns[name] = [[getattr(d, name) for d in pd] for pd in data]
+    td_amp = [np.array(a) for p in netpixels for a in p.tdAmp] if any(p.tdAmp.size() for p in netpixels) else None
+    if td_amp is not None and len(td_amp) != len(netpixels) * n_ifo:
+        raise ValueError("netpixels with and without time domain amplitudes can not be mixed")
+    return PixelTable.from_columns(n_ifo, td_amp=td_amp, neighbors=[list(p.neighbors) for p in netpixels],
+                                   **columns)
+
+
+def convert_pixel_table_to_netpixels(table, c_id):
+    """
+    Convert a pixel table to netpixels
+
+    :param table: pixel table
+    :type table: PixelTable
+    :param c_id: cluster id set in the netpixels
+    :type c_id: int
+    :return: netpixels
+    :rtype: list[ROOT.netpixel]
+    """
+    n_ifo = table.n_ifo
+    columns = {name: getattr(table, name).tolist() for name in PixelTable.PIXEL_FIELDS + PixelTable.IFO_FIELDS}
+    netpixels = []
+    for k in range(len(table)):
+        netpixel = ROOT.netpixel()
+        netpixel.clusterID = c_id
+        for name in PixelTable.PIXEL_FIELDS:
+            setattr(netpixel, name, columns[name][k])
+        pixdata = []
+        for n in range(n_ifo):
+            d = ROOT.pixdata()
+            d.noiserms = columns['noise_rms'][k][n]
+            d.wave = columns['wave'][k][n]
+            d.w_90 = columns['w_90'][k][n]
+            d.asnr = columns['asnr'][k][n]
+            d.a_90 = columns['a_90'][k][n]
+            d.rank = columns['rank'][k][n]
+            d.index = columns['index'][k][n]
+            pixdata.append(d)
+        netpixel.data = pixdata
+        if table.td_amp.size:
+            netpixel.tdAmp = convert_td_amp_to_cwb([table.get_td_amp(k, n) for n in range(n_ifo)])
+        netpixel.neighbors = table.get_neighbors(k).tolist()
+        netpixels.append(netpixel)
+    return netpixels
+
+
 def convert_td_amp_to_cwb(td_amps):
     import ctypes
     c_double_p = ctypes.POINTER(ctypes.c_double)
 
     res = []
     for i, data in enumerate(td_amps):
+        data = np.ascontiguousarray(data, dtype=np.float64)
         h = ROOT.wavearray(np.double)(len(data))
         ROOT.pycwb_copy_to_wavearray(data.ctypes.data_as(c_double_p), h, len(data))
         res.append(h)
@@ -11,18 +11,12 @@ def convert_sparse_series_to_sseries(sparse_series):
     else:
         ss.pWavelet.allocate(len(data), data)
 
-    ss.sparseLookup.resize(len(sparse_series.sparse_lookup))
-    for i, v in enumerate(sparse_series.sparse_lookup):
-        ss.sparseLookup[i] = v
-    ss.sparseIndex.resize(len(sparse_series.sparse_index))
-    for i, v in enumerate(sparse_series.sparse_index):
-        ss.sparseIndex[i] = v
-    ss.sparseMap00.resize(len(sparse_series.sparse_map_00))
-    for i, v in enumerate(sparse_series.sparse_map_00):
-        ss.sparseMap00[i] = v
-    ss.sparseMap90.resize(len(sparse_series.sparse_map_90))
-    for i, v in enumerate(sparse_series.sparse_map_90):
-        ss.sparseMap90[i] = v
+    # the CSR arrays are copied in one call, with the types of the SSeries wavearrays
+    lookup = np.ascontiguousarray(sparse_series.sparse_lookup, dtype=np.int32)
+    index = np.ascontiguousarray(sparse_series.sparse_index, dtype=np.int32)
+    ROOT.pycwb_set_sparse_table(ss, len(lookup), lookup, len(index), index,
+                                np.ascontiguousarray(sparse_series.sparse_map_00, dtype=np.float32),
+                                np.ascontiguousarray(sparse_series.sparse_map_90, dtype=np.float32))
     ss.rate(sparse_series.rate)
     ss.wrate(sparse_series.w_rate)
     ss.start(sparse_series.start)
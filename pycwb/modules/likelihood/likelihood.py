@@ -1,11 +1,15 @@
-import copy
 import time
 import logging
+from multiprocessing import get_context
+import ROOT
+import numpy as np
 from pycwb.config import Config
-from pycwb.modules.cwb_conversions import convert_fragment_clusters_to_netcluster, \
-    convert_netcluster_to_fragment_clusters
 from pycwb.types.network_cluster import FragmentCluster
+from pycwb.types.netcluster_handle import NetClusterHandle
 from pycwb.types.network_event import Event
+from pycwb.types.skymap_statistics import SkymapStatistics
+from pycwb.modules.likelihoodWP.likelihood import NetworkSky, likelihood as likelihood_wp, validate_likelihood, \
+    validate_precision
 
 logger = logging.getLogger(__name__)
 
@@ -14,74 +18,56 @@ def likelihood(config, network, fragment_clusters):
     """
     calculate likelihood
 
+    With config.likelihood_cluster_parallel the clusters are processed in forked workers, each with its
+    own copy of the network (sky tables, TD filters and delay indices set once before forking). The
+    clusters are dispatched largest first and the results are returned in the original order.
+
+    With config.likelihood_backend = 'numba' the likelihoodWP sky loop and detection statistics are computed
+    with numba, the sky arrays are loaded once for all the clusters. The sky loop runs in
+    config.likelihood_precision, with config.likelihood_precision_validate each event is compared with the
+    float64 sky loop.
+
     :param config: user configuration
     :type config: Config
     :param network: network
     :type network: Network
     :param fragment_clusters: list of cluster
-    :type fragment_clusters: list[FragmentCluster]
+    :type fragment_clusters: list[FragmentCluster or NetClusterHandle]
     :return: the list of events and clusters
     :rtype: list[Event], list[Cluster]
     """
 
     timer_start = time.perf_counter()
 
-    events = []
-    clusters = []
+    # the clusters are copied to the network natively, the python view is not needed here
+    handles = [NetClusterHandle.wrap(fragment_cluster) for fragment_cluster in fragment_clusters]
 
-    skymap_statistics = []
-    for j, fragment_cluster in enumerate(fragment_clusters):
-        cycle = fragment_cluster.shift
+    # (lag, cluster index) of the clusters to process, in lag then cluster order
+    tasks = []
+    for j, handle in enumerate(handles):
+        cycle = handle.netcluster.shift
 
         # print header
         logger.info("-------------------------------------------------------")
-        logger.info("-> Processing %d clusters in lag=%d" % (len(fragment_clusters[j].clusters), cycle))
+        logger.info("-> Processing %d clusters in lag=%d" % (handle.n_clusters, cycle))
         logger.info("   ----------------------------------------------------")
 
-        # loop over clusters to calculate likelihood
-        for k, selected_cluster in enumerate(fragment_cluster.clusters):
-            # skip if cluster is already rejected
-            if selected_cluster.cluster_status > 0:
-                continue
-
-            cluster_id = k + 1
-            event, cluster = _likelihood(config, network, j, cluster_id, fragment_cluster.dump_cluster(k))
-            events.append(event)
-            clusters.append(cluster)
-
-            # skip saving skymap_statistic if cluster is already rejected
-            if cluster.cluster_status != -1:
-                skymap_statistics.append(None)
-                continue
-
-            # save skymap statistic
-            skymap_statistic = {
-                "nSensitivity": [],
-                "nAlignment": [],
-                "nLikelihood": [],
-                "nNullEnergy": [],
-                "nCorrEnergy": [],
-                "nCorrelation": [],
-                "nSkyStat": [],
-                "nProbability": [],
-                "nDisbalance": [],
-                "nNetIndex": [],
-                "nEllipticity": [],
-                "nPolarisation": []
-            }
-
-            for key in skymap_statistic:
-                var = getattr(network.net, key)
-
-                layer_size = var.value.size()
-                l = []
-                for i in range(layer_size):
-                    l.extend(list(var.value[i]))
-                # L = var.size()
-                # skymap_statistic[key] = [var.get(l) for l in range(L)]
-                skymap_statistic[key] = l
-
-            skymap_statistics.append(skymap_statistic)
+        # skip if cluster is already rejected
+        tasks.extend((j, k) for k in range(handle.n_clusters) if handle.cluster_status(k) <= 0)
+
+    # set low-rate TD filters and delay indices, once for all the clusters
+    _setup_network(config, network)
+    sky = _likelihood_sky(config, network)
+
+    n_workers = min(config.nproc, len(tasks)) if config.likelihood_cluster_parallel else 1
+    if n_workers > 1:
+        results = _likelihood_parallel(config, network, handles, tasks, n_workers, sky)
+    else:
+        results = [_likelihood_task(config, network, handles, j, k, sky) for j, k in tasks]
+
+    events = [r[0] for r in results]
+    clusters = [r[1] for r in results]
+    skymap_statistics = [r[2] for r in results]
 
     n_events = len([c for c in clusters if c.cluster_status == -1])
 
@@ -95,7 +81,85 @@ def likelihood(config, network, fragment_clusters):
     return events, clusters, skymap_statistics
 
 
-def _likelihood(config, network, lag, cluster_id, fragment_cluster):
+def _setup_network(config, network):
+    """
+    set the low-rate TD filters and the delay indices used by likelihoodWP / likelihood2G
+    """
+    wdm_list = network.get_wdm_list()
+    for wdm in wdm_list:
+        wdm.setTDFilter(config.TDSize, config.upTDF)
+
+    network.set_delay_index(config.TDRate)
+
+
+def _likelihood_sky(config, network):
+    """
+    sky arrays of the numba likelihoodWP, None to use network::likelihoodWP / likelihood2G
+    """
+    if config.likelihood_backend != 'numba':
+        return None
+    if network.pattern <= 0:
+        logger.warning("numba likelihood is implemented only for likelihoodWP (pattern > 0), using ROOT")
+        return None
+    if not NetworkSky.supported(network):
+        logger.warning("numba likelihood does not support the celestial sky mask, using ROOT")
+        return None
+    return NetworkSky(network, config.MRAcatalog, config.sky_search_order, config.sky_search_top,
+                      config.sky_search_margin, config.sky_search_validate, config.xtalk_catalog_cache,
+                      config.likelihood_precision, config.likelihood_precision_validate)
+
+
+def _likelihood_task(config, network, handles, lag, k_cluster, sky=None):
+    """
+    likelihood of one cluster and the sky statistics of the selected events
+
+    :return: event, cluster and sky statistics (None if the cluster is rejected)
+    :rtype: (Event, Cluster, SkymapStatistics or None)
+    """
+    event, cluster = _likelihood(config, network, lag, k_cluster + 1, handles[lag], k_cluster, sky)
+
+    # skip saving skymap_statistic if cluster is already rejected
+    if cluster.cluster_status != -1:
+        return event, cluster, None
+
+    # save skymap statistic
+    skymap_statistic = SkymapStatistics.from_network(network.net, config.skymap_top_n)
+
+    return event, cluster, skymap_statistic
+
+
+# state inherited by the forked likelihood workers
+_likelihood_state = {}
+
+
+def _likelihood_parallel(config, network, handles, tasks, n_workers, sky=None):
+    """
+    Process the clusters in forked workers, the largest clusters are dispatched first for load balancing
+
+    :return: (event, cluster, sky statistics) of each task, in the order of the tasks
+    :rtype: list[tuple]
+    """
+    sizes = [handles[j].cluster_size(k) for j, k in tasks]
+    order = sorted(range(len(tasks)), key=lambda i: -sizes[i])
+
+    results = [None] * len(tasks)
+    _likelihood_state.update(config=config, network=network, handles=handles, tasks=tasks, sky=sky)
+    try:
+        with get_context('fork').Pool(processes=n_workers) as pool:
+            for i, result in pool.imap_unordered(_likelihood_worker, order, chunksize=1):
+                results[i] = result
+    finally:
+        _likelihood_state.clear()
+    return results
+
+
+def _likelihood_worker(i):
+    state = _likelihood_state
+    j, k = state['tasks'][i]
+    return i, _likelihood_task(state['config'], state['network'], state['handles'], j, k, state['sky'])
+
+
+def _likelihood(config, network, lag, cluster_id, fragment_cluster, k_cluster, sky=None):
     # dumb variables
     k = 0
 
@@ -103,12 +167,7 @@ def _likelihood(config, network, lag, cluster_id, fragment_cluster):
     # cWB2G likelihood #
     ####################
 
-    # set low-rate TD filters
-    wdm_list = network.get_wdm_list()
-    for wdm in wdm_list:
-        wdm.setTDFilter(config.TDSize, config.upTDF)
-
-    network.set_delay_index(config.TDRate)
+    # the low-rate TD filters and the delay indices are set by _setup_network
 
     # sparse_table_list = sparse_table_from_fragment_clusters(config, tf_maps, [fragment_cluster])
     # for n in range(config.nIFO):
@@ -118,23 +177,37 @@ def _likelihood(config, network, lag, cluster_id, fragment_cluster):
     #         det.vSS.push_back(convert_sparse_series_to_sseries(sparse_table[n]))
     #     print("vss Size", det.vSS.size())
 
-    # load cluster to network
-    pwc = network.get_cluster(lag)
-    pwc.cpf(convert_fragment_clusters_to_netcluster(fragment_cluster), False)
-
-    pwc.setcore(False, k + 1)
-    # attach TD amp to pixels, which will be used in likelihood calculation to pa(_vtd, v00), pA(_vTD, v90)
-    # todo: check how this is implemented
-    # todo: why this complex amplitude is not loaded before?
-    pwc.loadTDampSSE(network.net, 'a', config.BATCH, config.BATCH)
+    pwc = _load_cluster(config, network, lag, fragment_cluster, k_cluster)
 
     network.net.MRA = True
-    if network.pattern > 0:
+    if sky is not None:
+        if config.likelihood_validate:
+            # run network::likelihoodWP first, the cluster is reloaded for the numba likelihood and the
+            # waveforms reconstructed by the reference run are dropped so each cluster is stored once
+            n_waveforms = _reconstructed_waveform_count(network)
+            network.likelihoodWP(config.search, lag, config.Search)
+            reference = _selected_event(network, lag, k + 1)
+            ROOT.pycwb_truncate_reconstructed_waveforms(network.net, n_waveforms)
+            pwc = _load_cluster(config, network, lag, fragment_cluster, k_cluster)
+        if sky.precision_validate:
+            # run the float64 sky loop first, the cluster is reloaded for the sky loop in the configured precision
+            n_waveforms = _reconstructed_waveform_count(network)
+            likelihood_wp(network, lag, config.search, config.Search, sky.reference)
+            precision_reference = _selected_event(network, lag, k + 1)
+            ROOT.pycwb_truncate_reconstructed_waveforms(network.net, n_waveforms)
+            pwc = _load_cluster(config, network, lag, fragment_cluster, k_cluster)
+        selected_core_pixels = likelihood_wp(network, lag, config.search, config.Search, sky)
+        if config.likelihood_validate:
+            validate_likelihood(_selected_event(network, lag, k + 1), reference)
+        if sky.precision_validate:
+            validate_precision(_selected_event(network, lag, k + 1), precision_reference)
+    elif network.pattern > 0:
         selected_core_pixels = network.likelihoodWP(config.search, lag, config.Search)
     else:
         selected_core_pixels = network.likelihood2G(config.search, lag)
 
-    cluster = convert_netcluster_to_fragment_clusters(network.get_cluster(lag)).clusters[0]
+    # the view is built before pwc is cleaned, it is the only conversion of the cluster
+    cluster = NetClusterHandle(netcluster=pwc).view.clusters[0]
 
     event = Event()
     event.output(network.net, k + 1, 0)
@@ -148,7 +221,7 @@ def _likelihood(config, network, lag, cluster_id, fragment_cluster):
     detected = cluster.cluster_status == -1
 
     # print reconstructed event
-    logger.info("   cluster-id|pixels: %5d|%d" % (cluster_id, len(cluster.pixels)))
+    logger.info("   cluster-id|pixels: %5d|%d" % (cluster_id, len(cluster.pixel_table)))
     if detected:
         logger.info("\t -> SELECTED !!!")
     else:
@@ -157,6 +230,40 @@ def _likelihood(config, network, lag, cluster_id, fragment_cluster):
     return event, cluster
 
 
+def _load_cluster(config, network, lag, fragment_cluster, k_cluster):
+    """
+    load one cluster to the netcluster of the lag and attach the TD amplitudes of its pixels
+    """
+    # load cluster to network, copied natively with the same layout as netcluster.cpf()
+    pwc = network.get_cluster(lag)
+    selected = NetClusterHandle.from_netcluster(fragment_cluster.netcluster, k_cluster)
+    pwc.cpf(selected.netcluster, False)
+
+    pwc.setcore(False, 1)
+    # attach TD amp to pixels, which will be used in likelihood calculation to pa(_vtd, v00), pA(_vTD, v90)
+    # todo: check how this is implemented
+    # todo: why this complex amplitude is not loaded before?
+    pwc.loadTDampSSE(network.net, 'a', config.BATCH, config.BATCH)
+    return pwc
+
+
+def _reconstructed_waveform_count(network):
+    # number of reconstructed waveforms stored in each detector, restored after a reference run
+    count = np.zeros(network.ifo_size, dtype=np.int64)
+    ROOT.pycwb_reconstructed_waveform_count(network.net, count)
+    return count
+
+
+def _selected_event(network, lag, cluster_id):
+    # event of a cluster after the likelihood, None if the cluster is rejected
+    pwc = network.get_cluster(lag)
+    if pwc.sCuts[cluster_id - 1] != -1:
+        return None
+    event = Event()
+    event.output(network.net, cluster_id, 0)
+    return event
+
+
 # def save_likelihood_data(job_id, cluster_id, output_dir, event, cluster):
 #     """
 #     save event and cluster to file
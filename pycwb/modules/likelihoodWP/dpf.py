@@ -1,16 +1,13 @@
 from math import sqrt
 
 import numpy as np
-from numba import njit, prange, guvectorize, vectorize, float32, uint32
+from numba import njit, prange, guvectorize, vectorize, float32, float64, uint32
 
 
 @njit(parallel=True, cache=True)
 def calculate_dpf(FP, FX, rms, n_sky, n_ifo, gamma_regulator, network_energy_threshold):
-    FP = FP.astype(np.float32)
-    FX = FX.astype(np.float32)
-    rms = rms.astype(np.float32)
-    MM = np.zeros(n_sky)
-    aa = np.zeros(n_sky)
+    MM = np.zeros(n_sky, dtype=FP.dtype)
+    aa = np.zeros(n_sky, dtype=FP.dtype)
 
     # check shape of FP, FX, and rms
     if FP.shape != (n_sky, n_ifo) and FX.shape != (n_sky, n_ifo) and rms.shape[1] != n_ifo:
@@ -90,13 +87,13 @@ def dpf_np_loops_local(Fp0, Fx0, rms):
     NPIX, NIFO = rms.shape
 
     # variables for return
-    f = np.empty((NPIX, NIFO), dtype=np.float32)
-    F = np.empty((NPIX, NIFO), dtype=np.float32)
-    si = np.empty(NPIX, dtype=np.float32)
-    co = np.empty(NPIX, dtype=np.float32)
-    fp = np.empty(NPIX, dtype=np.float32)
-    fx = np.zeros(NPIX, dtype=np.float32)
-    ni = np.zeros(NPIX, dtype=np.float32)
+    f = np.empty((NPIX, NIFO), dtype=rms.dtype)
+    F = np.empty((NPIX, NIFO), dtype=rms.dtype)
+    si = np.empty(NPIX, dtype=rms.dtype)
+    co = np.empty(NPIX, dtype=rms.dtype)
+    fp = np.empty(NPIX, dtype=rms.dtype)
+    fx = np.zeros(NPIX, dtype=rms.dtype)
+    ni = np.zeros(NPIX, dtype=rms.dtype)
 
     # Prepare constants
     _o = np.float32(0.0001)
@@ -261,68 +258,68 @@ def dpf_np(Fp0, Fx0, rms):
     return sqrt(NI / (NN + 0.01)), fp, fx, si, co, ni
 
 
-@vectorize([float32(float32, float32)])
+@vectorize([float32(float32, float32), float64(float64, float64)])
 def mul_vec(a, b):
     return a * b
 
 
-@vectorize([float32(float32, float32)])
+@vectorize([float32(float32, float32), float64(float64, float64)])
 def div_vec(a, b):
     _o = float32(0.0001)
     return a / (b + _o)
 
 
-@vectorize([float32(float32, float32)])
+@vectorize([float32(float32, float32), float64(float64, float64)])
 def add_vec(a, b):
     return a + b
 
 
-@vectorize([float32(float32, float32)])
+@vectorize([float32(float32, float32), float64(float64, float64)])
 def sub_vec(a, b):
     return a - b
 
 
-@vectorize([float32(float32, float32)])
+@vectorize([float32(float32, float32), float64(float64, float64)])
 def norm_vec(a, b):
     return sqrt(a * a + b * b)
 
 
-@vectorize([float32(float32, float32)])
+@vectorize([float32(float32, float32), float64(float64, float64)])
 def avg_vec(a, b):
     return (a + b) / float32(2.)
 
 
-@vectorize([float32(float32)])
+@vectorize([float32(float32), float64(float64)])
 def sin_from_cc(a):
     return sqrt((float32(1.) - a) / float32(2.))
 
 
-@vectorize([float32(float32, float32)])
+@vectorize([float32(float32, float32), float64(float64, float64)])
 def cos_from_cc(a, si):
     return sqrt((float32(1.) + a) / float32(2.)) if si > float32(0.) else - sqrt((float32(1.) + a) / float32(2.))
 
 
-@vectorize([uint32(float32)])
+@vectorize([uint32(float32), uint32(float64)])
 def pos_sign_vec(a):
     return uint32(1) if a > float32(0.) else uint32(0)
 
 
-@vectorize([float32(float32, float32, float32, float32)])
+@vectorize([float32(float32, float32, float32, float32), float64(float64, float64, float64, float64)])
 def rotate_fp_vec(fp, fx, si, co):
     return fp * co + fx * si
 
 
-@vectorize([float32(float32, float32, float32, float32)])
+@vectorize([float32(float32, float32, float32, float32), float64(float64, float64, float64, float64)])
 def rotate_fx_vec(fp, fx, si, co):
     return fx * co - fp * si
 
 
-@vectorize([float32(float32)])
+@vectorize([float32(float32), float64(float64)])
 def quad_vec(a):
     return a * a * a * a
 
 
-@guvectorize([(float32[:], float32[:], float32[:])], '(n),(n)->()')
+@guvectorize([(float32[:], float32[:], float32[:]), (float64[:], float64[:], float64[:])], '(n),(n)->()')
 def sum_vec(a, b, res):
     s = float32(0.)
     for i in range(a.shape[0]):
@@ -337,13 +334,13 @@ def dpf_np_loops_vec(Fp0, Fx0, rms):
     NIFO = uint32(NIFO)
 
     # variables for return
-    f = np.empty((NPIX, NIFO), dtype=np.float32)
-    F = np.empty((NPIX, NIFO), dtype=np.float32)
-    si = np.empty(NPIX, dtype=np.float32)
-    co = np.empty(NPIX, dtype=np.float32)
-    fp = np.empty(NPIX, dtype=np.float32)
-    fx = np.zeros(NPIX, dtype=np.float32)
-    ni = np.zeros(NPIX, dtype=np.float32)
+    f = np.empty((NPIX, NIFO), dtype=rms.dtype)
+    F = np.empty((NPIX, NIFO), dtype=rms.dtype)
+    si = np.empty(NPIX, dtype=rms.dtype)
+    co = np.empty(NPIX, dtype=rms.dtype)
+    fp = np.empty(NPIX, dtype=rms.dtype)
+    fx = np.zeros(NPIX, dtype=rms.dtype)
+    ni = np.zeros(NPIX, dtype=rms.dtype)
 
     _o = float32(0.0001)
 
@@ -1,326 +1,926 @@
-from math import sqrt
+import copy
+import logging
+from math import sqrt, radians, degrees, acos, cos, sin
 
 import numpy as np
-from numba import njit, prange, float32
-from numba.typed import List
+import ROOT
+from numba import njit, prange
+
 from pycwb.modules.cwb_conversions import convert_wavearray_to_nparray
-from .dpf import calculate_dpf, dpf_np_loops_vec
+from .dpf import dpf_np_loops_vec
 from .sky_stat import avx_GW_ps, avx_ort_ps, avx_stat_ps, load_data_from_td
-from .utils import avx_packet_ps, packet_norm_numpy, gw_norm_numpy
-from ..xtalk.monster import load_catalog, getXTalk_pixels
-
-
-def likelihood(network, nIFO, cluster, MRAcatalog):
-    # load network parameters
-
-    acor = network.net.acor
-    network_energy_threshold = 2 * acor * acor * nIFO
-    gamma_regulator = network.net.gamma * network.net.gamma * 2 / 3
-    delta_regulator = abs(network.net.delta) if abs(network.net.delta) < 1 else 1
-    REG = np.array([delta_regulator * np.sqrt(2), 0., 0.])
-    netEC_threshold = network.net.netRHO * network.net.netRHO * 2
-    netCC = network.net.netCC
-
-    n_sky = network.net.index.size()
-    n_pix = len(cluster.pixels)
-
-    # Load xtalk catalog
-
-    catalog, layers, nRes = load_catalog(MRAcatalog)
-    sizeCC, wdm_xtalk = getXTalk_pixels(cluster.pixels, True, layers, catalog)
-
-    # Extract data from python object to numpy arrays for numba
-    ml, FP, FX = load_data_from_ifo(network, nIFO)
-    rms, td00, td90, td_energy = load_data_from_pixels(cluster.pixels, nIFO)
-
-    # Transpose array and convert to float32 for speedup
-    td00 = np.transpose(td00.astype(np.float32), (2, 0, 1))  # (ndelay, nifo, npix)
-    td90 = np.transpose(td90.astype(np.float32), (2, 0, 1))  # (ndelay, nifo, npix)
-    FP = FP.T.astype(np.float32)
-    FX = FX.T.astype(np.float32)
-    rms = rms.T.astype(np.float32)
-    wdm_xtalk = List(wdm_xtalk)
-
-
-    REG[1] = calculate_dpf(FP, FX, rms, n_sky, nIFO, gamma_regulator, network_energy_threshold)
-
-    l_max = find_optimal_sky_localization(nIFO, n_pix, n_sky, FP, FX, rms, td00, td90, ml, REG, netCC,
-                                          delta_regulator, network_energy_threshold)
-
-    calculate_sky_statistics(l_max, nIFO, n_pix, FP, FX, rms, td00, td90, ml, REG, network_energy_threshold,
-                             wdm_xtalk)
-
-    calculate_detection_statistic()
-
-    threshold_cut()
-    likelihood_by_pixel()
-    subnetwork_statistic()
-    detection_statistic()
-    get_error_region()
-    get_chip_mass()
-
-
-def load_data_from_pixels(pixels, nifo):
-    tsize = len(pixels[0].td_amp[0])
-
-    rms = np.zeros((nifo, len(pixels)))
-    td00 = np.zeros((nifo, len(pixels), int(tsize / 2)))
-    td90 = np.zeros((nifo, len(pixels), int(tsize / 2)))
-    td_energy = np.zeros((nifo, len(pixels), int(tsize / 2)))
-    for pid, pix in enumerate(pixels):
-        rms_pix = 0
-        rms_array = np.zeros(nifo)
-
-        for i in range(nifo):
-            xx = 1. / pix.data[i].noise_rms
-            rms_pix += xx * xx
-            rms_array[i] = xx
-
-        rms_pix = np.sqrt(1. / rms_pix)
-
-        for i in range(nifo):
-            rms[i, pid] = rms_array[i] * rms_pix
-            td00[i, pid] = pix.td_amp[i][0:int(tsize / 2)]
-            td90[i, pid] = pix.td_amp[i][int(tsize / 2):tsize]
-            td_energy[i, pid] = td00[i, pid] ** 2 + td90[i, pid] ** 2
-    return rms, td00, td90, td_energy
+from .utils import avx_packet_ps, packet_norm_numpy, packet_energy_numpy, gw_norm_numpy, avx_setAMP_ps, \
+    avx_noise_ps
+from .sky_search import SkyHierarchy, sky_search_report
+from ..xtalk.monster import load_catalog, xtalk_support, getXTalk_pixels_pruned
+
+logger = logging.getLogger(__name__)
+
+# rows of the sky statistics returned by sky_statistics, in the order of pycwb_set_sky_statistics
+SKY_STATISTICS = ('skyProb', 'nAntenaPrior', 'nSensitivity', 'nAlignment', 'nLikelihood', 'nNullEnergy',
+                  'nCorrEnergy', 'nCorrelation', 'nSkyStat', 'nProbability', 'nDisbalance', 'nNetIndex',
+                  'nEllipticity', 'nPolarisation')
+
+# floating point precision of the sky loop kernels: the kernels compute in the dtype of their inputs, the
+# antenna patterns, TD amplitudes, noise rms and regulators are cast to the precision of the NetworkSky
+PRECISIONS = ('float32', 'float64')
+
+# number of delayed amplitudes per detector and pixel kept in memory by the sky loop
+_GROUP_CHUNK_SIZE = 1 << 22
+
+# sky maps of the cluster ID=1 time stamped with the trigger time at the end of network::likelihoodWP
+_GPS_MAPS = ['nSensitivity', 'nAlignment', 'nDisbalance', 'nLikelihood', 'nNullEnergy', 'nCorrEnergy',
+             'nCorrelation', 'nSkyStat', 'nEllipticity', 'nPolarisation', 'nNetIndex']
+
+
+class NetworkSky:
+    """
+    Sky arrays of the network used by the numba likelihoodWP and subNetCut, loaded once for all the lags
+    and clusters
+
+    :param network: network, with the sky resolution and the delay index already set
+    :type network: Network
+    :param mra_catalog: path of the MRA catalog
+    :type mra_catalog: str
+    :param search_order: HEALPix order of the first level of the coarse-to-fine sky search, 0 to scan all
+                         the sky locations. The sky maps of the selected events are filled from all the sky
+                         locations.
+    :type search_order: int
+    :param search_top: number of sky regions refined at each level of the sky search
+    :type search_top: int
+    :param search_margin: margin of the sky search, relative to the spread of the statistic
+    :type search_margin: float
+    :param search_validate: compare the sky search with the exhaustive scan, only for validation
+    :type search_validate: bool
+    :param catalog_cache: cache directory of the converted MRA catalogs, None to keep them only in memory
+    :type catalog_cache: str, optional
+    :param precision: floating point precision of the sky loop, 'float32' or 'float64'
+    :type precision: str
+    :param precision_validate: compare the events with the float64 sky loop, only for validation
+    :type precision_validate: bool
+    """
+
+    def __init__(self, network, mra_catalog, search_order=0, search_top=8, search_margin=0.1,
+                 search_validate=False, catalog_cache=None, precision='float32', precision_validate=False):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision {precision} is not one of {PRECISIONS}")
+        self.dtype = np.dtype(precision)
+        n_ifo = network.ifo_size
+        ml, FP, FX = load_data_from_ifo(network, n_ifo)
+        self.ml = np.ascontiguousarray(ml, dtype=np.int32)
+        self.FP = np.ascontiguousarray(FP.T, dtype=self.dtype)
+        self.FX = np.ascontiguousarray(FX.T, dtype=self.dtype)
+        self.sky_group = group_sky_by_delay(self.ml)
+        self.sky_mask = convert_wavearray_to_nparray(network.net.skyMask, short=True) != 0
+        self.xtalk_coeff, self.xtalk_lookup_table, self.layers, self.n_res = load_catalog(mra_catalog, catalog_cache)
+        self.xtalk_support = xtalk_support(self.layers, self.xtalk_coeff, self.xtalk_lookup_table)
+        self.likelihood_map = network.net.nLikelihood
+        self.big_cluster_size, self.big_cluster_mask = _big_cluster_mask(network, self.n_res, self.n_sky)
+
+        healpix = network.net.nSkyStat.getOrder()
+        self.hierarchy = None
+        if search_order and search_order < healpix:
+            self.hierarchy = SkyHierarchy(network.net.nSkyStat, search_order, search_top, search_margin)
+        elif search_order:
+            logger.warning("sky search order %d is not lower than the HEALPix order %d, all the sky locations "
+                           "are scanned", search_order, healpix)
+        self.search_validate = search_validate and self.hierarchy is not None
+        self.precision_validate = precision_validate and self.dtype != np.float64
+        self.reference = self.with_precision('float64') if self.precision_validate else None
+        logger.info("%d sky locations in %d groups of delays, %s sky loop", self.n_sky, self.sky_group.max() + 1,
+                    self.dtype.name)
+
+    @property
+    def n_sky(self):
+        return len(self.sky_mask)
+
+    def with_precision(self, precision):
+        """
+        Copy of the sky arrays with another precision, the arrays which do not depend on the precision are shared
+
+        :param precision: floating point precision of the sky loop, 'float32' or 'float64'
+        :type precision: str
+        :return: sky arrays
+        :rtype: NetworkSky
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision {precision} is not one of {PRECISIONS}")
+        sky = copy.copy(self)
+        sky.dtype = np.dtype(precision)
+        sky.FP = self.FP.astype(sky.dtype)
+        sky.FX = self.FX.astype(sky.dtype)
+        sky.precision_validate = False
+        sky.reference = None
+        return sky
+
+    @staticmethod
+    def supported(network):
+        """
+        the celestial sky mask depends on the cluster time and is only applied by the root backend
+        """
+        return network.net.skyMaskCC.size() != network.net.index.size()
+
+
+def _big_cluster_mask(network, n_res, n_sky):
+    # sky locations of the resampled skymap used for the big clusters, set by the precision parameter
+    precision = int(abs(network.net.precision))
+    csize = precision % 65536
+    order = (precision - csize) // 65536
+    healpix = network.net.nSkyStat.getOrder()
+    mask = np.ones(n_sky, dtype=np.bool_)
+    if healpix and csize and order and order < healpix:
+        mask[:] = False
+        rsm = ROOT.skymap(int(order))
+        for l in range(rsm.size()):
+            mask[network.net.nSkyStat.getSkyIndex(rsm.getTheta(l), rsm.getPhi(l))] = True
+    return n_res * csize, mask
+
+
+def group_sky_by_delay(ml):
+    """
+    Group the sky locations with the same delay indices in all the detectors
+
+    :param ml: delay indices (nifo, nsky)
+    :type ml: numpy.ndarray
+    :return: group of each sky location
+    :rtype: numpy.ndarray
+    """
+    _, group = np.unique(np.asarray(ml).T, axis=0, return_inverse=True)
+    return group.ravel().astype(np.int32)
+
+
+def group_locations(clusters, locations, sky_group):
+    """
+    Offsets of the groups of (cluster, sky location) pairs with the same cluster and delays, in pairs sorted
+    by cluster and group of delays
+
+    :param clusters: cluster of each pair
+    :type clusters: numpy.ndarray
+    :param locations: sky location of each pair
+    :type locations: numpy.ndarray
+    :param sky_group: group of each sky location, returned by group_sky_by_delay
+    :type sky_group: numpy.ndarray
+    :return: offsets of the groups in the pairs
+    :rtype: numpy.ndarray
+    """
+    if not len(locations):
+        return np.zeros(1, dtype=np.int64)
+    group = sky_group[locations]
+    starts = np.flatnonzero((np.diff(group) != 0) | (np.diff(clusters) != 0)) + 1
+    return np.concatenate(([0], starts, [len(locations)])).astype(np.int64)
 
 
 def load_data_from_ifo(network, nIFO):
-    ml = []
-    FP = []
-    FX = []
-    for i in range(nIFO):
-        ml.append(convert_wavearray_to_nparray(network.get_ifo(i).index, short=True))
-        FP.append(convert_wavearray_to_nparray(network.get_ifo(i).fp))
-        FX.append(convert_wavearray_to_nparray(network.get_ifo(i).fx))
+    """
+    Get the delay indices and the antenna patterns of the detectors, read from the sky tables of the
+    network when available
+
+    :param network: network
+    :type network: Network
+    :param nIFO: number of detectors
+    :type nIFO: int
+    :return: ml, FP and FX (nifo, nsky)
+    :rtype: tuple[numpy.ndarray]
+    """
+    FP, FX = network.antenna_patterns()
+    ml = network.delay_index()
+    return np.asarray(ml[:nIFO]), np.asarray(FP[:nIFO]), np.asarray(FX[:nIFO])
+
+
+def load_td_amp(netcluster, n_ifo, dtype=np.float32):
+    """
+    Export the TD amplitudes of the clusters loaded by netcluster::loadTDampSSE
+
+    :param netcluster: netcluster
+    :type netcluster: ROOT.netcluster
+    :param n_ifo: number of detectors
+    :type n_ifo: int
+    :param dtype: dtype of the TD amplitudes, they are exported in float32
+    :type dtype: numpy.dtype
+    :return: cluster ids, pixel offsets of the clusters, pixel layers, pixel time, noise rms (npix, nifo) and
+             TD amplitudes (ntd, nifo, npix), with the 00 amplitudes in the first half and the 90 in the second
+    :rtype: tuple[numpy.ndarray]
+    """
+    n_cluster, n_pix, td_size = [int(x) for x in ROOT.pycwb_td_amp_layout(netcluster)]
+    if n_pix and (td_size == 0 or td_size % 2):
+        raise ValueError("wrong pixel TD data")
+
+    cluster_ids = np.empty(n_cluster, dtype=np.int32)
+    pixel_offsets = np.zeros(n_cluster + 1, dtype=np.int64)
+    layers = np.empty(n_pix, dtype=np.int32)
+    time = np.empty(n_pix, dtype=np.int32)
+    rms = np.empty((n_pix, n_ifo), dtype=np.float32)
+    td_amp = np.empty((td_size, n_ifo, n_pix), dtype=np.float32)
+    if n_cluster:
+        ROOT.pycwb_export_td_amp(netcluster, n_pix, cluster_ids, pixel_offsets, layers, time, rms, td_amp)
+    return cluster_ids, pixel_offsets, layers, time, rms, td_amp.astype(dtype, copy=False)
+
+
+def normalized_inverse_rms(rms, dtype=np.float32):
+    """
+    Inverse noise rms of the pixels normalized over the detectors
+
+    :param rms: noise rms (npix, nifo)
+    :type rms: numpy.ndarray
+    :param dtype: dtype of the normalized inverse rms, the normalization is computed in float64
+    :type dtype: numpy.dtype
+    :return: normalized inverse rms (npix, nifo)
+    :rtype: numpy.ndarray
+    """
+    xx = 1. / rms.astype(np.float64)
+    return np.ascontiguousarray(xx / np.sqrt(np.sum(xx * xx, axis=1))[:, None], dtype=dtype)
 
-    ml = np.array(ml)
-    FP = np.array(FP)
-    FX = np.array(FX)
 
-    return ml, FP, FX
+@njit(cache=True)
+def delayed_amplitudes(td_amp, p0, p1, ml, l):
+    """
+    00 and 90 amplitudes (nifo, npix) of the pixels p0:p1 delayed to the sky location l
+    """
+    n_ifo = td_amp.shape[1]
+    half = td_amp.shape[0] // 2
+    offset = half // 2
+    v00 = np.empty((n_ifo, p1 - p0), dtype=td_amp.dtype)
+    v90 = np.empty((n_ifo, p1 - p0), dtype=td_amp.dtype)
+    for i in range(n_ifo):
+        d = ml[i, l] + offset
+        v00[i] = td_amp[d, i, p0:p1]
+        v90[i] = td_amp[half + d, i, p0:p1]
+    return v00, v90
+
+
+def likelihood(network, lag, mode, search, sky):
+    """
+    Numba implementation of network::likelihoodWP for the clusters loaded by netcluster::loadTDampSSE
+
+    The sky loop of all the loaded clusters runs in one call, in parallel over the (cluster, sky location)
+    pairs, the statistics at the selected sky location are computed with numba for each cluster and stored
+    in the netcluster of the lag. The waveform reconstruction, the sky error
+    regions and the chirp mass are computed by the native network.
+
+    :param network: network
+    :type network: Network
+    :param lag: lag index
+    :type lag: int
+    :param mode: likelihood mode (config.search)
+    :type mode: str
+    :param search: search type (config.Search), the chirp mass is reconstructed for CBC/BBH/IMBHB
+    :type search: str
+    :param sky: sky arrays of the network
+    :type sky: NetworkSky
+    :return: number of accepted clusters after the last rejected cluster
+    :rtype: int
+    """
+    net = network.net
+    pwc = network.get_cluster(lag)
+    if not pwc.size():
+        return 0
+
+    net.tYPe = mode
+    n_ifo = network.ifo_size
+    m_chirp = False if net.optim else mode in ('i', 'e', 'c', 'r', 'p', 'b', 'l', 's', 'g')
+
+    En = 2 * net.acor * net.acor * n_ifo  # network energy threshold in the sky loop
+    gama = net.gamma * net.gamma * 2. / 3.  # gamma regulator for x component
+    deta = min(abs(net.delta), 1.)  # delta regulator for + component
+    netEC = net.netRHO * net.netRHO * 2  # netEC/netRHO threshold
+
+    cluster_ids, pixel_offsets, layers, time, rms, td_amp = load_td_amp(pwc, n_ifo, sky.dtype)
+    nr = normalized_inverse_rms(rms, sky.dtype)
+
+    # sky mask and regulators of each cluster, big clusters are processed on the resampled skymap
+    big_cluster_mask = sky.sky_mask & sky.big_cluster_mask
+    sky_masks = []
+    REG = np.zeros((len(cluster_ids), 2), dtype=sky.dtype)
+    REG[:, 0] = deta * sqrt(2)
+    for k in range(len(cluster_ids)):
+        p0, p1 = pixel_offsets[k], pixel_offsets[k + 1]
+        sky_masks.append(big_cluster_mask if p1 - p0 > sky.big_cluster_size else sky.sky_mask)
+        if p1 > p0:
+            REG[k, 1] = dpf_regulator(sky.FP, sky.FX, nr[p0:p1], sky_masks[k], gama, En)
+
+    sky_loop = find_optimal_sky_localization(td_amp, pixel_offsets, nr, sky, sky_masks, En, REG, net.netCC,
+                                             net.delta)
+    count = 0
+    for k, cluster_id in enumerate(cluster_ids):
+        p0, p1 = pixel_offsets[k], pixel_offsets[k + 1]
+        if p1 == p0:
+            continue
+        selected = _cluster_likelihood(network, lag, int(cluster_id), td_amp[:, :, p0:p1], layers[p0:p1], time[p0:p1],
+                                       nr[p0:p1], sky, sky_masks[k], search, En, REG[k], netEC, m_chirp,
+                                       *sky_loop[k])
+        count = count + 1 if selected else 0  # the count is reset by a rejected cluster, as in likelihoodWP
+    return count
+
+
+def _cluster_likelihood(network, lag, cluster_id, td_amp, layers, time, nr, sky, sky_mask, search, En, REG, netEC,
+                        m_chirp, locations, stat, lm, found):
+    net = network.net
+    pwc = network.get_cluster(lag)
+    n_ifo = network.ifo_size
+    n_pix = len(layers)
+
+    pixels = np.empty((n_pix, 2), dtype=np.int64)
+    pixels[:, 0] = layers
+    pixels[:, 1] = time
+    xtalk_lookup, xtalk = getXTalk_pixels_pruned(pixels, sky.layers, sky.xtalk_coeff, sky.xtalk_lookup_table,
+                                                 sky.xtalk_support)
+    ROOT.pycwb_set_sky_statistics(net, sky.n_sky, len(locations), locations, stat, cluster_id == 1)
+
+    if found:
+        Eo, Mo, Cr, Ec, Mp, No, CH, cc, Co, ff, FF, v00, v90, ps, pS, mask, energy, ee, EE, ec, gn = \
+            calculate_sky_statistics(td_amp, nr, sky.FP, sky.FX, sky.ml, lm, En, REG)
+        (Eo, Eh, Em, Lm, Np, Gn, Ec, Dc, Rc, N, ch, cc, rho, xrho, S_snr,
+         pd, pD, ps, pS, pn, pN, gn) = calculate_detection_statistic(v00, v90, ps, pS, mask, energy, ec, gn,
+                                                                     xtalk_lookup, xtalk, net.netRHO)
+    if not found or threshold_cut(net.netRHO, netEC, Lm, Eo, Eh, Ec, Rc, cc, rho, N):
+        pwc.sCuts[cluster_id - 1] = 1  # reject cluster
+        pwc.clean(cluster_id)
+        return False
+
+    core, pixel_likelihood, pixel_null, Mw = likelihood_by_pixel(pd, pD, ps, pS, pn, pN, mask, ee, EE, gn, ec,
+                                                                 xtalk_lookup, xtalk)
+    subnet = subnetwork_statistic(S_snr, Rc, Gn, Np, N, n_ifo)
+    if sky.hierarchy is not None:
+        # the sky search evaluated only its candidates, the sky maps used by the error regions and exported
+        # for the selected event are filled from all the sky locations, the selected sky location is kept
+        locations, stat = full_sky_statistics(td_amp, nr, sky, sky_mask, En, REG, net.netCC, net.delta)
+        ROOT.pycwb_set_sky_statistics(net, sky.n_sky, len(locations), locations, stat, cluster_id == 1)
+    detection_statistic(network, lag, cluster_id, lm, (pd, pD, ps, pS), core, pixel_likelihood, pixel_null,
+                        [Mo, Mw, Eo, Eh, Em, Gn, Ec, Dc, Rc, N, rho, xrho, Co, CH, ff, FF, subnet])
+    T = get_error_region(network, lag, cluster_id, Mo, Rc, CH)
+    get_chip_mass(network, lag, cluster_id, Ec, search, m_chirp)
+
+    if cluster_id == 1 and not net.EFEC:
+        for name in _GPS_MAPS:
+            getattr(net, name).gps = T
+
+    pwc.sCuts[cluster_id - 1] = -1
+    pwc.clean(cluster_id)
+    return True
 
 
 @njit(cache=True, parallel=True)
-def find_optimal_sky_localization(n_ifo, n_pix, n_sky, FP, FX, rms, td00, td90, ml, REG, netCC, delta_regulator, network_energy_threshold):
-    # td00 = np.transpose(td00.astype(np.float32), (2, 0, 1))  # (ndelay, nifo, npix)
-    # td90 = np.transpose(td90.astype(np.float32), (2, 0, 1))  # (ndelay, nifo, npix)
-    # FP = FP.T.astype(np.float32)
-    # FX = FX.T.astype(np.float32)
-    # rms = rms.T.astype(np.float32)
-    REG = REG.astype(np.float32)
-
-
-    # get unique list of ml.T for each nsky for numba
-    # ml_set = set()
-    # for i in range(n_sky):
-    #     ml_set.add(tuple(ml.T[i]))
-
-    nAlignment = np.zeros(n_sky, dtype=float32)
-    nLikelihood = np.zeros(n_sky, dtype=float32)
-    nNullEnergy = np.zeros(n_sky, dtype=float32)
-    nCorrEnergy = np.zeros(n_sky, dtype=float32)
-    nCorrelation = np.zeros(n_sky, dtype=float32)
-    nSkyStat = np.zeros(n_sky, dtype=float32)
-    nProbability = np.zeros(n_sky, dtype=float32)
-    nDisbalance = np.zeros(n_sky, dtype=float32)
-    nNetIndex = np.zeros(n_sky, dtype=float32)
-    nEllipticity = np.zeros(n_sky, dtype=float32)
-    nPolarisation = np.zeros(n_sky, dtype=float32)
-    nAntenaPrior = np.zeros(n_sky, dtype=float32)
-
-    Eh = float32(0.0)
-    # sky = 0.0
-    # l_max = 0
-    # STAT=-1.e12
-    offset = int(td00.shape[0] / 2)
-
-    AA_array = np.zeros(n_sky, dtype=float32)
+def dpf_regulator(FP, FX, rms, sky_mask, gamma_regulator, network_energy_threshold):
+    """
+    x regulator of the sky loop, computed from the DPF of the sky locations in the sky mask
+    """
+    n_sky = len(sky_mask)
+    aa = np.zeros(n_sky, dtype=FP.dtype)
     for l in prange(n_sky):
-        # get time delayed data slice at sky location l, make sure it is numpy float32 array
-        v00 = np.empty((n_ifo, n_pix), dtype=float32)
-        v90 = np.empty((n_ifo, n_pix), dtype=float32)
-        for i in range(n_ifo):
-            v00[i] = td00[ml[i, l] + offset, i]
-            v90[i] = td90[ml[i, l] + offset, i]
-
-        # calculate data stats for time delayed data slice
-        Eo, NN, energy_total, mask = load_data_from_td(v00, v90, network_energy_threshold)
-        # print Eo at 0, 1000, 2000
-        # if l == 0 or l == 1000 or l == 2000:
-        #     print(f"Eo({l}): ", Eo)
-        #     print(f"mask[{l}]: ", np.sum(mask))
-        # print(f"v00[{l}]:" , np.max(v00[0]), np.max(v00[1]), f", v90[{l}]:", np.max(v90[0]), np.max(v90[1]))
-        # print(f"ml[0, {l}]: {ml[0, l]}, ml[1, {l}]: {ml[1, l]}")
-
-        # calculate DPF f+,fx and their norms
-        _, f, F, fp, fx, si, co, ni = dpf_np_loops_vec(FP[l], FX[l], rms)
-
-        # gw strain packet, return number of selected pixels
-        Mo, ps, pS, mask, au, AU, av, AV = avx_GW_ps(v00, v90, f, F, fp, fx, ni, energy_total, mask, REG)
-        # print Mo at 0, 1000, 2000
-        # if l == 0 or l == 1000 or l == 2000:
-        #     print(f"Mo({l}): ", Mo)
-        #     print(f"ps[{l}]: ", np.max(ps[0]), np.max(ps[1])), print(f"pS[{l}]: ", np.max(pS[0]), np.max(pS[1]))
-        #     print(f"mask[{l}]: ", np.sum(mask))
-        #     print(f"fp[{l}]: ", np.max(fp), f" fx[{l}]: ", np.max(fx))
-
-
-        # othogonalize signal amplitudes
-        Lo, si, co, ee, EE = avx_ort_ps(ps, pS, mask)
-        # print Lo at 0, 1000, 2000
-        # if l == 0 or l == 1000 or l == 2000:
-        #     print(f"Lo({l}): ", Lo)
-
-        # coherent statistics
-        Cr, Ec, Mp, No, coherent_energy = avx_stat_ps(v00, v90, ps, pS, si, co, mask)
-
-        CH = No / (n_ifo * Mo + sqrt(Mo))  # chi2 in TF domain
-        cc = CH if CH > float(1.0) else 1.0  # noise correction factor in TF domain
-        Co = Ec / (Ec + No * cc - Mo * (n_ifo - 1))  # network correlation coefficient in TF
-
-        if Cr < netCC:
-            continue
-
-        aa = Eo - No if Eo > float32(0.) else float32(0.)  # likelihood skystat
-        AA = aa * Co  # x-correlation skystat
-        # if l == 0 or l == 1000 or l == 2000:
-        #     print(f"Cr({l}): ", Cr, f" Ec[{l}]: ", Ec, f" Mp[{l}]: ", Mp, f" No[{l}]: ", No)
-        #     print(f"CH({l}): ", CH, f" cc[{l}]: ", cc, f" Co[{l}]: ", Co)
-        #     print(f"aa({l}): ", aa, f" AA[{l}]: ", AA)
-        nProbability[l] = aa if delta_regulator < 0 else AA
+        if sky_mask[l]:
+            aa[l], _, _, _, _, _, _, _ = dpf_np_loops_vec(FP[l], FX[l], rms)
 
-        ff, FF, ee = float32(0.), float32(0.), float32(0.)
+    FF = 0.
+    ff = 0.
+    for l in range(n_sky):
+        if not sky_mask[l]:
+            continue
+        FF += 1
+        if aa[l] > gamma_regulator:
+            ff += 1
+    return (FF * FF / (ff * ff + 1.e-9) - 1) * network_energy_threshold
 
-        for j in range(n_pix):
-            if mask[j] <= 0:
-                continue
-            ee += energy_total[j]  # total energy
-            ff += fp[j] * energy_total[j]  # |f+|^2
-            FF += fx[j] * energy_total[j]  # |fx|^2
-        ff = ff / ee if ee > float32(0.) else float32(0.)
-        FF = FF / ee if ee > float32(0.) else float32(0.)
-
-        nAntenaPrior[l] = sqrt(ff + FF)
-        nAlignment[l] = sqrt(FF / ff) if ff > float32(0.) else float32(0.)
-        nLikelihood[l] = Eo - No
-        nNullEnergy[l] = No
-        nCorrEnergy[l] = Ec
-        nCorrelation[l] = Co
-        nSkyStat[l] = AA
-        nDisbalance[l] = CH
-        nNetIndex[l] = cc
-        nEllipticity[l] = Cr
-        nPolarisation[l] = Mp
-
-        AA_array[l] = AA
-        # if AA >= STAT:
-        #     STAT = AA
-        #     l_max = l
-        #     Em = Eo - Eh
-        #
-        # if nProbability[l] > sky:
-        #     sky = nProbability[l]  # find max of skyloc stat
-    STAT = np.max(AA_array)
-    l_max = np.argmax(AA_array)
-    sky = np.max(nProbability)
-
-    return l_max
 
+@njit(cache=True, error_model='numpy')
+def calculate_sky_statistics(td_amp, rms, FP, FX, ml, l, network_energy_threshold, REG):
+    """
+    coherent statistics of the cluster at the sky location l, one iteration of the network::likelihoodWP sky loop
 
-@njit(cache=True)
-def calculate_sky_statistics(l, n_ifo, n_pix, FP, FX, rms, td00, td90, ml, REG, network_energy_threshold, cluster_xtalk, cluster_xtalk_lookup_table):
-    # from numpy import float32
-    # td00 = np.transpose(td00.astype(np.float32), (2, 0, 1))  # (ndelay, nifo, npix)
-    # td90 = np.transpose(td90.astype(np.float32), (2, 0, 1))  # (ndelay, nifo, npix)
-    v00 = np.empty((n_ifo, n_pix), dtype=float32)
-    v90 = np.empty((n_ifo, n_pix), dtype=float32)
-    td_energy = np.zeros((n_ifo, n_pix), dtype=float32)
+    :return: Eo, Mo, Cr, Ec, Mp, No, CH, cc, Co, ff, FF and the pixel arrays v00, v90, ps, pS, mask, energy,
+             ee, EE, ec, gn
+    """
+    v00, v90 = delayed_amplitudes(td_amp, 0, td_amp.shape[2], ml, l)
 
-    offset = int(td00.shape[0] / 2)
+    # calculate data stats for time delayed data slice
+    Eo, _, energy, mask = load_data_from_td(v00, v90, network_energy_threshold)
 
-    for i in range(n_ifo):
-        v00[i] = td00[ml[i, l] + offset, i]
-        v90[i] = td90[ml[i, l] + offset, i]
+    return _sky_point_statistics(v00, v90, Eo, energy, mask, FP[l], FX[l], rms, REG)
 
-    for i in range(n_ifo):
-        for j in range(n_pix):
-            td_energy[i, j] = v00[i, j] * v00[i, j] + v90[i, j] * v90[i, j]
 
-    # calculate data stats for time delayed data slice
-    Eo, NN, energy_total, mask = load_data_from_td(v00, v90, network_energy_threshold)
+@njit(cache=True, error_model='numpy')
+def _sky_point_statistics(v00, v90, Eo, energy, mask, FP, FX, rms, REG):
+    # antenna dependent part of the sky loop, the data statistics only depend on the delays
+    n_ifo = len(v00)
 
     # calculate DPF f+,fx and their norms
-    _, f, F, fp, fx, si, co, ni = dpf_np_loops_vec(FP[l], FX[l], rms)
+    _, f, F, fp, fx, _, _, ni = dpf_np_loops_vec(FP, FX, rms)
 
     # gw strain packet, return number of selected pixels
-    Mo, ps, pS, mask, au, AU, av, AV = avx_GW_ps(v00, v90, f, F, fp, fx, ni, energy_total, mask, REG)
+    Mo, ps, pS, mask, _, _, _, _ = avx_GW_ps(v00, v90, f, F, fp, fx, ni, energy, mask, REG)
 
     # othogonalize signal amplitudes
-    Lo, si, co, ee, EE = avx_ort_ps(ps, pS, mask)
+    _, si, co, ee, EE = avx_ort_ps(ps, pS, mask)
 
     # coherent statistics
-    _, _, _, _, coherent_energy = avx_stat_ps(v00, v90, ps, pS, si, co, mask)
-
-    Eo, pd, pD, pd_E, _, _, _, _ = avx_packet_ps(v00, v90, mask)  # get data packet
-    Lo, ps, pS, ps_E, _, _, _, _ = avx_packet_ps(ps, pS, mask)  # get signal packet
-
-    detector_snr, norm, rn = packet_norm_numpy(pd, pD, cluster_xtalk, cluster_xtalk_lookup_table, mask, pd_E)
-    D_snr = np.sum(detector_snr)
-    gw_norm, signal_norm = gw_norm_numpy(td_energy, norm, ps_E, coherent_energy)
-    S_snr = np.sum(gw_norm)
-    # print(f"Eo = {Eo}, Lo = {Lo}, Ep = {D_snr}, Lp = {S_snr}")
-    print("Eo = ", Eo, ", Lo = ", Lo, ", Ep = ", D_snr, ", Lp = ", S_snr)
-
-
-def calculate_detection_statistic():
-    pass
-
-
-def threshold_cut():
-    pass
+    Cr, Ec, Mp, No, ec, gn, _ = avx_stat_ps(v00, v90, ps, pS, si, co, mask)
 
+    CH = No / (n_ifo * Mo + sqrt(Mo))  # chi2 in TF domain
+    cc = CH if CH > 1 else 1.  # noise correction factor in TF domain
+    Co = Ec / (Ec + No * cc - Mo * (n_ifo - 1))  # network correlation coefficient in TF
 
-def likelihood_by_pixel():
-    pass
-
-
-def subnetwork_statistic():
-    pass
-
+    ff = 0.
+    FF = 0.
+    et = 0.
+    for j in range(len(mask)):
+        if mask[j] <= 0:
+            continue
+        et += energy[j]  # total energy
+        ff += fp[j] * energy[j]  # |f+|^2
+        FF += fx[j] * energy[j]  # |fx|^2
+    ff = ff / et if et > 0 else 0.
+    FF = FF / et if et > 0 else 0.
+
+    return Eo, Mo, Cr, Ec, Mp, No, CH, cc, Co, ff, FF, v00, v90, ps, pS, mask, energy, ee, EE, ec, gn
+
+
+def find_optimal_sky_localization(td_amp, pixel_offsets, rms, sky, sky_masks, network_energy_threshold, REG, netCC,
+                                  delta):
+    """
+    sky loop of network::likelihoodWP for a batch of clusters, on all the sky locations in the sky mask or on
+    the sky locations selected by the coarse-to-fine sky search. The (cluster, sky location) pairs of all the
+    clusters are evaluated in one parallel call per level of the sky search.
+
+    :param td_amp: TD amplitudes of the clusters (ntd, nifo, npix)
+    :type td_amp: numpy.ndarray
+    :param pixel_offsets: pixel offsets of the clusters
+    :type pixel_offsets: numpy.ndarray
+    :param rms: normalized inverse noise rms (npix, nifo)
+    :type rms: numpy.ndarray
+    :param sky: sky arrays of the network
+    :type sky: NetworkSky
+    :param sky_masks: sky mask of each cluster
+    :type sky_masks: list[numpy.ndarray]
+    :param REG: regulators of each cluster (ncluster, 2)
+    :type REG: numpy.ndarray
+    :return: for each cluster, the sky locations which passed the netCC threshold, their sky statistics
+             (14, nloc) in the order of SKY_STATISTICS, the selected sky location and False if no sky location
+             passed the netCC threshold
+    :rtype: list[tuple]
+    """
+    n_cluster = len(sky_masks)
+
+    def evaluate(locations):
+        # sky statistics of the pairs, computed in the order of the clusters and groups of delays
+        sizes = [len(x) for x in locations]
+        clusters = np.repeat(np.arange(n_cluster, dtype=np.int32), sizes)
+        locations = np.concatenate(locations).astype(np.int32) if n_cluster else np.empty(0, dtype=np.int32)
+        order = np.lexsort((sky.sky_group[locations], clusters))
+        stat, passed = sky_statistics(td_amp, pixel_offsets, rms, sky.FP, sky.FX, sky.ml, clusters[order],
+                                      locations[order], group_locations(clusters[order], locations[order],
+                                                                        sky.sky_group),
+                                      network_energy_threshold, REG, netCC, delta)
+        stat[:, order], passed[order] = stat.copy(), passed.copy()
+        offsets = np.cumsum([0] + sizes)
+        return [(stat[:, offsets[k]:offsets[k + 1]], passed[offsets[k]:offsets[k + 1]]) for k in range(n_cluster)]
+
+    def statistic(locations):
+        # selection statistic of the sky search, -inf if the netCC threshold is not passed
+        return [np.where(passed, stat[8], -np.inf) for stat, passed in evaluate(locations)]
+
+    exhaustive = [np.flatnonzero(sky_mask) for sky_mask in sky_masks]
+    candidates = [None] * n_cluster
+    if sky.hierarchy is not None:
+        candidates, n_evaluated = sky.hierarchy.search_batch(statistic, sky_masks)
+    # exhaustive scan, also used if no cell of the sky search passed the netCC threshold
+    candidates = [x if x is not None else exhaustive[k] for k, x in enumerate(candidates)]
+
+    results = []
+    for locations, (stat, passed) in zip(candidates, evaluate(candidates)):
+        locations, stat = locations[passed].astype(np.int32), np.ascontiguousarray(stat[:, passed])
+        results.append((locations, stat) + tuple(select_sky_location(locations, stat[8])))
+
+    if sky.search_validate:
+        # compare the selected sky location of each cluster with the exhaustive scan
+        for k, (stat, passed) in enumerate(evaluate(exhaustive)):
+            locations, sky_stat, lm, found = results[k]
+            reference, reference_stat = exhaustive[k][passed], stat[8, passed]
+            reference_lm, reference_found = select_sky_location(reference, reference_stat)
+            sky_search_report(sky.likelihood_map,
+                              lm if found else -1, sky_stat[8][locations == lm][0] if found else 0.,
+                              reference_lm if reference_found else -1,
+                              reference_stat[reference == reference_lm][0] if reference_found else 0.,
+                              n_evaluated[k] + len(candidates[k]), len(exhaustive[k]))
+    return results
+
+
+def full_sky_statistics(td_amp, rms, sky, sky_mask, network_energy_threshold, REG, netCC, delta):
+    """
+    sky statistics of one cluster on all the sky locations in its sky mask
+
+    :param td_amp: TD amplitudes of the cluster (ntd, nifo, npix)
+    :type td_amp: numpy.ndarray
+    :param rms: normalized inverse noise rms (npix, nifo)
+    :type rms: numpy.ndarray
+    :param sky: sky arrays of the network
+    :type sky: NetworkSky
+    :param sky_mask: sky mask of the cluster
+    :type sky_mask: numpy.ndarray
+    :param REG: regulators of the cluster (2,)
+    :type REG: numpy.ndarray
+    :return: the sky locations which passed the netCC threshold and their sky statistics (14, nloc) in the
+             order of SKY_STATISTICS
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    locations = np.flatnonzero(sky_mask).astype(np.int32)
+    locations = locations[np.argsort(sky.sky_group[locations], kind='stable')]
+    clusters = np.zeros(len(locations), dtype=np.int32)
+    pixel_offsets = np.array([0, td_amp.shape[2]], dtype=np.int64)
+    stat, passed = sky_statistics(np.ascontiguousarray(td_amp), pixel_offsets, rms, sky.FP, sky.FX, sky.ml,
+                                  clusters, locations, group_locations(clusters, locations, sky.sky_group),
+                                  network_energy_threshold, REG.reshape(1, 2), netCC, delta)
+    return locations[passed], np.ascontiguousarray(stat[:, passed])
+
+
+@njit(cache=True, parallel=True, error_model='numpy')
+def sky_statistics(td_amp, pixel_offsets, rms, FP, FX, ml, clusters, locations, group_offsets,
+                   network_energy_threshold, REG, netCC, delta):
+    """
+    sky statistics of network::likelihoodWP at (cluster, sky location) pairs sorted by cluster and group of
+    delays. The delayed amplitudes, the data statistics and the pixels above the energy threshold are computed
+    once per group, only the antenna dependent statistics of these pixels are computed for each pair
+    (in parallel over the pairs of all the clusters).
+
+    :return: sky statistics (14, npair) in the order of SKY_STATISTICS and the pairs which passed the
+             netCC threshold
+    """
+    n_pair = len(locations)
+    n_ifo = rms.shape[1]
+    n_group = len(group_offsets) - 1
+    stat = np.zeros((len(SKY_STATISTICS), n_pair), dtype=np.float64)
+    stat[0] = -1.e12
+    passed = np.zeros(n_pair, dtype=np.bool_)
+
+    # the groups are processed in chunks to bound the memory of the delayed amplitudes
+    g0 = 0
+    while g0 < n_group:
+        size = 0
+        g1 = g0
+        while g1 < n_group:
+            k = clusters[group_offsets[g1]]
+            n = (pixel_offsets[k + 1] - pixel_offsets[k]) * (n_ifo * 3 + 2)
+            if g1 > g0 and size + n > _GROUP_CHUNK_SIZE:
+                break
+            size += n
+            g1 += 1
+        buffer_offsets = np.zeros(g1 - g0 + 1, dtype=np.int64)
+        for g in range(g0, g1):
+            k = clusters[group_offsets[g]]
+            buffer_offsets[g - g0 + 1] = buffer_offsets[g - g0] + pixel_offsets[k + 1] - pixel_offsets[k]
+
+        # data statistics of each group, reduced to the pixels above the energy threshold: the other
+        # pixels are rejected by avx_GW_ps and do not contribute to the sky statistics
+        n_buffer = buffer_offsets[-1]
+        n_sel = np.zeros(g1 - g0, dtype=np.int64)
+        v00 = np.empty((n_ifo, n_buffer), dtype=td_amp.dtype)
+        v90 = np.empty((n_ifo, n_buffer), dtype=td_amp.dtype)
+        nr = np.empty((n_buffer, n_ifo), dtype=rms.dtype)
+        Eo = np.empty(g1 - g0, dtype=td_amp.dtype)
+        energy = np.empty(n_buffer, dtype=td_amp.dtype)
+        mask = np.empty(n_buffer, dtype=np.int32)
+        for g in prange(g0, g1):
+            n0 = group_offsets[g]
+            k = clusters[n0]
+            p0, p1 = pixel_offsets[k], pixel_offsets[k + 1]
+            a00, a90 = delayed_amplitudes(td_amp, p0, p1, ml, locations[n0])
+            Eo[g - g0], _, et, mk = load_data_from_td(a00, a90, network_energy_threshold)
+            b = buffer_offsets[g - g0]
+            m = 0
+            for j in range(p1 - p0):
+                if mk[j] <= 0:
+                    continue
+                v00[:, b + m] = a00[:, j]
+                v90[:, b + m] = a90[:, j]
+                nr[b + m] = rms[p0 + j]
+                energy[b + m] = et[j]
+                mask[b + m] = mk[j]
+                m += 1
+            n_sel[g - g0] = m
+
+        for n in prange(group_offsets[g0], group_offsets[g1]):
+            g = np.searchsorted(group_offsets, n, side='right') - 1 - g0
+            b0 = buffer_offsets[g]
+            b1 = b0 + n_sel[g]
+            _sky_location_statistics(stat, passed, n, locations[n], v00[:, b0:b1], v90[:, b0:b1], Eo[g],
+                                     energy[b0:b1], mask[b0:b1], FP, FX, nr[b0:b1], REG[clusters[n]], netCC, delta)
+        g0 = g1
+    return stat, passed
 
-def detection_statistic():
-    pass
 
+@njit(cache=True)
+def select_sky_location(locations, sky_stat):
+    """
+    the last sky location with the largest sky statistic, as in the sky loop of network::likelihoodWP
+
+    :return: selected sky location and False if there is no sky location
+    """
+    lm = 0
+    STAT = -1.e12
+    found = False
+    for k in range(len(locations)):
+        if sky_stat[k] > STAT or (sky_stat[k] == STAT and locations[k] > lm):
+            STAT = sky_stat[k]
+            lm = locations[k]
+            found = True
+    return lm, found
+
+
+@njit(cache=True, error_model='numpy')
+def _sky_location_statistics(stat, passed, k, l, v00, v90, Eo, energy, mask, FP, FX, rms, REG, netCC, delta):
+    # statistics of the sky location l, stored in stat[:, k] if it passes the netCC threshold
+    _, Mo, Cr, Ec, Mp, No, CH, cc, Co, ff, FF, _, _, _, _, _, _, _, _, _, _ = _sky_point_statistics(
+        v00, v90, Eo, energy, mask, FP[l], FX[l], rms, REG)
+    if Cr < netCC:
+        return
+
+    aa = Eo - No if Eo > 0 else 0.  # likelihood skystat
+    AA = aa * Co  # x-correlation skystat
+    passed[k] = True
+    stat[0, k] = aa if delta < 0 else AA
+    stat[1, k] = sqrt(ff + FF)
+    stat[2, k] = sqrt(ff + FF)
+    stat[3, k] = sqrt(FF / ff) if ff > 0 else 0.
+    stat[4, k] = Eo - No
+    stat[5, k] = No
+    stat[6, k] = Ec
+    stat[7, k] = Co
+    stat[8, k] = AA
+    stat[9, k] = stat[0, k]
+    stat[10, k] = CH
+    stat[11, k] = cc
+    stat[12, k] = Cr
+    stat[13, k] = Mp
+
+
+@njit(cache=True, error_model='numpy')
+def calculate_detection_statistic(v00, v90, ps, pS, mask, energy, ec, gn, xtalk_lookup, xtalk, net_rho):
+    """
+    detection statistics of the data and signal packets at the selected sky location
+
+    :return: Eo, Eh, Em, Lm, Np, Gn, Ec, Dc, Rc, N, ch, cc, rho, xrho, the signal SNR of the detectors,
+             the data (pd, pD), signal (ps, pS) and null (pn, pN) packet amplitudes and the pixel G-noise correction
+    """
+    n_ifo = len(v00)
+    Eo, pd, pD, pd_E, pd_si, pd_co, pd_a, pd_A = avx_packet_ps(v00, v90, mask)  # get data packet
+    _, ps, pS, ps_E, ps_si, ps_co, ps_a, ps_A = avx_packet_ps(ps, pS, mask)  # get signal packet
+    _, d_norm, data_norm, rn = packet_norm_numpy(pd, pD, xtalk, xtalk_lookup, mask, pd_E)  # data packet norms
+    S_snr, signal_norm = gw_norm_numpy(data_norm, d_norm, ps_E, ec)  # set signal norms, return signal SNR
+
+    Gn, Ec, Dc, Rc, Eh, gn = avx_noise_ps(signal_norm, data_norm, mask, energy, ec, gn, rn)  # G-noise correction
+
+    N, pd, pD = avx_setAMP_ps(pd, pD, pd_a + pd_A, pd_si, pd_co, data_norm, mask)  # set data packet amplitudes
+    N -= 1
+    _, ps, pS = avx_setAMP_ps(ps, pS, ps_a + ps_A, ps_si, ps_co, signal_norm, mask)  # set signal packet amplitudes
+    pn = pd - ps  # noise TF domain amplitudes
+    pN = pD - pS
+    Em = np.sum(packet_energy_numpy(pd, pD, xtalk, xtalk_lookup, mask))  # time domain energy
+    Np = np.sum(packet_energy_numpy(pn, pN, xtalk, xtalk_lookup, mask))  # time-domain NULL
+    Lm = Em - Np - Gn  # time domain signal energy
+    norm = (Eo - Eh) / Em if Em > 0 else 1.e9
+    if norm < 1:
+        norm = 1.
+    Ec /= norm  # core coherent energy in time domain
+    Dc /= norm  # signal-core coherent energy in time domain
+    ch = (Np + Gn) / (N * n_ifo)  # chi2
+    cc = ch if ch > 1 else 1.  # rho correction factor
+    if net_rho >= 0:  # original 2G
+        rho = sqrt(Ec * Rc / 2.) if Ec > 0 else 0.  # cWB detection stat
+        xrho = 0.
+    else:  # XGB.rho0
+        rho = sqrt(Ec / (1 + ch * (max(1., ch) - 1)))
+        xrho = sqrt(Ec * Rc / 2.) if Ec > 0 else 0.  # original 2G rho statistic
+    return Eo, Eh, Em, Lm, Np, Gn, Ec, Dc, Rc, N, ch, cc, rho, xrho, S_snr, pd, pD, ps, pS, pn, pN, gn
+
+
+def threshold_cut(net_rho, netEC, Lm, Eo, Eh, Ec, Rc, cc, rho, N):
+    """
+    cluster selection of network::likelihoodWP
+
+    :return: True if the cluster is rejected
+    :rtype: bool
+    """
+    if net_rho >= 0:  # original 2G
+        return Lm <= 0. or (Eo - Eh) <= 0. or Ec * Rc / cc < netEC or N < 1
+    # XGB.rho0
+    return Lm <= 0. or (Eo - Eh) <= 0. or rho < abs(net_rho) or N < 1
 
-def get_error_region():
-    # pwc->p_Ind[id - 1].push_back(Mo);
-    # double T = To + pwc->start;                          // trigger time
-    # std::vector<float> sArea;
-    # pwc->sArea.push_back(sArea);
-    # pwc->p_Map.push_back(sArea);
-    #
-    # double var = norm * Rc * sqrt(Mo) * (1 + fabs(1 - CH));
-    #
-    # // TODO: fix this
-    # if (iID <= 0 || ID == id) {
-    # network::getSkyArea(id, lag, T, var);       // calculate error regions
-    # }
-    pass
 
+@njit(cache=True)
+def likelihood_by_pixel(pd, pD, ps, pS, pn, pN, mask, ee, EE, gn, ec, xtalk_lookup, xtalk):
+    """
+    core flag, likelihood and null energy of the pixels at the selected sky location
+
+    :return: core (npix), likelihood (npix), null (npix) and the number of core pixels with G-noise correction
+    """
+    n_ifo, n_pix = pd.shape
+    core = mask > 0
+    likelihood = np.zeros(n_pix, dtype=pd.dtype)
+    null = np.zeros(n_pix, dtype=pd.dtype)
+    Mw = 0
+    for j in range(n_pix):
+        if core[j]:
+            likelihood[j] = -(ee[j] + EE[j]) / 2  # negative total pixel energy
+
+    for j in range(n_pix):
+        if not core[j] or gn[j] <= 0:  # skip satellites
+            continue
+        Mw += 1
+        for c in range(xtalk_lookup[j, 0], xtalk_lookup[j, 1]):
+            k = int(xtalk[c, 0] + 0.1)
+            if not core[k] or gn[k] <= 0:
+                continue
+            for i in range(n_ifo):
+                null[j] += xtalk[c, 4] * pn[i, j] * pn[i, k]
+                null[j] += xtalk[c, 6] * pn[i, j] * pN[i, k]
+                null[j] += xtalk[c, 5] * pN[i, j] * pn[i, k]
+                null[j] += xtalk[c, 7] * pN[i, j] * pN[i, k]
 
-def get_chip_mass():
-    # if (netRHO >= 0) {
-    # ee = pwc->mchirp(id);        // original mchirp 2G
-    # cc = Ec / (fabs(Ec) + ee);            // chirp cc
-    # printf("mchirp_2g : %d %g %.2e %.3f %.3f %.3f %.3f \n\n",
-    # int(id), cc, pwc->cData[id - 1].mchirp,
-    # pwc->cData[id - 1].mchirperr, pwc->cData[id - 1].tmrgr,
-    # pwc->cData[id - 1].tmrgrerr, pwc->cData[id - 1].chi2chirp);
-    # } else {                // Enabled only for Search=CBC/BBH/IMBHB
-    # if (m_chirp && (TString(Search) == "CBC" || TString(Search) == "BBH" || TString(Search) == "IMBHB")) {
-    # ee = pwc->mchirp_upix(id, nRun);        // mchirp micropixel version
-    # }
-    # }
-    pass
+        if ec[j] <= 0:  # skip incoherent pixels
+            continue
+        likelihood[j] = 0
+        for c in range(xtalk_lookup[j, 0], xtalk_lookup[j, 1]):
+            k = int(xtalk[c, 0] + 0.1)
+            if not core[k] or ec[k] <= 0:
+                continue
+            for i in range(n_ifo):
+                likelihood[j] += xtalk[c, 4] * ps[i, j] * ps[i, k]
+                likelihood[j] += xtalk[c, 6] * ps[i, j] * pS[i, k]
+                likelihood[j] += xtalk[c, 5] * pS[i, j] * ps[i, k]
+                likelihood[j] += xtalk[c, 7] * pS[i, j] * pS[i, k]
+    return core, likelihood, null, Mw
+
+
+@njit(cache=True, error_model='numpy')
+def subnetwork_statistic(S_snr, Rc, Gn, Np, N, n_ifo):
+    """
+    sub-network statistic from the signal SNR of the detectors
+    """
+    Emax = np.max(S_snr)  # detector with max energy
+    Esub = np.sum(S_snr) - Emax
+    Esub = Esub * (1 + 2 * Rc * Esub / Emax)
+    Nmax = Gn + Np - N * (n_ifo - 1)
+    return Esub / (Esub + Nmax)
+
+
+def detection_statistic(network, lag, cluster_id, lm, amplitudes, core, pixel_likelihood, pixel_null, stat):
+    """
+    Store the pixel statistics, reconstruct the waveforms and fill in the cluster data of the native netcluster
+
+    :param network: network
+    :type network: Network
+    :param lag: lag index
+    :type lag: int
+    :param cluster_id: cluster id
+    :type cluster_id: int
+    :param lm: selected sky location
+    :type lm: int
+    :param amplitudes: data (pd, pD) and signal (ps, pS) packet amplitudes (nifo, npix)
+    :type amplitudes: tuple[numpy.ndarray]
+    :param core: core pixels
+    :type core: numpy.ndarray
+    :param pixel_likelihood: pixel likelihood
+    :type pixel_likelihood: numpy.ndarray
+    :param pixel_null: pixel null energy
+    :type pixel_null: numpy.ndarray
+    :param stat: Mo, Mw, Eo, Eh, Em, Gn, Ec, Dc, Rc, N, rho, xrho, Co, CH, ff, FF, subnet
+    :type stat: list[float]
+    """
+    amp = np.ascontiguousarray(np.stack(amplitudes), dtype=np.float32)
+    ROOT.pycwb_set_likelihood_wp(network.net, lag, cluster_id, lm, amp.shape[2], amp,
+                                 np.ascontiguousarray(core, dtype=np.uint8),
+                                 np.ascontiguousarray(pixel_likelihood, dtype=np.float32),
+                                 np.ascontiguousarray(pixel_null, dtype=np.float32),
+                                 np.asarray(stat, dtype=np.float64))
+
+
+def get_error_region(network, lag, cluster_id, Mo, Rc, CH):
+    """
+    Calculate the sky error regions with network::getSkyArea
+
+    :return: trigger time
+    :rtype: float
+    """
+    pwc = network.get_cluster(lag)
+    cd = pwc.cData[cluster_id - 1]
+    pwc.p_Ind[cluster_id - 1].push_back(int(Mo))
+    T = cd.cTime + pwc.start  # trigger time
+    pwc.sArea.push_back(ROOT.std.vector['float']())
+    pwc.p_Map.push_back(ROOT.std.vector['float']())
+
+    var = cd.norm / 2 * Rc * sqrt(Mo) * (1 + abs(1 - CH))
+    network.net.getSkyArea(cluster_id, lag, T, var)
+    return T
+
+
+def get_chip_mass(network, lag, cluster_id, Ec, search, m_chirp):
+    """
+    Reconstruct the chirp mass with netcluster::mchirp (2G) or netcluster::mchirp_upix (XGB.rho0, CBC/BBH/IMBHB)
+    """
+    pwc = network.get_cluster(lag)
+    cd = pwc.cData[cluster_id - 1]
+    cd.mchirp = 0
+    cd.mchirperr = 0
+    cd.tmrgr = 0
+    cd.tmrgrerr = 0
+    cd.chi2chirp = 0
+    if not m_chirp:
+        return
+
+    if network.net.netRHO >= 0:
+        ee = pwc.mchirp(cluster_id)  # original mchirp 2G
+        cc = Ec / (abs(Ec) + ee)  # chirp cc
+        logger.info("mchirp_2g : %d %g %.2e %.3f %.3f %.3f %.3f", cluster_id, cc, cd.mchirp, cd.mchirperr,
+                    cd.tmrgr, cd.tmrgrerr, cd.chi2chirp)
+    elif search in ("CBC", "BBH", "IMBHB"):
+        pwc.mchirp_upix(cluster_id, network.net.nRun)  # mchirp micropixel version
+
+
+# event attributes compared with network::likelihoodWP
+VALIDATED_ATTRIBUTES = ['likelihood', 'ecor', 'rho', 'netcc', 'neted', 'penalty', 'norm', 'gnet', 'anet', 'inet',
+                        'theta', 'phi', 'snr', 'sSNR', 'xSNR', 'null', 'time', 'frequency', 'hrss', 'size']
+
+
+def validate_likelihood(event, reference, rtol=1e-3):
+    """
+    Compare an event of the numba likelihood with the event of network::likelihoodWP and log the deviation
+
+    :param event: event of the numba likelihood, None if the cluster is rejected
+    :type event: Event
+    :param reference: event of network::likelihoodWP, None if the cluster is rejected
+    :type reference: Event
+    :param rtol: relative tolerance
+    :type rtol: float
+    :return: attributes which do not agree within rtol
+    :rtype: list[str]
+    """
+    if event is None or reference is None:
+        if event is not reference:
+            logger.warning("likelihood validation: cluster %s by numba and %s by ROOT",
+                           *["rejected" if e is None else "selected" for e in (event, reference)])
+            return ['selection']
+        return []
+
+    mismatch = []
+    for name in VALIDATED_ATTRIBUTES:
+        value, expected = getattr(event, name, None), getattr(reference, name, None)
+        if value is None or expected is None:
+            continue
+        value = np.atleast_1d(np.asarray(value, dtype=float))
+        expected = np.atleast_1d(np.asarray(expected, dtype=float))
+        if value.shape != expected.shape or not np.allclose(value, expected, rtol=rtol):
+            mismatch.append(name)
+            logger.warning("likelihood validation: %s = %s, ROOT %s", name, value, expected)
+    if not mismatch:
+        logger.info("likelihood validation: %d attributes agree within %g", len(VALIDATED_ATTRIBUTES), rtol)
+    return mismatch
+
+
+# event statistics compared between the precisions of the sky loop
+PRECISION_ATTRIBUTES = ['rho', 'netcc', 'likelihood']
+
+
+def validate_precision(event, reference, rtol=1e-3):
+    """
+    Compare an event of the sky loop in float32 with the event of the sky loop in float64 and log the drift of
+    the event statistics and of the sky location
+
+    :param event: event of the float32 sky loop, None if the cluster is rejected
+    :type event: Event
+    :param reference: event of the float64 sky loop, None if the cluster is rejected
+    :type reference: Event
+    :param rtol: relative tolerance of the event statistics
+    :type rtol: float
+    :return: relative drift of each attribute of PRECISION_ATTRIBUTES, separation (deg) of the sky locations and
+             selection (True if both events are selected or rejected), empty if both clusters are rejected
+    :rtype: dict
+    """
+    if event is None or reference is None:
+        if event is not reference:
+            logger.warning("precision validation: cluster %s in float32 and %s in float64",
+                           *["rejected" if e is None else "selected" for e in (event, reference)])
+            return {'selection': False}
+        return {}
+
+    drift = {'selection': True}
+    for name in PRECISION_ATTRIBUTES:
+        value = np.atleast_1d(np.asarray(getattr(event, name), dtype=float))
+        expected = np.atleast_1d(np.asarray(getattr(reference, name), dtype=float))
+        if value.shape != expected.shape:
+            drift[name] = np.inf
+            continue
+        scale = np.where(expected != 0, np.abs(expected), 1.)
+        drift[name] = float(np.max(np.abs(value - expected) / scale)) if len(value) else 0.
+
+    drift['separation'] = 0.
+    moved = len(event.theta) and len(reference.theta) and \
+        (event.theta[0], event.phi[0]) != (reference.theta[0], reference.phi[0])
+    if moved:
+        t1, t2 = radians(event.theta[0]), radians(reference.theta[0])
+        dp = radians(event.phi[0] - reference.phi[0])
+        c = cos(t1) * cos(t2) + sin(t1) * sin(t2) * cos(dp)
+        drift['separation'] = degrees(acos(min(max(c, -1.), 1.)))
+
+    exceeded = [name for name in PRECISION_ATTRIBUTES if drift[name] > rtol]
+    (logger.warning if exceeded or drift['separation'] > 0 else logger.info)(
+        "precision validation: relative drift %s, sky separation %.2f deg",
+        ", ".join(f"{name} {drift[name]:.2e}" for name in PRECISION_ATTRIBUTES), drift['separation'])
+    return drift
@@ -0,0 +1,237 @@
+import logging
+from math import radians, degrees, acos, cos, sin
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SkyHierarchy:
+    """
+    Coarse-to-fine sky search on the HEALPix orders between order and the order of the sky map.
+
+    At each level the statistic is computed at the center of the candidate cells, the top cells and the
+    cells within a margin of the top are kept and their children are the candidates of the next level.
+    The candidates of the last level are sky locations of the sky map.
+
+    :param skymap: sky map of the sky statistics (network::nSkyStat)
+    :type skymap: ROOT.skymap
+    :param order: HEALPix order of the first level
+    :type order: int
+    :param top: number of cells kept at each level
+    :type top: int
+    :param margin: the cells with a statistic above the top - margin * (max - median) are also kept
+    :type margin: float
+    """
+
+    def __init__(self, skymap, order, top=8, margin=0.1):
+        import ROOT
+
+        self.healpix = int(skymap.getOrder())
+        if not 0 <= order < self.healpix:
+            raise ValueError(f"sky search order {order} is not lower than the sky map order {self.healpix}")
+        self.orders = list(range(int(order), self.healpix))
+        self.top = max(int(top), 1)
+        self.margin = margin
+        self.n_sky = int(skymap.size())
+
+        # parent cell of each sky location and sky location at the center of each cell, for each order
+        self.parents = []
+        self.representatives = []
+        for o in self.orders:
+            parent = np.empty(self.n_sky, dtype=np.int32)
+            representative = np.empty(12 * 4 ** o, dtype=np.int32)
+            ROOT.pycwb_sky_hierarchy(skymap, o, parent, representative)
+            self.parents.append(parent)
+            self.representatives.append(representative)
+
+        # children of each cell in the next level, the children of the last level are sky locations
+        self._children = []
+        for i in range(len(self.orders)):
+            if i + 1 < len(self.orders):
+                child_parent = self.parents[i][self.representatives[i + 1]]
+            else:
+                child_parent = self.parents[i]
+            order_ = np.argsort(child_parent, kind='stable').astype(np.int32)
+            offsets = np.zeros(len(self.representatives[i]) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(child_parent, minlength=len(self.representatives[i])), out=offsets[1:])
+            self._children.append((order_, offsets))
+
+    @property
+    def n_levels(self):
+        return len(self.orders)
+
+    def start(self, sky_mask):
+        """
+        candidate cells of the first level, the cells with at least one sky location in the sky mask
+
+        :param sky_mask: sky mask
+        :type sky_mask: numpy.ndarray
+        :return: candidate cells
+        :rtype: numpy.ndarray
+        """
+        return self._active(0, sky_mask)
+
+    def locations(self, level, cells):
+        """
+        sky locations where the statistic of the cells is computed
+
+        :param level: level
+        :type level: int
+        :param cells: cells of the level
+        :type cells: numpy.ndarray
+        :return: sky locations
+        :rtype: numpy.ndarray
+        """
+        return self.representatives[level][cells]
+
+    def select(self, statistic):
+        """
+        cells kept for the refinement, the top cells and the cells within the margin of the top
+
+        :param statistic: statistic of the candidate cells, -inf for the rejected cells
+        :type statistic: numpy.ndarray
+        :return: indices of the kept cells in the candidates
+        :rtype: numpy.ndarray
+        """
+        finite = np.isfinite(statistic)
+        if not np.any(finite):
+            return np.empty(0, dtype=np.int64)
+        values = statistic[finite]
+        threshold = np.sort(values)[::-1][min(self.top, len(values)) - 1]
+        threshold -= self.margin * (np.max(values) - np.median(values))
+        return np.flatnonzero(finite & (statistic >= threshold))
+
+    def refine(self, level, cells, statistic, sky_mask, active=None):
+        """
+        candidates of the next level, the children of the kept cells
+
+        :param level: level of the cells
+        :type level: int
+        :param cells: candidate cells
+        :type cells: numpy.ndarray
+        :param statistic: statistic of the candidate cells, -inf for the rejected cells
+        :type statistic: numpy.ndarray
+        :param sky_mask: sky mask
+        :type sky_mask: numpy.ndarray
+        :param active: active cells of the next level, computed from the sky mask if not given
+        :type active: numpy.ndarray, optional
+        :return: candidate cells of the next level or sky locations after the last level,
+                 None if no cell has a finite statistic
+        :rtype: numpy.ndarray or None
+        """
+        kept = cells[self.select(statistic)]
+        if not len(kept):
+            return None
+        order_, offsets = self._children[level]
+        children = np.concatenate([order_[offsets[c]:offsets[c + 1]] for c in kept])
+        if level + 1 < self.n_levels:
+            if active is None:
+                active = self._active(level + 1, sky_mask)
+            children = children[np.isin(children, active, assume_unique=True)]
+        else:
+            children = children[sky_mask[children]]
+        return np.sort(children)
+
+    def search(self, evaluate, sky_mask):
+        """
+        Coarse-to-fine search of the sky locations to evaluate at the full resolution
+
+        :param evaluate: function returning the statistic of sky locations, -inf for the rejected locations
+        :type evaluate: callable
+        :param sky_mask: sky mask
+        :type sky_mask: numpy.ndarray
+        :return: sky locations of the last level and number of evaluated cells,
+                 None if no cell of a level has a finite statistic
+        :rtype: tuple[numpy.ndarray or None, int]
+        """
+        candidates, n_evaluated = self.search_batch(lambda locations: [evaluate(locations[0])], [sky_mask])
+        return candidates[0], int(n_evaluated[0])
+
+    def search_batch(self, evaluate, sky_masks):
+        """
+        Coarse-to-fine search for several clusters, the levels run in lockstep so that the candidates of all
+        the clusters are evaluated in one call per level
+
+        :param evaluate: function returning the statistic of the sky locations of each cluster (list of arrays),
+                         -inf for the rejected locations
+        :type evaluate: callable
+        :param sky_masks: sky mask of each cluster
+        :type sky_masks: list[numpy.ndarray]
+        :return: sky locations of the last level of each cluster (None if no cell of a level has a finite
+                 statistic) and number of evaluated cells of each cluster
+        :rtype: tuple[list, numpy.ndarray]
+        """
+        # active cells of each level, computed once for the clusters sharing a sky mask
+        active = {}
+        for sky_mask in sky_masks:
+            if id(sky_mask) not in active:
+                active[id(sky_mask)] = [self._active(level, sky_mask) for level in range(self.n_levels)]
+
+        candidates = [active[id(sky_mask)][0] for sky_mask in sky_masks]
+        n_evaluated = np.zeros(len(sky_masks), dtype=np.int64)
+        empty = np.empty(0, dtype=np.int32)
+        for level in range(self.n_levels):
+            searching = [k for k, cells in enumerate(candidates) if cells is not None]
+            if not searching:
+                break
+            statistic = evaluate([self.locations(level, cells) if cells is not None else empty
+                                  for cells in candidates])
+            for k in searching:
+                cells = candidates[k]
+                n_evaluated[k] += len(cells)
+                if not len(cells):
+                    candidates[k] = None
+                    continue
+                next_active = active[id(sky_masks[k])][level + 1] if level + 1 < self.n_levels else None
+                candidates[k] = self.refine(level, cells, statistic[k], sky_masks[k], next_active)
+        return candidates, n_evaluated
+
+    def _active(self, level, sky_mask):
+        # cells of the level with at least one sky location in the sky mask
+        count = np.bincount(self.parents[level][sky_mask], minlength=len(self.representatives[level]))
+        return np.flatnonzero(count > 0)
+
+
+def sky_search_report(skymap, lm, statistic, reference_lm, reference_statistic, n_evaluated, n_sky):
+    """
+    Compare the sky location selected by the coarse-to-fine search with the exhaustive scan and log the result
+
+    :param skymap: sky map of the sky statistics
+    :type skymap: ROOT.skymap
+    :param lm: sky location of the coarse-to-fine search, -1 if none
+    :type lm: int
+    :param statistic: selection statistic at lm
+    :type statistic: float
+    :param reference_lm: sky location of the exhaustive scan, -1 if none
+    :type reference_lm: int
+    :param reference_statistic: selection statistic at reference_lm
+    :type reference_statistic: float
+    :param n_evaluated: number of sky locations evaluated by the coarse-to-fine search
+    :type n_evaluated: int
+    :param n_sky: number of sky locations evaluated by the exhaustive scan
+    :type n_sky: int
+    :return: report with the keys same_location, separation (deg), statistic_ratio and evaluated_fraction
+    :rtype: dict
+    """
+    report = {
+        'same_location': lm == reference_lm,
+        'separation': 0.,
+        'statistic_ratio': 1.,
+        'evaluated_fraction': n_evaluated / max(n_sky, 1),
+    }
+    if lm < 0 or reference_lm < 0:
+        report['separation'] = 0. if lm == reference_lm else 180.
+        report['statistic_ratio'] = 1. if lm == reference_lm else 0.
+    elif lm != reference_lm:
+        t1, t2 = radians(skymap.getTheta(int(lm))), radians(skymap.getTheta(int(reference_lm)))
+        dp = radians(skymap.getPhi(int(lm)) - skymap.getPhi(int(reference_lm)))
+        c = cos(t1) * cos(t2) + sin(t1) * sin(t2) * cos(dp)
+        report['separation'] = degrees(acos(min(max(c, -1.), 1.)))
+        report['statistic_ratio'] = statistic / reference_statistic if reference_statistic else 0.
+
+    (logger.info if report['same_location'] else logger.warning)(
+        "sky search validation: location %d (exhaustive %d), separation %.2f deg, statistic ratio %.4f, "
+        "%.2f%% of the sky evaluated", lm, reference_lm, report['separation'], report['statistic_ratio'],
+        100 * report['evaluated_fraction'])
+    return report
@@ -9,7 +9,7 @@ def _avx_loadata_ps(p, q, En):
     n_ifo = len(p)  # Number of interferometers
     n_pix = len(p[0])  # Number of pixels
 
-    energy_total = np.empty(n_pix, dtype=float32)
+    energy_total = np.empty(n_pix, dtype=p.dtype)
     mask = np.empty(n_pix, dtype=int32)
     ee = float32(0.0)
     EE = float32(0.0)
@@ -38,7 +38,7 @@ def load_data_from_td(p, q, network_energy_threshold):
     n_ifo = len(p)  # Number of interferometers
     n_pix = len(p[0])  # Number of pixels
 
-    energy_total = np.empty(n_pix, dtype=float32)
+    energy_total = np.empty(n_pix, dtype=p.dtype)
     mask = np.empty(n_pix, dtype=int32)
     ee = float32(0.0)
     EE = float32(0.0)
@@ -67,17 +67,17 @@ def avx_GW_ps(p, q, f, F, fp, fx, ni, et, mask, reg):
     n_ifo = len(p)  # Number of interferometers
     n_pix = len(p[0])  # Number of pixels
 
-    au = np.empty(n_pix, dtype=np.float32)
-    AU = np.empty(n_pix, dtype=np.float32)
-    av = np.empty(n_pix, dtype=np.float32)
-    AV = np.empty(n_pix, dtype=np.float32)
-    mask_updated = np.empty(n_pix, dtype=np.float32)
-    p_updated = np.empty((n_ifo, n_pix), dtype=np.float32)
-    q_updated = np.empty((n_ifo, n_pix), dtype=np.float32)
+    au = np.empty(n_pix, dtype=p.dtype)
+    AU = np.empty(n_pix, dtype=p.dtype)
+    av = np.empty(n_pix, dtype=p.dtype)
+    AV = np.empty(n_pix, dtype=p.dtype)
+    mask_updated = np.empty(n_pix, dtype=p.dtype)
+    p_updated = np.empty((n_ifo, n_pix), dtype=p.dtype)
+    q_updated = np.empty((n_ifo, n_pix), dtype=p.dtype)
 
     _o = np.float32(1e-5)
-    _rr = np.float32(reg[0])
-    _RR = np.float32(reg[1])
+    _rr = reg[0]
+    _RR = reg[1]
     NN = np.int32(0)
 
     for i in range(n_pix):
@@ -154,10 +154,10 @@ def avx_ort_ps(p, q, mask):
     _1 = np.float32(1)
     _o = np.float32(1e-21)
 
-    si = np.empty(n_pix, dtype=np.float32)
-    co = np.empty(n_pix, dtype=np.float32)
-    ee = np.empty(n_pix, dtype=np.float32)
-    EE = np.empty(n_pix, dtype=np.float32)
+    si = np.empty(n_pix, dtype=p.dtype)
+    co = np.empty(n_pix, dtype=p.dtype)
+    ee = np.empty(n_pix, dtype=p.dtype)
+    EE = np.empty(n_pix, dtype=p.dtype)
 
     e = np.float32(0)
     E = np.float32(0)
@@ -206,9 +206,9 @@ def avx_stat_ps(x, X, s, S, si, co, mask):
     _2 = np.float32(2)
     # _k = 2 * (1 - k)
 
-    ec = np.empty(n_pix, dtype=np.float32)
-    gn = np.empty(n_pix, dtype=np.float32)
-    rn = np.empty(n_pix, dtype=np.float32)
+    ec = np.empty(n_pix, dtype=x.dtype)
+    gn = np.empty(n_pix, dtype=x.dtype)
+    rn = np.empty(n_pix, dtype=x.dtype)
 
     LL = np.float32(0)
     Lr = np.float32(0)
@@ -270,4 +270,4 @@ def avx_stat_ps(x, X, s, S, si, co, mask):
     corr_coeff = float32(2.0) * Lr / (LL + _o)  # network correlation coefficient
     total_noise = (GN + RN) / float32(2.0)
 
-    return corr_coeff, EC, NN, total_noise, ec
+    return corr_coeff, EC, NN, total_noise, ec, gn, rn
@@ -10,17 +10,17 @@ def avx_packet_ps(p, q, mask):
     n_pix = len(p[0])
     _o = float(0.0001)
 
-    mk = np.empty(n_pix, dtype=np.float32)
-    aa = np.zeros(n_ifo, dtype=np.float32)
-    AA = np.zeros(n_ifo, dtype=np.float32)
-    aA = np.zeros(n_ifo, dtype=np.float32)
-
-    si = np.empty(n_ifo, dtype=np.float32)
-    co = np.empty(n_ifo, dtype=np.float32)
-    a = np.empty(n_ifo, dtype=np.float32)
-    A = np.empty(n_ifo, dtype=np.float32)
-    a_save = np.empty(n_ifo, dtype=np.float32)
-    A_save = np.empty(n_ifo, dtype=np.float32)
+    mk = np.empty(n_pix, dtype=p.dtype)
+    aa = np.zeros(n_ifo, dtype=p.dtype)
+    AA = np.zeros(n_ifo, dtype=p.dtype)
+    aA = np.zeros(n_ifo, dtype=p.dtype)
+
+    si = np.empty(n_ifo, dtype=p.dtype)
+    co = np.empty(n_ifo, dtype=p.dtype)
+    a = np.empty(n_ifo, dtype=p.dtype)
+    A = np.empty(n_ifo, dtype=p.dtype)
+    a_save = np.empty(n_ifo, dtype=p.dtype)
+    A_save = np.empty(n_ifo, dtype=p.dtype)
 
     for i in range(n_pix):
         mk[i] = float32(1.0) if mask[i] > 0 else float32(0.)
@@ -31,7 +31,7 @@ def avx_packet_ps(p, q, mask):
             AA[j] += mk[i] * (q[j][i] * q[j][i])
             aA[j] += mk[i] * (p[j][i] * q[j][i])
 
-    E = np.empty(n_ifo, dtype=np.float32)
+    E = np.empty(n_ifo, dtype=p.dtype)
     for i in range(n_ifo):
         _si = float32(2.) * aA[i]   # rotation 2*sin*cos*norm
         _co = aa[i] - AA[i]   # rotation (cos^2-sin^2)*norm
@@ -57,8 +57,8 @@ def avx_packet_ps(p, q, mask):
     for i in range(n_ifo):
         Ep += E[i]
 
-    p_updated = np.empty((n_ifo, n_pix), dtype=np.float32)
-    q_updated = np.empty((n_ifo, n_pix), dtype=np.float32)
+    p_updated = np.empty((n_ifo, n_pix), dtype=p.dtype)
+    q_updated = np.empty((n_ifo, n_pix), dtype=p.dtype)
     for j in range(n_ifo):
         for i in range(n_pix):
             _a = p[j][i] * co[j] + q[j][i] * si[j]
@@ -69,9 +69,26 @@ def avx_packet_ps(p, q, mask):
     return Ep/float32(2.), p_updated, q_updated, E, si, co, a_save, A_save
 
 
+@njit(cache=True)
+def _packet_xtalk(p, q, xtalks, xtalks_lookup, i, k):
+    # xtalk projections of the packet on pixel i for detector k
+    x0 = float32(0.)
+    x1 = float32(0.)
+    x2 = float32(0.)
+    x3 = float32(0.)
+    for c in range(xtalks_lookup[i, 0], xtalks_lookup[i, 1]):
+        n = int(xtalks[c, 0])
+        x0 += xtalks[c, 4] * p[k, n]
+        x1 += xtalks[c, 6] * p[k, n]
+        x2 += xtalks[c, 5] * q[k, n]
+        x3 += xtalks[c, 7] * q[k, n]
+    t = x0 * p[k, i] + x1 * q[k, i] + x2 * p[k, i] + x3 * q[k, i]
+    return (t if t > 0 else float32(0.)), x0 + x2, x1 + x3
+
+
 @njit(cache=True)
 def packet_norm_numpy(p, q, xtalks, xtalks_lookup, mk, q_E):
-    """Compute the norm of a packet of pixels.
+    """Compute the norm of a packet of pixels (network::_avx_norm_ps with I>0).
 
     Parameters
     ----------
@@ -80,65 +97,73 @@ def packet_norm_numpy(p, q, xtalks, xtalks_lookup, mk, q_E):
     q : np.ndarray
         The q component of the packet. q[ifo][pixel]
     xtalks : np.ndarray
-        The cross-talk matrix. xtalks[pixel]
+        The cross-talk coefficients of the cluster
+    xtalks_lookup : np.ndarray
+        The range of the cross-talk coefficients of each pixel
+    mk : np.ndarray
+        The pixel energy mask
+    q_E : np.ndarray
+        The packet energy of each detector, returned by avx_packet_ps
+
+    Returns
+    -------
+    tuple[np.ndarray]
+        detector SNR, detector norms (>=2), pixel norms q_norm[ifo][pixel] and halo noise rn[pixel]
     """
-    n_pixels = len(p[0])
-    n_ifos = len(p)
+    n_ifos, n_pixels = p.shape
     _o = float32(1.e-12)
 
-    q_norm = np.zeros((n_ifos, n_pixels))
-    norm = np.zeros(n_ifos)
-    rn = np.zeros(n_pixels)
+    q_norm = np.zeros((n_ifos, n_pixels), dtype=p.dtype)
+    norm = np.zeros(n_ifos, dtype=p.dtype)
+    rn = np.zeros(n_pixels, dtype=p.dtype)
     for i in range(n_pixels):
         if mk[i] <= 0.:
             continue
-        xtalk_range = xtalks_lookup[i]
-        xtalk = xtalks[xtalk_range[0]:xtalk_range[1]]
-        xtalk_indexes = xtalk[:,0].astype(np.int32)
-        xtalk_cc = np.vstack((xtalk[:,4], xtalk[:,5], xtalk[:,6], xtalk[:,7]))  # 4xM matrix
-        # Select elements from p and q based on xtalk_indexes
-        p_vec = p[:, xtalk_indexes]  # N*M matrix
-        q_vec = q[:, xtalk_indexes]  # N*M matrix
-        # Compute the sums using a vectorized approach
-        # x = np.sum(xtalk_cc * np.array([q_vec, p_vec, q_vec, p_vec]), axis=1)  # 4-d vector
-
-        # h = x * np.array([q[:, i], p[:, i], q[:, i], p[:, i]])
-        x = np.vstack((np.dot(p_vec, xtalk_cc[0].T),
-                      np.dot(p_vec, xtalk_cc[1].T),
-                      np.dot(q_vec, xtalk_cc[2].T),
-                      np.dot(q_vec, xtalk_cc[3].T)))  # 4xN matrix
-
-        # Summing all components together
-        t = (x[0] * p[:, i]) + (x[1] * q[:, i]) + (x[2] * p[:, i]) + (x[3] * q[:, i])
-
-        # if i == 0:
-        #     print('xtalk_cc: ', xtalk_cc)
-        #     print('xtalk: ', xtalk[0], xtalk[4], xtalk[5], xtalk[6], xtalk[7])
-        #     print('x: ', x)
-        #     print('t: ', t)
-        #     print('p[0, i]: ', p[0, i])
-        #     print('q[0, i]: ', q[0, i])
-
-
-        # set t to 0 if t < 0
-        norm += np.where(t < 0, 0, t)
-
-        e = (p[:, i] * p[:, i] + q[:, i] * q[:, i]) / (t + _o)  # 1-d vector
-
-        q_norm[:, i] = np.where(e > 1, 0, e)
-
-        u = x[0] + x[2]
-        v = x[1] + x[3]
-        rn[i] = np.sum(u * u + v * v)
-
-    # print('q: ', norm)
+        for k in range(n_ifos):
+            t, u, v = _packet_xtalk(p, q, xtalks, xtalks_lookup, i, k)
+            norm[k] += t
+            e = (p[k, i] * p[k, i] + q[k, i] * q[k, i]) / (t + _o)
+            q_norm[k, i] = 0. if e >= 1 else e
+            rn[i] += u * u + v * v
+
     e = q_E * 2   # TF-Domain SNR
     norm = np.where(norm < float32(2.), float32(2.), norm)  # set norm to 2 if norm < 2
-    # print('norm: ', norm)
-    # print('e: ', e)
     detector_snr = e / norm  # detector {0:NIFO} SNR
 
-    return detector_snr, norm, rn
+    return detector_snr, norm, q_norm, rn
+
+
+@njit(cache=True)
+def packet_energy_numpy(p, q, xtalks, xtalks_lookup, mk):
+    """Compute the energy of a packet of pixels in the time domain (network::_avx_norm_ps with I<0).
+
+    Parameters
+    ----------
+    p : np.ndarray
+        The p component of the packet. p[ifo][pixel]
+    q : np.ndarray
+        The q component of the packet. q[ifo][pixel]
+    xtalks : np.ndarray
+        The cross-talk coefficients of the cluster
+    xtalks_lookup : np.ndarray
+        The range of the cross-talk coefficients of each pixel
+    mk : np.ndarray
+        The pixel energy mask
+
+    Returns
+    -------
+    np.ndarray
+        packet energy of each detector
+    """
+    n_ifos, n_pixels = p.shape
+    energy = np.zeros(n_ifos, dtype=p.dtype)
+    for i in range(n_pixels):
+        if mk[i] <= 0.:
+            continue
+        for k in range(n_ifos):
+            t, _, _ = _packet_xtalk(p, q, xtalks, xtalks_lookup, i, k)
+            energy[k] += t
+    return energy
 
 
 @njit(cache=True)
@@ -146,10 +171,10 @@ def gw_norm_numpy(data_norm, q_norm, p_E, ec):
     n_pixels = len(data_norm[0])
     n_ifos = len(data_norm)
 
-    norm = np.zeros(n_ifos)
-    p_norm = np.zeros(n_ifos)
+    norm = np.zeros(n_ifos, dtype=data_norm.dtype)
+    p_norm = np.zeros(n_ifos, dtype=data_norm.dtype)
 
-    signal_norm = np.zeros((n_ifos, n_pixels))
+    signal_norm = np.zeros((n_ifos, n_pixels), dtype=data_norm.dtype)
     for i in range(n_ifos):
         norm[i] = q_norm[i]  # get data norms
         p_norm[i] = norm[i]  # save norms
@@ -160,6 +185,110 @@ def gw_norm_numpy(data_norm, q_norm, p_E, ec):
     return norm, signal_norm
 
 
+@njit(cache=True)
+def avx_setAMP_ps(p, q, amp, si, co, norm, mask):
+    """Set the packet amplitudes for the waveform reconstruction (_avx_setAMP_ps).
+
+    Parameters
+    ----------
+    p : np.ndarray
+        The unit vector p component of the packet. p[ifo][pixel]
+    q : np.ndarray
+        The unit vector q component of the packet. q[ifo][pixel]
+    amp : np.ndarray
+        The packet amplitude (a+A) of each detector
+    si : np.ndarray
+        The packet rotation sin of each detector
+    co : np.ndarray
+        The packet rotation cos of each detector
+    norm : np.ndarray
+        The pixel norms. norm[ifo][pixel]
+    mask : np.ndarray
+        The pixel energy mask
+
+    Returns
+    -------
+    tuple
+        number of degrees of freedom and the packet amplitudes p, q
+    """
+    n_ifo, n_pix = p.shape
+    p_updated = np.empty((n_ifo, n_pix), dtype=p.dtype)
+    q_updated = np.empty((n_ifo, n_pix), dtype=p.dtype)
+    Np = float32(0.)
+    for i in range(n_pix):
+        mk = float32(0.5) if mask[i] > 0 else float32(0.)
+        nn = float32(0.)
+        for j in range(n_ifo):
+            n = amp[j] * mk * norm[j, i]
+            p_updated[j, i] = n * (p[j, i] * co[j] - q[j, i] * si[j])
+            q_updated[j, i] = n * (q[j, i] * co[j] + p[j, i] * si[j])
+            nn += norm[j, i]
+        Np += nn * mk
+    return Np * 4 / n_ifo, p_updated, q_updated
+
+
+@njit(cache=True)
+def avx_noise_ps(signal_norm, data_norm, mask, et, ec, gn, rn):
+    """Gaussian noise correction of the packet (_avx_noise_ps).
+
+    Parameters
+    ----------
+    signal_norm : np.ndarray
+        The signal pixel norms. signal_norm[ifo][pixel]
+    data_norm : np.ndarray
+        The data pixel norms. data_norm[ifo][pixel]
+    mask : np.ndarray
+        The pixel energy mask
+    et : np.ndarray
+        The total pixel energy
+    ec : np.ndarray
+        The pixel coherent energy
+    gn : np.ndarray
+        The pixel G-noise correction in the TF domain
+    rn : np.ndarray
+        The pixel halo noise
+
+    Returns
+    -------
+    tuple
+        G-noise correction Gn, core coherent energy Ec, signal-core coherent energy Dc, EC normalization Rc,
+        halo energy Eh and the G-noise correction of the pixels in time domain
+    """
+    n_ifo, n_pix = data_norm.shape
+    _o = float32(1.e-9)
+    gn_updated = np.empty(n_pix, dtype=gn.dtype)
+    GN = float32(0.)
+    RC = float32(0.)
+    ES = float32(0.)
+    EH = float32(0.)
+    EC = float32(0.)
+    SC = float32(0.)
+    for i in range(n_pix):
+        ns = float32(0.)
+        nx = float32(0.)
+        for j in range(n_ifo):
+            ns += signal_norm[j, i]
+            nx += data_norm[j, i]
+        ns /= n_ifo
+        nx /= n_ifo
+        mk = float32(1.) if mask[i] > 0 else float32(0.)  # event mask
+        nm = mk if nx > 0 else float32(0.)  # norm x event mask
+        EC += nm * ec[i]  # coherent energy
+        ES += (mk - nm) * rn[i]  # residual satellite noise
+
+        rc = float32(1.) if gn[i] < 2 else float32(0.)
+        rc = ec[i] / (rc + gn[i] * (1 - rc) * float32(0.5) + _o)  # normalized EC
+
+        nm = mk if ns > 0 else float32(0.)  # norm x event mask
+        gn_updated[i] = mk * gn[i] * nx  # normalize Gaussian noise correction
+        SC += nm * ec[i]  # signal coherent energy
+        RC += nm * rc  # total normalized EC
+        GN += nm * gn_updated[i]  # G-noise correction in time domain
+        EH += (mk - nm) * et[i]  # halo energy in TF domain
+
+    return GN, EC, SC - EC, RC / (SC + float32(0.01)), EH / 2, gn_updated
+
+
 @njit
 def orthogonalize_and_rotate(p, q, pAVX, length):
     event_mask = pAVX[1]
@@ -1 +1,2 @@
-from .wdm import *
\ No newline at end of file
+from .wdm import *
+from .tf_map_cache import *
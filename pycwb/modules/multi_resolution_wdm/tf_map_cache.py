@@ -0,0 +1,117 @@
+import logging
+
+from pycwb.types.time_frequency_series import TimeFrequencySeries
+from .wdm import create_wdm_for_level
+
+logger = logging.getLogger(__name__)
+
+
+class TFMapCache:
+    """
+    Segment-scoped cache of forward transformed time-frequency maps.
+
+    The orthonormal WDM transform (with the time-delay filters of ``config.TDSize`` initialised) of each
+    detector is computed once per (ifo, level) and shared between the coherence and supercluster stages,
+    instead of being recomputed from a deep copy of the whitened data for every sparse table. With
+    ``nproc > 1`` the transforms are computed by the coherence workers and stored with :meth:`load`,
+    otherwise they are computed on the first :meth:`get`.
+
+    The cached workspaces are allocated with ``malloc`` on the C++ side and are not owned by the ROOT
+    objects, so :meth:`release` must be called once the last consumer (supercluster) is done.
+
+    :param config: user configuration
+    :type config: Config
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._maps = {}
+
+    def __contains__(self, key):
+        return key in self._maps
+
+    def __len__(self):
+        return len(self._maps)
+
+    def get(self, tf_maps, ifo_id, level):
+        """
+        Get the forward transformed map for the given detector and level, compute it on a miss
+
+        :param tf_maps: whitened time-frequency maps, one for each detector
+        :type tf_maps: list[TimeFrequencySeries]
+        :param ifo_id: detector index
+        :type ifo_id: int
+        :param level: WDM decomposition level
+        :type level: int
+        :return: forward transformed map, must be treated as read-only
+        :rtype: TimeFrequencySeries
+        """
+        key = (ifo_id, level)
+        if key not in self._maps:
+            self._maps[key] = forward_transform(self.config, tf_maps[ifo_id], level)
+        return self._maps[key]
+
+    def load(self, tf_maps, ifo_id, level, data):
+        """
+        Store a transform computed elsewhere, e.g. by a coherence worker with :func:`forward_transform`
+
+        :param tf_maps: whitened time-frequency maps, one for each detector
+        :type tf_maps: list[TimeFrequencySeries]
+        :param ifo_id: detector index
+        :type ifo_id: int
+        :param level: WDM decomposition level
+        :type level: int
+        :param data: sliced array of the transform, the 00 phase followed by the 90 phase
+        :type data: numpy.ndarray
+        """
+        key = (ifo_id, level)
+        if key in self._maps:
+            return
+        ws = _workspace(self.config, tf_maps[ifo_id], level)
+        ws.load_transform(data)
+        self._maps[key] = ws
+
+    @property
+    def nbytes(self):
+        """
+        memory held by the cached workspaces in bytes
+        """
+        return sum(ws.wavelet.nWWS * 8 for ws in self._maps.values())
+
+    def release(self):
+        """
+        Free the cached workspaces. The maps returned by :meth:`get` must not be used afterwards.
+        """
+        nbytes = self.nbytes
+        for ws in self._maps.values():
+            ws.wavelet.free()
+        self._maps.clear()
+        logger.info("TF map cache released: %.1f MB", nbytes / 1024 ** 2)
+
+
+def forward_transform(config, tf_map, level):
+    """
+    Orthonormal WDM transform of a whitened map with the time-delay filters of ``config.TDSize`` initialised.
+    The workspace is malloced, free it with ``ws.wavelet.free()`` if the map is not stored in a cache.
+
+    :param config: user configuration
+    :type config: Config
+    :param tf_map: whitened time-frequency map
+    :type tf_map: TimeFrequencySeries
+    :param level: WDM decomposition level
+    :type level: int
+    :return: forward transformed map
+    :rtype: TimeFrequencySeries
+    """
+    ws = _workspace(config, tf_map, level)
+    ws.forward()
+    return ws
+
+
+def _workspace(config, tf_map, level):
+    wdm = create_wdm_for_level(config, level)
+    wdm.set_td_filter(config.TDSize, 1)
+    # the wavelet setter copies the data into a malloced workspace,
+    # so the whitened time series itself is shared and left untouched
+    return TimeFrequencySeries(data=tf_map.data, wavelet=wdm, whiten_mode=tf_map.whiten_mode,
+                               bpp=tf_map.bpp, w_rate=tf_map.w_rate, f_low=tf_map.f_low, f_high=tf_map.f_high)
@@ -5,6 +5,7 @@ import numpy as np
 import healpy as hp
 import logging
 
+from pycwb.utils.dataclass_object_io import load_skymap_statistics_from_npz
 from pycwb.utils.skymap_coord import convert_cwb_to_geo
 
 logger = logging.getLogger(__name__)
@@ -38,7 +39,9 @@ def plot_skymap_contour(skymap_statistic, key="nProbability", reconstructed_loc=
                         resolution=2):
     mplstyle.use('fast')
 
-    # get the [key] property from the skymap
+    # get the [key] property from the skymap, the sky maps saved as npz are read lazily
+    if isinstance(skymap_statistic, str):
+        skymap_statistic = load_skymap_statistics_from_npz(skymap_statistic)
     skymap = np.array(skymap_statistic[key])
 
     # create theta and phi, add one extra point and remove it to make sure
@@ -52,7 +55,7 @@ def plot_skymap_contour(skymap_statistic, key="nProbability", reconstructed_loc=
     flatten_phi = phi.flatten()
 
     # convert to HEALPix indices and get the values for each point
-    healpix_indices = hp.ang2pix(2 ** 7, flatten_theta, flatten_phi)
+    healpix_indices = hp.ang2pix(hp.npix2nside(len(skymap)), flatten_theta, flatten_phi)
     values = skymap[healpix_indices]
 
     # reshape to 2D map
@@ -32,15 +32,16 @@ def get_MRA_wave(cluster, wdmList, rate, ifo, a_type, mode, nproc):
     waveform : pycbc.types.timeseries.TimeSeries
         reconstructed waveform
     """
-    if not cluster.pixels:
+    if not len(cluster.pixel_table):
         return None
+    pixels = cluster.pixels
 
     max_f_len = max([wdm.m_H / rate for wdm in wdmList])
 
     # find event time interval, fill in amplitudes
     tmin = 1e20
     tmax = 0
-    for pix in cluster.pixels:
+    for pix in pixels:
         T = int(pix.time / pix.layers)  # get time index
         T = T / pix.rate  # time in seconds from the start
         tmin = min(tmin, T)
@@ -59,7 +60,7 @@ def get_MRA_wave(cluster, wdmList, rate, ifo, a_type, mode, nproc):
 
     z_len = len(z.data)
 
-    results = [_process_pixels(pix, ifo, a_type, mode, wdmList, io, z_len) for pix in cluster.pixels]
+    results = [_process_pixels(pix, ifo, a_type, mode, wdmList, io, z_len) for pix in pixels]
     # if min(nproc, len(cluster.pixels)) == 1:
     #     results = [_process_pixels(pix, ifo, a_type, mode, wdmList, io, z_len) for pix in cluster.pixels]
     # else:
@@ -1,38 +1,67 @@
 import logging, time
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 
 from pycwb.modules.multi_resolution_wdm import create_wdm_for_level
+from pycwb.types.netcluster_handle import NetClusterHandle
 from pycwb.types.sparse_series import SparseTimeFrequencySeries
 
 logger = logging.getLogger(__name__)
 
 
-def sparse_table_from_fragment_clusters(config, tf_maps, fragment_clusters, parallel=False):
+def sparse_table_from_fragment_clusters(config, tf_maps, fragment_clusters, parallel=False, tf_map_cache=None):
     """Create sparse tables from fragment clusters
 
+    The tables are built for each (resolution, detector) unit. With ``parallel`` and a ``tf_map_cache`` the
+    units run in a thread pool of ``config.nproc`` workers: the halo expansion is done with numpy and the
+    cached maps are shared in memory instead of being pickled to worker processes. Without the cache each
+    unit runs WDM::Forward, which holds the GIL, so the units are built serially.
+
     :param config: config object
     :type config: Config
     :param tf_maps: time-frequency maps
     :type tf_maps: list[TimeFrequencySeries]
-    :param wdm_list: list of wavelet-domain models
-    :type wdm_list: list[WDM]
-    :param fragment_clusters: fragment clusters
-    :type fragment_clusters: list[FragmentCluster]
+    :param fragment_clusters: fragment clusters, one for each resolution, the core pixels are read from the
+                              native netcluster of a handle without building its view
+    :type fragment_clusters: list[FragmentCluster or NetClusterHandle]
+    :param parallel: build the tables in a thread pool, only with tf_map_cache
+    :type parallel: bool
+    :param tf_map_cache: cache of forward transformed maps shared with coherence
+    :type tf_map_cache: TFMapCache, optional
     :return: sparse tables
     :rtype: list[list[SparseTimeFrequencySeries]]
     """
     timer_start = time.perf_counter()
 
-    if parallel:
-        logger.info("Start sparse series in parallel")
-        with Pool(processes=min(config.nproc, config.nRES)) as pool:
-            sparse_tables = pool.map(_sparse_table_from_fragment_cluster,
-                                     [(config, tf_maps, i, fragment_cluster)
-                                      for i, fragment_cluster in enumerate(fragment_clusters)])
+    units = [(i, n) for i in range(len(fragment_clusters)) for n in range(config.nIFO)]
+    core_pixels = [NetClusterHandle.wrap(fragment_cluster).core_pixels() for fragment_cluster in fragment_clusters]
+
+    if tf_map_cache is not None:
+        # fill the cache before starting the workers, the cached maps are then only read
+        for i, n in units:
+            tf_map_cache.get(tf_maps, n, config.WDM_level[i])
+
+        def _build(unit):
+            i, n = unit
+            return SparseTimeFrequencySeries().from_transformed_map(
+                tf_map_cache.get(tf_maps, n, config.WDM_level[i]), core_pixels[i], config.max_delay, n)
+    else:
+        def _build(unit):
+            i, n = unit
+            # each unit transforms a copy of the whitened map with its own wavelet
+            wdm = create_wdm_for_level(config, config.WDM_level[i])
+            return SparseTimeFrequencySeries().from_fragment_cluster(wdm, tf_maps[n], core_pixels[i],
+                                                                     config.TDSize, config.max_delay, n)
+
+    # the forward transforms of the uncached units hold the GIL, threads would only add overhead
+    n_workers = min(config.nproc, len(units)) if parallel and tf_map_cache is not None else 1
+    if n_workers > 1:
+        logger.info("Start sparse series in %d threads", n_workers)
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            tables = list(executor.map(_build, units))
     else:
-        sparse_tables = list(map(_sparse_table_from_fragment_cluster,
-                                 [(config, tf_maps, i, fragment_cluster)
-                                  for i, fragment_cluster in enumerate(fragment_clusters)]))
+        tables = list(map(_build, units))
+
+    sparse_tables = [tables[i * config.nIFO:(i + 1) * config.nIFO] for i in range(len(fragment_clusters))]
 
     timer_stop = time.perf_counter()
     logger.info("----------------------------------------")
@@ -40,13 +69,3 @@ def sparse_table_from_fragment_clusters(config, tf_maps, fragment_clusters, para
     logger.info("----------------------------------------")
 
     return sparse_tables
-
-
-def _sparse_table_from_fragment_cluster(args):
-    config, tf_maps, i, fragment_cluster = args
-    wdm = create_wdm_for_level(config, config.WDM_level[i])
-
-    return [
-        SparseTimeFrequencySeries().from_fragment_cluster(wdm, tf_maps[n], fragment_cluster,
-                                                          config.TDSize, config.max_delay, n)
-        for n in range(config.nIFO)]
@@ -0,0 +1,351 @@
+import logging
+from math import sqrt
+
+import numpy as np
+import ROOT
+from numba import njit, prange
+
+from pycwb.modules.likelihoodWP.dpf import dpf_np_loops_vec
+from pycwb.modules.likelihoodWP.likelihood import load_td_amp, normalized_inverse_rms, delayed_amplitudes
+from pycwb.modules.likelihoodWP.sky_search import sky_search_report
+from pycwb.modules.likelihoodWP.sky_stat import load_data_from_td
+from pycwb.modules.xtalk.monster import getXTalk_pixels_pruned
+
+logger = logging.getLogger(__name__)
+
+
+def sub_net_cut(network, lag, sky, sub_net=0.6, sub_cut=0.33, sub_norm=0.0):
+    """
+    Numba implementation of network::subNetCut for the clusters loaded by netcluster::loadTDampSSE
+
+    All the loaded clusters are processed in one call: the first sky loop runs in parallel over
+    (cluster, sky location) and the MRA pass at the best sky location runs in parallel over the clusters.
+    A cluster is rejected without the MRA pass as soon as its all-sky subnet statistic is below sub_net.
+    If the sky arrays have a sky hierarchy, the first sky loop is replaced by the coarse-to-fine sky search.
+    The results are stored in the netcluster of the lag and the TD amplitudes are released.
+
+    :param network: network
+    :type network: Network
+    :param lag: lag index
+    :type lag: int
+    :param sky: sky arrays of the network
+    :type sky: NetworkSky
+    :param sub_net: sub network threshold
+    :type sub_net: float
+    :param sub_cut: sub network threshold in the skyloop (enabled only if >=0)
+    :type sub_cut: float
+    :param sub_norm: sub network norm threshold
+    :type sub_norm: float
+    :return: number of pixels in the accepted clusters
+    :rtype: int
+    """
+    pwc = network.get_cluster(lag)
+    n_ifo = network.ifo_size
+    cluster_ids, pixel_offsets, layers, time, rms, td_amp = load_td_amp(pwc, n_ifo, sky.dtype)
+    n_cluster = len(cluster_ids)
+    if n_cluster == 0:
+        return 0
+
+    acor = network.net.acor
+    En = 2 * acor * acor * n_ifo
+    Es = 2 * network.net.e2or
+
+    xtalk_lookup, xtalk = _cluster_xtalk(pixel_offsets, layers, time, sky.layers, sky.xtalk_coeff,
+                                         sky.xtalk_lookup_table, sky.xtalk_support)
+    nr = normalized_inverse_rms(rms, sky.dtype)
+    if sky.hierarchy is not None:
+        stat = _hierarchical_sky_scan(td_amp, pixel_offsets, nr, sky, En, Es, sub_cut)
+    else:
+        stat = _sky_scan(td_amp, pixel_offsets, nr, sky.FP, sky.FX, sky.ml, sky.sky_mask, En, Es, sub_cut)
+    sky_index, likenet, energy, mra, submra, submra_null, suball, suball_null, rejected = _cluster_cut(
+        td_amp, pixel_offsets, nr, sky.FP, sky.FX, sky.ml, stat, xtalk_lookup, xtalk,
+        En, Es, sub_cut, abs(sub_net), sub_norm, abs(network.net.netRHO))
+
+    theta = np.array([sky.likelihood_map.getTheta(int(l)) if l >= 0 else 0. for l in sky_index], dtype=np.float64)
+    phi = np.array([sky.likelihood_map.getPhi(int(l)) if l >= 0 else 0. for l in sky_index], dtype=np.float64)
+    ROOT.pycwb_set_subnet_cut(pwc, n_cluster, cluster_ids, sky_index, theta, phi, likenet, energy,
+                              mra.view(np.uint8), submra, submra_null, suball, suball_null, rejected.view(np.uint8))
+
+    cluster_size = np.array([pwc.cList[int(c) - 1].size() for c in cluster_ids[~rejected]], dtype=np.int64)
+    return int(cluster_size.sum())
+
+
+@njit(cache=True)
+def _cluster_xtalk(pixel_offsets, layers, time, catalog_layers, xtalk_coeff, xtalk_lookup_table, xtalk_support):
+    """
+    xtalk coefficients of the pixels of each cluster, the pixel indices in the coefficients are relative
+    to the cluster and the lookup table is global
+    """
+    n_cluster = len(pixel_offsets) - 1
+    lookup = np.empty((pixel_offsets[-1], 2), dtype=np.int64)
+    parts = []
+    n = 0
+    for k in range(n_cluster):
+        p0, p1 = pixel_offsets[k], pixel_offsets[k + 1]
+        pixels = np.empty((p1 - p0, 2), dtype=np.int64)
+        pixels[:, 0] = layers[p0:p1]
+        pixels[:, 1] = time[p0:p1]
+        cc_lookup, cc = getXTalk_pixels_pruned(pixels, catalog_layers, xtalk_coeff, xtalk_lookup_table, xtalk_support)
+        lookup[p0:p1] = cc_lookup + n
+        n += len(cc)
+        parts.append(cc)
+    xtalk = np.empty((n, 8), dtype=np.float32)
+    n = 0
+    for cc in parts:
+        xtalk[n:n + len(cc)] = cc
+        n += len(cc)
+    return lookup, xtalk
+
+
+@njit(cache=True)
+def _mra(a00, a90, energy, En, K, xtalk_lookup, xtalk):
+    """
+    principal components of the cluster at one sky location (network::_sse_MRA_ps),
+    a00 and a90 are overwritten with the residuals
+    """
+    n_ifo, n_pix = a00.shape
+    ee = energy.copy()
+    amp = np.zeros((n_ifo, n_pix), dtype=a00.dtype)
+    AMP = np.zeros((n_ifo, n_pix), dtype=a00.dtype)
+    mam = np.empty(n_ifo, dtype=a00.dtype)
+    mAM = np.empty(n_ifo, dtype=a00.dtype)
+    EE = 0.
+    k = 0
+    m = 0
+    while k < K:
+        for j in range(n_pix):
+            if ee[j] > ee[m]:
+                m = j
+        if ee[m] <= En:
+            break
+        E = 0.
+        for i in range(n_ifo):
+            E += a00[i, m] * a00[i, m] + a90[i, m] * a90[i, m]
+        EE += E
+        if E / EE < 0.01:
+            break
+        for i in range(n_ifo):
+            mam[i] = a00[i, m]
+            mAM[i] = a90[i, m]
+            amp[i, m] += mam[i]
+            AMP[i, m] += mAM[i]
+        for c in range(xtalk_lookup[m, 0], xtalk_lookup[m, 1]):
+            n = int(xtalk[c, 0] + 0.1)
+            if ee[n] > En:
+                e = 0.
+                for i in range(n_ifo):
+                    a00[i, n] -= mam[i] * xtalk[c, 4] + mAM[i] * xtalk[c, 5]
+                    a90[i, n] -= mam[i] * xtalk[c, 6] + mAM[i] * xtalk[c, 7]
+                    e += a00[i, n] * a00[i, n] + a90[i, n] * a90[i, n]
+                ee[n] = e
+        k += 1
+    return amp, AMP
+
+
+@njit(cache=True)
+def _sky_point(td_amp, p0, p1, nr, FP, FX, ml, l, En, Es, sub_cut, mra, xtalk_lookup, xtalk):
+    """
+    subnet statistics of a cluster at one sky location, one iteration of the network::subNetCut sky loop
+
+    :return: valid, AA (subnet stat with threshold), Lo, Eo, Ls, m, suball (subnet stat without threshold),
+             suball NULL
+    """
+    v00, v90 = delayed_amplitudes(td_amp, p0, p1, ml, l)
+    n_ifo, n_pix = v00.shape
+
+    # energy above the network threshold and minimum subnetwork energy
+    E_o, NN, energy, _ = load_data_from_td(v00, v90, En)
+    Eo = 2. * E_o + 0.01
+    m = 2 * NN
+    Ls = 0.
+    Ln = 0.
+    K = 0
+    for j in range(n_pix):
+        if energy[j] <= 0.:
+            continue
+        es = energy[j]
+        for i in range(n_ifo):
+            es = min(es, energy[j] - (v00[i, j] * v00[i, j] + v90[i, j] * v90[i, j]))
+        Ls += es
+        if es >= Es:
+            Ln += energy[j]
+        if energy[j] > En:
+            K += 1
+    aa = Ls * Ln / (Eo - Ls)
+    if sub_cut >= 0 and (aa - m) / (aa + m) < sub_cut:
+        return False, 0., 0., 0., 0., 0, 0., 0.
+
+    if mra:
+        x00, x90 = _mra(v00, v90, energy, En, K, xtalk_lookup[p0:p1], xtalk)
+    else:
+        x00, x90 = v00, v90
+
+    # likelihood of the pixels above the threshold in the DPF
+    _, f, F, _, _, _, _, _ = dpf_np_loops_vec(FP[l], FX[l], nr[p0:p1])
+    m = 0
+    Ls = 0.
+    Ln = 0.
+    Eo = 0.
+    Lo = 0.
+    for j in range(n_pix):
+        ee = 0.
+        em = 0.
+        for i in range(n_ifo):
+            e = x00[i, j] * x00[i, j] + x90[i, j] * x90[i, j]
+            ee += e
+            em = max(em, e)
+        if ee < En:
+            continue
+        m += 1
+        Ls += ee - em
+        Eo += ee
+        if ee - em > Es:
+            Ln += ee
+        xp = 0.
+        XP = 0.
+        xx = 0.
+        XX = 0.
+        gp = 1.e-12
+        gx = 1.e-12
+        for i in range(n_ifo):
+            xp += f[j, i] * x00[i, j]
+            XP += f[j, i] * x90[i, j]
+            xx += F[j, i] * x00[i, j]
+            XX += F[j, i] * x90[i, j]
+            gp += f[j, i] * f[j, i]
+            gx += F[j, i] * F[j, i]
+        Lo += (xp * xp + XP * XP) / gp + (xx * xx + XX * XX) / gx
+    if Eo <= 0:
+        return False, 0., 0., 0., 0., 0, 0., 0.
+
+    AA = aa / (abs(aa) + abs(Eo - Lo) + 2 * m * (Eo - Ln) / Eo)
+    ee = Ls * Eo / (Eo - Ls)
+    em = abs(Eo - Lo) + 2 * m
+    return True, AA, Lo, Eo, Ls, m, ee / (ee + em), em
+
+
+@njit(cache=True, parallel=True)
+def _sky_scan(td_amp, pixel_offsets, nr, FP, FX, ml, sky_mask, En, Es, sub_cut):
+    """
+    first sky loop of network::subNetCut for all the clusters, parallel over (cluster, sky location)
+
+    :return: subnet statistic with threshold (n_cluster, n_sky), 0 for the skipped sky locations
+    """
+    n_cluster = len(pixel_offsets) - 1
+    n_sky = len(sky_mask)
+    stat = np.zeros((n_cluster, n_sky), dtype=np.float64)
+    no_xtalk_lookup = np.empty((0, 2), dtype=np.int64)
+    no_xtalk = np.empty((0, 8), dtype=np.float32)
+    for n in prange(n_cluster * n_sky):
+        k = n // n_sky
+        l = n % n_sky
+        if not sky_mask[l]:
+            continue
+        valid, AA, _, _, _, _, _, _ = _sky_point(td_amp, pixel_offsets[k], pixel_offsets[k + 1], nr, FP, FX, ml, l,
+                                                 En, Es, sub_cut, False, no_xtalk_lookup, no_xtalk)
+        if valid:
+            stat[k, l] = AA
+    return stat
+
+
+def _hierarchical_sky_scan(td_amp, pixel_offsets, nr, sky, En, Es, sub_cut):
+    """
+    first sky loop of network::subNetCut with the coarse-to-fine sky search, the levels of the search run
+    in lockstep for all the clusters so that each level is one parallel call over (cluster, sky location)
+
+    :return: subnet statistic with threshold (n_cluster, n_sky), 0 for the sky locations not evaluated
+    """
+    n_cluster = len(pixel_offsets) - 1
+
+    def evaluate(locations):
+        clusters = np.repeat(np.arange(n_cluster, dtype=np.int32), [len(c) for c in locations])
+        offsets = np.zeros(n_cluster + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in locations], out=offsets[1:])
+        AA = _sky_scan_pairs(td_amp, pixel_offsets, nr, sky.FP, sky.FX, sky.ml, clusters,
+                             np.concatenate(locations).astype(np.int32), En, Es, sub_cut)
+        return [AA[offsets[k]:offsets[k + 1]] for k in range(n_cluster)]
+
+    candidates, n_evaluated = sky.hierarchy.search_batch(evaluate, [sky.sky_mask] * n_cluster)
+    # no cell passed the sky loop threshold, fall back to the exhaustive scan
+    candidates = [c if c is not None else np.flatnonzero(sky.sky_mask) for c in candidates]
+
+    statistic = evaluate(candidates)
+    stat = np.zeros((n_cluster, len(sky.sky_mask)), dtype=np.float64)
+    for k in range(n_cluster):
+        stat[k, candidates[k]] = np.where(np.isfinite(statistic[k]), statistic[k], 0.)
+
+    if sky.search_validate:
+        reference = _sky_scan(td_amp, pixel_offsets, nr, sky.FP, sky.FX, sky.ml, sky.sky_mask, En, Es, sub_cut)
+        for k in range(n_cluster):
+            lm, reference_lm = np.argmax(stat[k]), np.argmax(reference[k])
+            sky_search_report(sky.likelihood_map, lm if stat[k, lm] > 0 else -1, stat[k, lm],
+                              reference_lm if reference[k, reference_lm] > 0 else -1, reference[k, reference_lm],
+                              n_evaluated[k] + len(candidates[k]), int(np.count_nonzero(sky.sky_mask)))
+    return stat
+
+
+@njit(cache=True, parallel=True)
+def _sky_scan_pairs(td_amp, pixel_offsets, nr, FP, FX, ml, clusters, locations, En, Es, sub_cut):
+    """
+    first sky loop of network::subNetCut at the given (cluster, sky location) pairs, parallel over the pairs
+
+    :return: subnet statistic with threshold of each pair, -inf for the skipped pairs
+    """
+    AA = np.full(len(clusters), -np.inf, dtype=np.float64)
+    no_xtalk_lookup = np.empty((0, 2), dtype=np.int64)
+    no_xtalk = np.empty((0, 8), dtype=np.float32)
+    for n in prange(len(clusters)):
+        k = clusters[n]
+        valid, aa, _, _, _, _, _, _ = _sky_point(td_amp, pixel_offsets[k], pixel_offsets[k + 1], nr, FP, FX, ml,
+                                                 locations[n], En, Es, sub_cut, False, no_xtalk_lookup, no_xtalk)
+        if valid:
+            AA[n] = aa
+    return AA
+
+
+@njit(cache=True, parallel=True)
+def _cluster_cut(td_amp, pixel_offsets, nr, FP, FX, ml, stat, xtalk_lookup, xtalk,
+                 En, Es, sub_cut, sub_net, sub_norm, net_rho):
+    """
+    MRA pass at the best sky location and selection of each cluster, parallel over the clusters
+    """
+    n_cluster = len(pixel_offsets) - 1
+    sky_index = np.full(n_cluster, -1, dtype=np.int32)
+    likenet = np.zeros(n_cluster, dtype=np.float32)
+    energy = np.zeros(n_cluster, dtype=np.float32)
+    mra = np.zeros(n_cluster, dtype=np.bool_)
+    submra = np.zeros(n_cluster, dtype=np.float32)
+    submra_null = np.zeros(n_cluster, dtype=np.float32)
+    suball = np.zeros(n_cluster, dtype=np.float32)
+    suball_null = np.zeros(n_cluster, dtype=np.float32)
+    rejected = np.ones(n_cluster, dtype=np.bool_)
+    for k in prange(n_cluster):
+        p0, p1 = pixel_offsets[k], pixel_offsets[k + 1]
+        # the first location with the largest positive statistic, as in the sky loop
+        lm = np.argmax(stat[k])
+        if stat[k, lm] <= 0:
+            continue
+        sky_index[k] = lm
+        _, _, Lm, Em, _, _, sub_all, sub_all_null = _sky_point(td_amp, p0, p1, nr, FP, FX, ml, lm, En, Es, sub_cut,
+                                                              False, xtalk_lookup, xtalk)
+        likenet[k] = Lm
+        energy[k] = Em
+        suball[k] = sub_all
+        suball_null[k] = sub_all_null
+        # early exit, min(suball, submra) > sub_net can not be satisfied
+        if not sub_all > sub_net:
+            continue
+
+        valid, _, Lo, Eo, Ls, m, _, _ = _sky_point(td_amp, p0, p1, nr, FP, FX, ml, lm, En, Es, sub_cut,
+                                                   True, xtalk_lookup, xtalk)
+        # no principal component above the threshold, the cluster is rejected
+        if not valid:
+            continue
+        mra[k] = True
+        sub_mra = Ls * Eo / (Eo - Ls)
+        submra_null[k] = abs(Eo - Lo) + 2 * (m + 6)
+        sub_mra /= abs(sub_mra) + submra_null[k]
+        submra[k] = sub_mra
+        rho = sqrt(Lo * Lo / (Eo + 2 * m) / 2)
+        rejected[k] = not (min(sub_all, sub_mra) > sub_net and rho > net_rho and Em > sub_norm * Eo)
+    return sky_index, likenet, energy, mra, submra, submra_null, suball, suball_null, rejected
@@ -1,17 +1,21 @@
-import copy
-
 import logging
 import time
-from pycwb.modules.cwb_conversions import convert_fragment_clusters_to_netcluster, convert_sparse_series_to_sseries, \
-    convert_netcluster_to_fragment_clusters
+from multiprocessing import get_context
+
+import numpy as np
+import ROOT
+from pycwb.modules.cwb_conversions import convert_sparse_series_to_sseries
 from pycwb.modules.sparse_series import sparse_table_from_fragment_clusters
 from pycwb.modules.multi_resolution_wdm import create_wdm_for_level
 from pycwb.types.network_cluster import FragmentCluster
+from pycwb.types.netcluster_handle import NetClusterHandle
+from pycwb.modules.likelihoodWP.likelihood import NetworkSky
+from .sub_net_cut import sub_net_cut
 
 logger = logging.getLogger(__name__)
 
 
-def supercluster(config, network, fragment_clusters, tf_maps):
+def supercluster(config, network, fragment_clusters, tf_maps, tf_map_cache=None):
     """
     Multi resolution clustering & Rejection of the sub-threshold clusters
 
@@ -29,16 +33,21 @@ def supercluster(config, network, fragment_clusters, tf_maps):
     :param wdm_list: list of wavelets
     :type wdm_list: list[WDM]
     :param fragment_clusters: fragment clusters
-    :type fragment_clusters: list[FragmentCluster]
+    :type fragment_clusters: list[FragmentCluster or NetClusterHandle]
     :param sparse_table_list: list of sparse tables
     :type sparse_table_list: list[SparseTimeFrequencySeries]
-    :return: the list of clusters
-    :rtype: list[FragmentCluster]
+    :param tf_map_cache: cache of forward transformed maps filled in coherence
+    :type tf_map_cache: TFMapCache, optional
+    :return: the selected clusters of each lag, kept in native netclusters
+    :rtype: list[NetClusterHandle]
     """
     # timer
     timer_start = time.perf_counter()
 
-    sparse_table_list = sparse_table_from_fragment_clusters(config, tf_maps, fragment_clusters)
+    handles = [NetClusterHandle.wrap(fragment_cluster) for fragment_cluster in fragment_clusters]
+    # the core pixels are read from the native netclusters, the clusters are not converted to python
+    sparse_table_list = sparse_table_from_fragment_clusters(config, tf_maps, handles,
+                                                            parallel=config.nproc > 1, tf_map_cache=tf_map_cache)
 
     # decrease skymap resolution to improve subNetCut performances
     if config.healpix > 0:
@@ -47,9 +56,8 @@ def supercluster(config, network, fragment_clusters, tf_maps):
         raise NotImplementedError("Only healpix is supported")
 
     if skyres > 0:
+        # the antenna patterns and delays are set by update_sky_map, from the sky tables when available
         network.update_sky_map(config, skyres)
-        network.net.setAntenna()
-        network.net.setDelay(config.refIFO)
         network.update_sky_mask(config, skyres)
 
     hot = []
@@ -63,19 +71,14 @@ def supercluster(config, network, fragment_clusters, tf_maps):
         # add wavelets to network
         network.add_wavelet(wdm)
 
-    # merge cluster
-    cluster = copy.deepcopy(fragment_clusters[0])
-    if len(fragment_clusters) > 1:
-        for fragment_cluster in fragment_clusters[1:]:
-            cluster.clusters += fragment_cluster.clusters
-
-    pwc_list = []
-
     ###############################
     # cWB2G supercluster
     ###############################
-    # convert to netcluster
-    cluster = convert_fragment_clusters_to_netcluster(cluster)
+    # merge the clusters of all the resolutions in a native netcluster, the header is the one of the first
+    cluster = ROOT.netcluster()
+    ROOT.pycwb_copy_netcluster(cluster, handles[0].netcluster)
+    for handle in handles[1:]:
+        ROOT.pycwb_append_netcluster(cluster, handle.netcluster)
 
     # read sparse map to detector for pwc.loadTDampSSE
     for n in range(config.nIFO):
@@ -84,71 +87,23 @@ def supercluster(config, network, fragment_clusters, tf_maps):
         for sparse_table in sparse_table_list:
             det.vSS.push_back(convert_sparse_series_to_sseries(sparse_table[n]))
 
-    for j in range(int(network.nLag)):
-        # cycle = cfg.simulation ? ifactor : Long_t(NET.wc_List[j].shift);
-        cycle = int(network.get_cluster(j).shift)
-        cycle_name = f"lag={cycle}"
-
-        logger.info("-> Processing %s ...", cycle_name)
-        logger.info("   --------------------------------------------------")
-        logger.info("    coher clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
-
-        if config.l_high == config.l_low:
-            cluster.pair = False
-        if network.pattern != 0:
-            cluster.pair = False
-
-        cluster.supercluster('L',network.net.e2or,config.TFgap,False)
-        logger.info("    super clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
-
-        # defragmentation for pattern != 0
-        if network.pattern != 0:
-            cluster.defragment(config.Tgap, config.Fgap)
-            logger.info("   defrag clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
-
-        # copy selected clusters to network
-        pwc = network.get_cluster(j)
-        pwc.cpf(cluster, False)
-
-        # apply subNetCut() only for pattern=0 || cfg.subnet>0 || cfg.subcut>0 || cfg.subnorm>0 || cfg.subrho>=0
-        if network.pattern == 0 or config.subnet > 0 or config.subcut > 0 or config.subnorm > 0 or config.subrho >= 0:
-            # set Acore and netRHO
-            if config.subacor > 0:
-                network.net.acor = config.subacor
-            if config.subrho > 0:
-                network.net.netRHO = config.subrho
-
-            network.set_delay_index(hot[0].rate())
-            pwc.setcore(False)
-
-            psel = 0
-            while True:
-                # TODO: pythonize this
-                count = pwc.loadTDampSSE(network.net, 'a', config.BATCH, config.LOUD)
-                psel += network.sub_net_cut(j, config.subnet, config.subcut, config.subnorm)
-                if count < 10000:
-                    break
-            logger.info("   subnet clusters|pixels      : %6d|%d", network.n_events, pwc.psize(-1))
-
-            # restore Acore and netRHO
-            if config.subacor > 0:
-                network.net.acor = config.Acore
-            if config.subrho > 0:
-                network.net.netRHO = config.netRHO
-
-        if network.pattern == 0:
-            # TODO: pythonize this
-            pwc.defragment(config.Tgap, config.Fgap)
-            logger.info("   defrag clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
-
-        # convert to FragmentCluster and append to list
-        fragment_cluster = convert_netcluster_to_fragment_clusters(pwc)
-
-        # remove rejected clusters as done in netcluster.cpf()
-        fragment_cluster.remove_rejected()
-        pwc_list.append(fragment_cluster)
-
-        pwc.clear()
+    # sky arrays for the numba subNetCut, shared by all the lags
+    sky = None
+    if config.subnet_cut_backend == "numba":
+        network.set_delay_index(hot[0].rate())
+        if NetworkSky.supported(network):
+            sky = NetworkSky(network, config.MRAcatalog, config.sky_search_order, config.sky_search_top,
+                             config.sky_search_margin, config.sky_search_validate, config.xtalk_catalog_cache,
+                             config.likelihood_precision)
+        else:
+            logger.warning("subNetCut with celestial sky mask is only supported by the root backend")
+
+    n_lag = int(network.nLag)
+    n_workers = min(config.nproc, n_lag) if config.supercluster_lag_parallel else 1
+    if n_workers > 1:
+        pwc_list = _supercluster_lags_parallel(config, network, cluster, hot, n_lag, n_workers, sky)
+    else:
+        pwc_list = [_supercluster_lag(config, network, cluster, hot, j, sky) for j in range(n_lag)]
     ###############################
 
     n_event = sum([c.event_count() for c in pwc_list])
@@ -173,3 +128,124 @@ def supercluster(config, network, fragment_clusters, tf_maps):
     logger.info("----------------------------------------")
 
     return pwc_list
+
+
+def _supercluster_lag(config, network, merged, hot, j, sky=None):
+    """
+    Supercluster, subNetCut and defragmentation for one lag
+
+    :param config: user configuration
+    :type config: Config
+    :param network: network
+    :type network: Network
+    :param merged: clusters of all the resolutions merged in a netcluster, shared by the lags and left untouched
+    :type merged: ROOT.netcluster
+    :param hot: whitened time series of the detectors
+    :type hot: list[ROOT.wavearray]
+    :param j: lag index
+    :type j: int
+    :param sky: sky arrays for the numba subNetCut, None to use network::subNetCut
+    :type sky: NetworkSky, optional
+    :return: the selected clusters of the lag
+    :rtype: NetClusterHandle
+    """
+    # cycle = cfg.simulation ? ifactor : Long_t(NET.wc_List[j].shift);
+    cycle = int(network.get_cluster(j).shift)
+    cycle_name = f"lag={cycle}"
+
+    logger.info("-> Processing %s ...", cycle_name)
+    logger.info("   --------------------------------------------------")
+
+    # netcluster::supercluster and defragment work in place, each lag processes its own copy
+    cluster = ROOT.netcluster()
+    ROOT.pycwb_copy_netcluster(cluster, merged)
+    logger.info("    coher clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
+
+    if config.l_high == config.l_low:
+        cluster.pair = False
+    if network.pattern != 0:
+        cluster.pair = False
+
+    cluster.supercluster('L',network.net.e2or,config.TFgap,False)
+    logger.info("    super clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
+
+    # defragmentation for pattern != 0
+    if network.pattern != 0:
+        cluster.defragment(config.Tgap, config.Fgap)
+        logger.info("   defrag clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
+
+    # copy selected clusters to network
+    pwc = network.get_cluster(j)
+    pwc.cpf(cluster, False)
+
+    # apply subNetCut() only for pattern=0 || cfg.subnet>0 || cfg.subcut>0 || cfg.subnorm>0 || cfg.subrho>=0
+    if network.pattern == 0 or config.subnet > 0 or config.subcut > 0 or config.subnorm > 0 or config.subrho >= 0:
+        # set Acore and netRHO
+        if config.subacor > 0:
+            network.net.acor = config.subacor
+        if config.subrho > 0:
+            network.net.netRHO = config.subrho
+
+        network.set_delay_index(hot[0].rate())
+        pwc.setcore(False)
+
+        psel = 0
+        while True:
+            # TODO: pythonize this
+            count = pwc.loadTDampSSE(network.net, 'a', config.BATCH, config.LOUD)
+            if sky is not None:
+                psel += sub_net_cut(network, j, sky, config.subnet, config.subcut, config.subnorm)
+            else:
+                psel += network.sub_net_cut(j, config.subnet, config.subcut, config.subnorm)
+            if count < 10000:
+                break
+        logger.info("   subnet clusters|pixels      : %6d|%d", network.n_events, pwc.psize(-1))
+
+        # restore Acore and netRHO
+        if config.subacor > 0:
+            network.net.acor = config.Acore
+        if config.subrho > 0:
+            network.net.netRHO = config.netRHO
+
+    if network.pattern == 0:
+        # TODO: pythonize this
+        pwc.defragment(config.Tgap, config.Fgap)
+        logger.info("   defrag clusters|pixels      : %6d|%d", cluster.esize(0), cluster.psize(0))
+
+    # keep a native copy without the rejected clusters (as done in netcluster.cpf()) for likelihood
+    handle = NetClusterHandle.from_netcluster(pwc, rejected=False)
+
+    pwc.clear()
+    cluster.clear()
+    return handle
+
+
+# state inherited by the forked lag workers
+_lag_state = {}
+
+
+def _supercluster_lags_parallel(config, network, cluster, hot, n_lag, n_workers, sky=None):
+    """
+    Process the lags in forked workers, each worker owns a copy-on-write clone of the network (detectors,
+    sparse tables, sky delays and antenna patterns) and of the merged clusters, and processes a contiguous
+    chunk of lags. The results are returned in lag order.
+
+    :return: the selected clusters of each lag
+    :rtype: list[NetClusterHandle]
+    """
+    chunks = [chunk.tolist() for chunk in np.array_split(np.arange(n_lag), n_workers)]
+    _lag_state.update(config=config, network=network, cluster=cluster, hot=hot, sky=sky)
+    try:
+        with get_context('fork').Pool(processes=n_workers) as pool:
+            results = pool.map(_supercluster_lag_chunk, chunks, chunksize=1)
+    finally:
+        _lag_state.clear()
+    # the handles come back with their python view, the netclusters are rebuilt only if needed
+    return [handle for chunk in results for handle in chunk]
+
+
+def _supercluster_lag_chunk(lags):
+    state = _lag_state
+    return [_supercluster_lag(state['config'], state['network'], state['cluster'], state['hot'], j, state['sky'])
+            for j in lags]
+
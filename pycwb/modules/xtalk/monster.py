@@ -1,49 +1,124 @@
-import struct
+import os
+import uuid
+from collections import namedtuple
+
 import numpy as np
-from numba import njit
+from numba import njit, prange
+from pycwb.types.network_pixel import PixelTable
 
 
-def load_catalog(fn):
-    with open(fn, "rb") as f:
-        data = f.read()  # Read the entire file into memory
+# catalogs loaded in this process, shared by the forked workers
+_catalogs = {}
 
-    offset = 0
+CatalogHeader = namedtuple('CatalogHeader', ['nRes', 'layers', 'tag', 'BetaOrder', 'precision', 'KWDM'])
 
-    def unpack(fmt):
-        nonlocal offset
-        result = struct.unpack_from(fmt, data, offset)
-        offset += struct.calcsize(fmt)
-        return result
 
-    nRes = int(unpack('f')[0])
+def read_catalog_header(fn):
+    """
+    Read the header of a MRA catalog without the cross-talk coefficients
 
+    :param fn: path of the MRA catalog
+    :type fn: str
+    :return: header, with the field names of the ROOT monster
+    :rtype: CatalogHeader
+    """
+    with open(fn, "rb") as f:
+        return _read_header(f.read)
+
+
+def _read_header(read):
+    # read(n) returns the next n bytes of the catalog
+    nRes = int(np.frombuffer(read(4), dtype=np.float32)[0])
     if nRes < 0:
         nRes = -nRes
-        tag, BetaOrder, precision, KWDM = unpack('4f')
+        tag, BetaOrder, precision, KWDM = np.frombuffer(read(16), dtype=np.float32)
     else:
         tag, BetaOrder, precision, KWDM = 0, 0, 0, 0
+    layers = np.frombuffer(read(4 * nRes), dtype=np.float32).astype(np.int64)
+    return CatalogHeader(nRes, layers, tag, BetaOrder, precision, KWDM)
+
+
+def load_catalog(fn, cache_dir=None):
+    """
+    Load a MRA catalog. The coefficients of each lookup bucket are sorted by index so that getXTalk can use
+    a binary search. The catalog is converted once per process, if cache_dir is given the converted arrays
+    are saved as .npy files and memory mapped by the following jobs.
+
+    :param fn: path of the MRA catalog
+    :type fn: str
+    :param cache_dir: cache directory of the converted catalogs, None to keep them only in memory
+    :type cache_dir: str, optional
+    :return: coefficients (n, 5) with the index in the first column, lookup table of the buckets, layers and
+             number of resolutions
+    :rtype: tuple
+    """
+    stat = os.stat(fn)
+    key = f"{os.path.basename(fn)}-{stat.st_size}-{stat.st_mtime_ns}"
+    if (key, cache_dir) in _catalogs:
+        return _catalogs[(key, cache_dir)]
 
-    layers = [int(unpack('f')[0]) for _ in range(nRes)]
-    max_layers = max(layers)
-    lookup_table = np.zeros((nRes, nRes, max_layers + 1, 2, 2), dtype=np.int32)
-    xtalk_coeff = []
+    path = os.path.join(cache_dir, key) if cache_dir else None
+    arrays = _load_arrays(path) if path else None
+    if arrays is None:
+        arrays = _convert_catalog(fn)
+        if path:
+            _save_arrays(path, arrays)
+    catalog = arrays['xtalk_coeff'], arrays['lookup_table'], arrays['layers'], int(len(arrays['layers']))
+    _catalogs[(key, cache_dir)] = catalog
+    return catalog
+
+
+def _convert_catalog(fn):
+    # parse the catalog and sort the coefficients of each bucket by index
+    with open(fn, "rb") as f:
+        data = f.read()  # Read the entire file into memory
+
+    offset = 0
+
+    def read(n):
+        nonlocal offset
+        offset += n
+        return data[offset - n:offset]
+
+    header = _read_header(read)
+    layers = header.layers
+    entry = np.dtype([('index', '<i4'), ('CC', '<f4', 4)])
+    lookup_table = np.zeros((header.nRes, header.nRes, layers.max() + 1, 2, 2), dtype=np.int32)
+    parts = []
     entry_index = 0
-    for i in range(nRes):
+    for i in range(header.nRes):
         for j in range(i + 1):
             for k in range(layers[i] + 1):
                 for l in range(2):
-                    oa_size = int(unpack('f')[0])
-                    oa_data = np.frombuffer(data, dtype=np.dtype([('index', 'i'), ('CC', '4f')]), count=oa_size,
-                                            offset=offset).tolist()
-                    offset += oa_size * struct.calcsize('i4f')
+                    oa_size = int(np.frombuffer(read(4), dtype=np.float32)[0])
+                    parts.append(np.frombuffer(read(oa_size * entry.itemsize), dtype=entry))
                     lookup_table[i, j, k, l, 0] = entry_index
-                    for entry in oa_data:
-                        xtalk_coeff.append(
-                            np.array([entry[0], entry[1][0], entry[1][1], entry[1][2], entry[1][3]], dtype=np.float32))
-                        entry_index += 1
+                    entry_index += oa_size
                     lookup_table[i, j, k, l, 1] = entry_index
 
-    return np.array(xtalk_coeff), lookup_table, np.array(layers), nRes
+    entries = np.concatenate(parts) if parts else np.zeros(0, dtype=entry)
+    bucket = np.repeat(np.arange(len(parts)), [len(x) for x in parts])
+    entries = entries[np.lexsort((entries['index'], bucket))]
+    xtalk_coeff = np.empty((len(entries), 5), dtype=np.float32)
+    xtalk_coeff[:, 0] = entries['index']
+    xtalk_coeff[:, 1:] = entries['CC']
+    return {'xtalk_coeff': xtalk_coeff, 'lookup_table': lookup_table, 'layers': layers}
+
+
+def _save_arrays(path, arrays):
+    # write to a temporary file and rename, so that concurrent jobs never read a partial file
+    os.makedirs(path, exist_ok=True)
+    for name, value in arrays.items():
+        tmp = os.path.join(path, f".{name}.{uuid.uuid4().hex}.npy")
+        np.save(tmp, value)
+        os.replace(tmp, os.path.join(path, f"{name}.npy"))
+
+
+def _load_arrays(path):
+    files = {name: os.path.join(path, f"{name}.npy") for name in ('xtalk_coeff', 'lookup_table', 'layers')}
+    if not all(os.path.exists(f) for f in files.values()):
+        return None
+    return {name: np.load(f, mmap_mode='r') for name, f in files.items()}
 
 
 @njit(cache=True)
@@ -72,16 +147,22 @@ def getXTalk(nLayer1, indx1, nLayer2, indx2, layers, xtalk_coeff, xtalk_lookup_t
     # Vector retrieval and processing
     ret = np.array([3.0, 3.0, 3.0, 3.0], dtype=np.float32)  # Preset array
     entry_index = xtalk_lookup_table[r1][r2][freq1][odd]
-    for item in xtalk_coeff[entry_index[0]:entry_index[1]]:
-        if index == int(item[0]):
-            ret[0] = item[1]
-            ret[1] = item[2]
-            ret[2] = item[3]
-            ret[3] = item[4]
+    # binary search, the coefficients of each bucket are sorted by index
+    lo, hi = entry_index[0], entry_index[1]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if xtalk_coeff[mid, 0] < index:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < entry_index[1] and index == int(xtalk_coeff[lo, 0]):
+        ret[0] = xtalk_coeff[lo, 1]
+        ret[1] = xtalk_coeff[lo, 2]
+        ret[2] = xtalk_coeff[lo, 3]
+        ret[3] = xtalk_coeff[lo, 4]
 
-            if swap:
-                ret[1], ret[2] = ret[2], ret[1]
-            break
+        if swap:
+            ret[1], ret[2] = ret[2], ret[1]
 
     return ret
 
@@ -107,7 +188,7 @@ def getXTalk_pixels_np(pixels, check, layers, xtalk_coeff, xtalk_lookup_table):
             clusterCC[index_counter][0] = float(M - 1)
             clusterCC[index_counter][1] = tmpOvlp[0] ** 2 + tmpOvlp[1] ** 2
             clusterCC[index_counter][2] = tmpOvlp[2] ** 2 + tmpOvlp[3] ** 2
-            clusterCC[index_counter][3] = clusterCC[i * n_pix + j][1] + clusterCC[i * n_pix + j][2]
+            clusterCC[index_counter][3] = clusterCC[index_counter][1] + clusterCC[index_counter][2]
             clusterCC[index_counter][4] = tmpOvlp[0]
             clusterCC[index_counter][5] = tmpOvlp[2]
             clusterCC[index_counter][6] = tmpOvlp[1]
@@ -121,8 +202,130 @@ def getXTalk_pixels_np(pixels, check, layers, xtalk_coeff, xtalk_lookup_table):
     return clusterCC_lookup, clusterCC[0:index_counter]
 
 
+@njit(cache=True)
+def xtalk_support(layers, xtalk_coeff, xtalk_lookup_table):
+    """
+    largest |index| of the cross-talk coefficients of each pair of resolutions (r1 >= r2), -1 if there is none,
+    used by getXTalk_pixels_pruned to bound the time separation of the overlapping pixels
+    """
+    n_res = len(layers)
+    support = np.full((n_res, n_res), -1, dtype=np.int64)
+    for r1 in range(n_res):
+        for r2 in range(r1 + 1):
+            for k in range(layers[r1] + 1):
+                for odd in range(2):
+                    for e in range(xtalk_lookup_table[r1, r2, k, odd, 0], xtalk_lookup_table[r1, r2, k, odd, 1]):
+                        support[r1, r2] = max(support[r1, r2], abs(int(xtalk_coeff[e, 0])))
+    return support
+
+
+@njit(cache=True)
+def _time_window(indx, t, r, r2, layers, support):
+    # range of the pixel time at resolution r2 which can overlap the pixel (indx, t) at resolution r,
+    # bounded with the index arithmetic of getXTalk
+    if r >= r2:
+        S = support[r, r2]
+        if S < 0:
+            return 0, -1
+        base = (t - (t & 1)) * (layers[r] // layers[r2]) * (layers[r2] + 1)
+        return (base - S) // (layers[r2] + 1), (base + S) // (layers[r2] + 1)
+    S = support[r2, r]
+    if S < 0:
+        return 0, -1
+    f = (layers[r2] // layers[r]) * (layers[r] + 1)
+    if f == 0:
+        return -(1 << 62), 1 << 62
+    return -((S - indx) // f), (indx + S) // f + 1
+
+
+@njit(cache=True, parallel=True)
+def getXTalk_pixels_pruned(pixels, layers, xtalk_coeff, xtalk_lookup_table, support):
+    """
+    cross-talk coefficients of the overlapping pixel pairs of a cluster, same result as getXTalk_pixels_np.
+    The pixels are bucketed by resolution and time, only the pairs within the time support of the catalog
+    (xtalk_support) are tested, so the memory and time scale with the number of neighbours instead of
+    n_pix * n_pix.
+
+    :return: range of the coefficients of each pixel (n_pix, 2) and coefficients (n, 8)
+    """
+    n_pix = len(pixels)
+    n_res = len(layers)
+    res = np.empty(n_pix, dtype=np.int64)
+    time = np.empty(n_pix, dtype=np.int64)
+    for i in range(n_pix):
+        r = -1
+        for k in range(n_res):
+            if layers[k] == pixels[i, 0] - 1:
+                r = k
+        if r == -1:
+            raise ValueError("Resolution not found in layers")
+        res[i] = r
+        time[i] = pixels[i, 1] // (layers[r] + 1)
+
+    # pixels sorted by resolution and time
+    t_min = time.min() if n_pix else 0
+    t_span = time.max() - t_min + 1 if n_pix else 1
+    order = np.argsort(res * t_span + time - t_min, kind='mergesort')
+    sorted_time = time[order]
+    res_offsets = np.searchsorted(res[order], np.arange(n_res + 1))
+
+    # candidate neighbours of each pixel
+    window = np.zeros((n_pix, n_res, 2), dtype=np.int64)
+    count = np.zeros(n_pix + 1, dtype=np.int64)
+    for i in prange(n_pix):
+        for r2 in range(n_res):
+            a, b = res_offsets[r2], res_offsets[r2 + 1]
+            t0, t1 = _time_window(pixels[i, 1], time[i], res[i], r2, layers, support)
+            if t1 < t0:
+                continue
+            window[i, r2, 0] = a + np.searchsorted(sorted_time[a:b], t0)
+            window[i, r2, 1] = a + np.searchsorted(sorted_time[a:b], t1, side='right')
+            count[i + 1] += window[i, r2, 1] - window[i, r2, 0]
+    offsets = np.cumsum(count)
+
+    # coefficients of the candidates, in the order of the pixels as in getXTalk_pixels_np
+    rows = np.empty((offsets[-1], 8), dtype=np.float32)
+    found = np.zeros(n_pix + 1, dtype=np.int64)
+    for i in prange(n_pix):
+        candidates = np.empty(offsets[i + 1] - offsets[i], dtype=np.int64)
+        c = 0
+        for r2 in range(n_res):
+            for k in range(window[i, r2, 0], window[i, r2, 1]):
+                candidates[c] = order[k]
+                c += 1
+        candidates.sort()
+        m = offsets[i]
+        for j in candidates:
+            tmpOvlp = getXTalk(pixels[i, 0], pixels[i, 1], pixels[j, 0], pixels[j, 1], layers, xtalk_coeff,
+                               xtalk_lookup_table)
+            if tmpOvlp[0] > 2:
+                continue
+            rows[m, 0] = float(j)
+            rows[m, 1] = tmpOvlp[0] ** 2 + tmpOvlp[1] ** 2
+            rows[m, 2] = tmpOvlp[2] ** 2 + tmpOvlp[3] ** 2
+            rows[m, 3] = rows[m, 1] + rows[m, 2]
+            rows[m, 4] = tmpOvlp[0]
+            rows[m, 5] = tmpOvlp[2]
+            rows[m, 6] = tmpOvlp[1]
+            rows[m, 7] = tmpOvlp[3]
+            m += 1
+        found[i + 1] = m - offsets[i]
+
+    lookup = np.empty((n_pix, 2), dtype=np.int32)
+    found = np.cumsum(found)
+    clusterCC = np.empty((found[-1], 8), dtype=np.float32)
+    for i in prange(n_pix):
+        lookup[i, 0] = found[i]
+        lookup[i, 1] = found[i + 1]
+        clusterCC[found[i]:found[i + 1]] = rows[offsets[i]:offsets[i] + found[i + 1] - found[i]]
+    return lookup, clusterCC
+
+
 def getXTalk_pixels(pixels, check, layers, xtalk_coeff, xtalk_lookup_table):
-    pixels_np = np.array([[pix.layers, pix.time] for pix in pixels])
+    if isinstance(pixels, PixelTable):
+        pixels_np = np.stack([pixels.layers, pixels.time], axis=1)
+    else:
+        pixels_np = np.array([[pix.layers, pix.time] for pix in pixels])
 
     clusterCC_lookup, clusterCC = getXTalk_pixels_np(pixels_np, check, layers, xtalk_coeff, xtalk_lookup_table)
 
@@ -8,7 +8,7 @@ import pycwb
 import matplotlib.pyplot as plt
 
 from pycwb.modules.plot.waveform import plot_reconstructed_waveforms
-from pycwb.utils.dataclass_object_io import save_dataclass_to_json
+from pycwb.utils.dataclass_object_io import save_dataclass_to_json, save_skymap_statistics_to_npz
 from pycwb.utils.dep_check import check_dependencies
 
 if check_dependencies(['autoencoder', 'reconstruction', 'logger', 'read_data', 'data_conditioning', 'coherence',
@@ -23,6 +23,7 @@ from pycwb.modules.logger import logger_init
 from pycwb.modules.read_data import read_from_job_segment, generate_injection
 from pycwb.modules.data_conditioning import data_conditioning
 from pycwb.modules.coherence import coherence
+from pycwb.modules.multi_resolution_wdm import TFMapCache
 from pycwb.modules.super_cluster import supercluster
 from pycwb.modules.likelihood import likelihood
 from pycwb.modules.job_segment import create_job_segment_from_config
@@ -73,15 +74,19 @@ def analyze_job_segment(config, job_seg, plot, compress_json):
     # data conditioning
     tf_maps, nRMS_list = data_conditioning(config, data)
 
+    # forward transforms shared by coherence and supercluster
+    tf_map_cache = TFMapCache(config)
+
     # calculate coherence
     # TODO: Merge resolution here?
-    fragment_clusters = coherence(config, tf_maps, nRMS_list)
+    fragment_clusters = coherence(config, tf_maps, nRMS_list, tf_map_cache=tf_map_cache)
 
     # create network
     network = Network(config, tf_maps, nRMS_list)
 
     # supercluster
-    pwc_list = supercluster(config, network, fragment_clusters, tf_maps)
+    pwc_list = supercluster(config, network, fragment_clusters, tf_maps, tf_map_cache=tf_map_cache)
+    tf_map_cache.release()
 
     # likelihood
     events, clusters, skymap_statistics = likelihood(config, network, pwc_list)
@@ -123,8 +128,8 @@ def post_production(config, job_id, event, cluster, event_skymap_statistics, plo
     # save the results
     save_dataclass_to_json(event, f'{trigger_folder}/event.json', compress_json=compress_json)
     save_dataclass_to_json(cluster, f'{trigger_folder}/cluster.json', compress_json=compress_json)
-    # save the skymap statistics as json file
-    save_dataclass_to_json(event_skymap_statistics, f'{trigger_folder}/skymap_statistics.json', compress_json=compress_json)
+    # save the skymap statistics as float32 npz file
+    save_skymap_statistics_to_npz(event_skymap_statistics, f'{trigger_folder}/skymap_statistics.npz')
     # save event to catalog
     add_events_to_catalog(f"{config.outputDir}/catalog.json", event.summary(job_id, f"{event.stop[0]}_{event.hash_id}"))
 
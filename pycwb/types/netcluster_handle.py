@@ -0,0 +1,227 @@
+import ROOT
+import numpy as np
+
+from pycwb.modules.cwb_conversions import convert_netcluster_to_fragment_clusters, \
+    convert_fragment_clusters_to_netcluster
+from pycwb.types.network_cluster import FragmentCluster
+
+
+class NetClusterHandle:
+    """
+    Handle keeping a native netcluster alive between the coherence, supercluster and likelihood stages.
+
+    The handle holds the native ``ROOT.netcluster``, the python ``FragmentCluster`` view, or both. The
+    missing side is converted on first access and cached, so the clusters are converted only if a stage
+    really needs the other representation. After the native netcluster is modified in place, call
+    :meth:`invalidate` to drop the cached view.
+
+    Attributes that are not defined on the handle (``clusters``, ``shift``, ``pixel_table``, ...) are
+    read from the view.
+
+    Parameters
+    ----------
+    netcluster : ROOT.netcluster, optional
+        native netcluster, owned by the handle
+    fragment_cluster : FragmentCluster, optional
+        python view
+    """
+
+    def __init__(self, netcluster=None, fragment_cluster=None):
+        if netcluster is None and fragment_cluster is None:
+            raise ValueError("a netcluster or a fragment cluster is required")
+        self._netcluster = netcluster
+        self._view = fragment_cluster
+
+    @classmethod
+    def from_netcluster(cls, netcluster, cluster_id=-1, rejected=True):
+        """
+        Copy a netcluster owned by someone else (e.g. the netcluster of a network lag) into a new handle
+
+        Parameters
+        ----------
+        netcluster : ROOT.netcluster
+            netcluster to copy
+        cluster_id : int, optional
+            copy only the cluster with this index, by default all the clusters
+        rejected : bool, optional
+            copy also the rejected clusters, by default True
+
+        Returns
+        -------
+        NetClusterHandle
+            handle owning the copy
+        """
+        copy = ROOT.netcluster()
+        ROOT.pycwb_copy_netcluster(copy, netcluster, cluster_id, rejected)
+        return cls(netcluster=copy)
+
+    @classmethod
+    def wrap(cls, clusters):
+        """
+        Handle of a netcluster, a fragment cluster or an existing handle
+
+        Parameters
+        ----------
+        clusters : NetClusterHandle or FragmentCluster or ROOT.netcluster
+            clusters to wrap, a netcluster is not copied
+
+        Returns
+        -------
+        NetClusterHandle
+            handle
+        """
+        if isinstance(clusters, NetClusterHandle):
+            return clusters
+        if isinstance(clusters, FragmentCluster):
+            return cls(fragment_cluster=clusters)
+        return cls(netcluster=clusters)
+
+    @property
+    def netcluster(self):
+        """
+        native netcluster, built from the view on first access
+        """
+        if self._netcluster is None:
+            self._netcluster = convert_fragment_clusters_to_netcluster(self._view)
+        return self._netcluster
+
+    @property
+    def view(self):
+        """
+        python view of the clusters, built from the native netcluster on first access
+        """
+        if self._view is None:
+            self._view = convert_netcluster_to_fragment_clusters(self._netcluster)
+        return self._view
+
+    @property
+    def n_clusters(self):
+        """
+        number of clusters, read without building the view
+        """
+        if self._view is not None:
+            return len(self._view.clusters)
+        return int(self._netcluster.cList.size())
+
+    def event_count(self, event_status=None):
+        """
+        Count number of events, read from the side which is already available
+
+        Parameters
+        ----------
+        event_status : int, optional
+            event status, None - all the clusters which are not rejected
+
+        Returns
+        -------
+        int
+            number of events
+        """
+        if self._view is not None:
+            return self._view.event_count(event_status)
+        return int(self._netcluster.esize(2 if event_status is None else event_status))
+
+    def pixel_count(self, event_status=None):
+        """
+        Count number of pixels in clusters, read from the side which is already available
+
+        Parameters
+        ----------
+        event_status : int, optional
+            event status, None - all the clusters which are not rejected
+
+        Returns
+        -------
+        int
+            number of pixels
+        """
+        if self._view is not None:
+            return self._view.pixel_count(event_status)
+        return int(self._netcluster.psize(2 if event_status is None else event_status))
+
+    def cluster_status(self, cluster_id):
+        """
+        selection flag of a cluster, read without building the view
+
+        Parameters
+        ----------
+        cluster_id : int
+            cluster index
+
+        Returns
+        -------
+        int
+            1 - rejected, 0 - not processed / accepted, -1 - not complete, -2 - ready for processing
+        """
+        if self._view is not None:
+            return self._view.clusters[cluster_id].cluster_status
+        return int(self._netcluster.sCuts[cluster_id])
+
+    def cluster_size(self, cluster_id):
+        """
+        number of pixels of a cluster, read without building the view
+
+        Parameters
+        ----------
+        cluster_id : int
+            cluster index
+
+        Returns
+        -------
+        int
+            number of pixels
+        """
+        if self._view is not None:
+            return len(self._view.clusters[cluster_id].pixel_table)
+        return int(self._netcluster.cList[cluster_id].size())
+
+    def core_pixels(self):
+        """
+        rate and detector indices of the pixels of the clusters which are not rejected, e.g. the core
+        pixels of the sparse tables, read without building the view
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            rate of each pixel, shape (n_pix,), and index in the wavearray of each detector, shape (n_pix, n_ifo)
+        """
+        if self._view is not None:
+            tables = [c.pixel_table for c in self._view.clusters if c.cluster_status != 1]
+            if not tables:
+                return np.zeros(0, dtype=np.float32), np.zeros((0, 0), dtype=np.int64)
+            return np.concatenate([t.rate for t in tables]), np.concatenate([t.index for t in tables])
+        n_pix, n_ifo = [int(n) for n in ROOT.pycwb_netcluster_layout(self._netcluster)][:2]
+        rate = np.zeros(n_pix, dtype=np.float32)
+        index = np.zeros((n_pix, n_ifo), dtype=np.int64)
+        n = int(ROOT.pycwb_export_core_pixels(self._netcluster, rate, index))
+        return rate[:n], index[:n]
+
+    def invalidate(self):
+        """
+        Drop the cached view after the native netcluster has been modified
+        """
+        if self._netcluster is None:
+            raise ValueError("the view is the only copy of the clusters")
+        self._view = None
+
+    def release(self):
+        """
+        Free the native netcluster, the view is built first so that the clusters are kept
+        """
+        if self._netcluster is not None:
+            self.view
+            self._netcluster.clear()
+            self._netcluster = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.view, name)
+
+    def __getstate__(self):
+        # the native netcluster is not pickled, the view is
+        return {'_netcluster': None, '_view': self.view}
+
+    def __setstate__(self, state):
+        self._netcluster = state['_netcluster']
+        self._view = state['_view']
@@ -2,7 +2,8 @@ import argparse, shlex
 import logging, ROOT
 
 import numpy as np
-from pycwb.modules.cwb_conversions import convert_to_wseries
+from pycwb.modules.cwb_conversions import convert_to_wseries, convert_wavearray_to_nparray
+from pycwb.types.sky_tables import get_sky_table_store
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +27,16 @@ class Network:
     def __init__(self, config, tf_list, nRMS_list, silent=False):
         self.net = ROOT.network()
         self.MRA_catalog = None
+        self.ifos = list(config.ifo)
+        self.ref_ifo = config.refIFO
+        # precomputed antenna patterns and delays, only for HEALPix sky maps
+        self.sky_tables = None
+        self.delay_rate = None
+        self._sky_table_store = None
+        # antenna patterns and delay indices read from the detectors, until the sky maps or delays change
+        self._sky_arrays = {}
+        if config.sky_table_cache is not None and config.healpix:
+            self._sky_table_store = get_sky_table_store(config.sky_table_cache or None)
 
         if silent:
             # disable logging when network is create for temporary use
@@ -269,7 +280,47 @@ class Network:
         return self.net.getDelay('MAX')
 
     def set_delay_index(self, rate):
-        self.net.setDelayIndex(rate)
+        if self.sky_tables is not None:
+            self.sky_tables.apply_delay_index(self, rate)
+        else:
+            self.net.setDelayIndex(rate)
+        self.delay_rate = rate
+        self._sky_arrays.pop('ml', None)
+
+    def antenna_patterns(self):
+        """
+        get the F+ and Fx antenna patterns of the detectors, read from the sky tables when available,
+        otherwise read from the detectors once and kept until the sky maps change
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            F+ and Fx, (n_ifo, n_sky)
+        """
+        if self.sky_tables is not None:
+            return self.sky_tables.fp, self.sky_tables.fx
+        if 'antenna' not in self._sky_arrays:
+            FP = np.array([convert_wavearray_to_nparray(self.get_ifo(i).fp) for i in range(self.ifo_size)])
+            FX = np.array([convert_wavearray_to_nparray(self.get_ifo(i).fx) for i in range(self.ifo_size)])
+            self._sky_arrays['antenna'] = (FP, FX)
+        return self._sky_arrays['antenna']
+
+    def delay_index(self):
+        """
+        get the delay indices of the detectors set by :meth:`set_delay_index`, read from the sky tables
+        when available, otherwise read from the detectors once and kept until the delays change
+
+        Returns
+        -------
+        numpy.ndarray
+            delay indices, (n_ifo, n_sky)
+        """
+        if self.sky_tables is not None and self.delay_rate is not None:
+            return self.sky_tables.delay_index(self, self.delay_rate)[0]
+        if 'ml' not in self._sky_arrays:
+            self._sky_arrays['ml'] = np.array([convert_wavearray_to_nparray(self.get_ifo(i).index, short=True)
+                                               for i in range(self.ifo_size)])
+        return self._sky_arrays['ml']
 
     def get_cluster(self, lag):
         """
@@ -331,6 +382,11 @@ class Network:
         skyres : int, optional
             sky resolution
         """
+        self._sky_arrays.clear()
+        if self._sky_table_store is not None:
+            self._set_sky_tables(int(skyres) if skyres else int(config.healpix))
+            return
+
         if skyres:
             self.net.setSkyMaps(int(skyres))
         else:
@@ -353,18 +409,31 @@ class Network:
         skyres : int, optional
             sky resolution
         """
-        if skyres:
-            if config.healpix:
-                self.net.setSkyMaps(int(config.healpix))
-            else:
-                self.net.setSkyMaps(config.angle, config.Theta1, config.Theta2, config.Phi1, config.Phi2)
-        self.net.setAntenna()
-        self.net.setDelay(config.refIFO)
+        self._sky_arrays.clear()
+        if self._sky_table_store is not None:
+            self._set_sky_tables(int(config.healpix))
+        else:
+            if skyres:
+                if config.healpix:
+                    self.net.setSkyMaps(int(config.healpix))
+                else:
+                    self.net.setSkyMaps(config.angle, config.Theta1, config.Theta2, config.Phi1, config.Phi2)
+            self.net.setAntenna()
+            self.net.setDelay(config.refIFO)
         if len(config.skyMaskFile) > 0:
             self.set_sky_mask(config, config.skyMaskFile, 'e')
         if len(config.skyMaskCCFile) > 0:
             self.set_sky_mask(config, config.skyMaskCCFile, 'c')
 
+    def _set_sky_tables(self, healpix):
+        """
+        switch the sky maps to a HEALPix order with the precomputed sky tables, the delay indices
+        have to be set again with :meth:`set_delay_index`
+        """
+        self.sky_tables = self._sky_table_store.get(self, self.ifos, self.ref_ifo, healpix)
+        self.sky_tables.apply(self)
+        self.delay_rate = None
+
     def update_sky_mask(self, config, skyres: int = None):
         """
         Update sky mask from configuration, if sky resolution is not specified, use the one in configuration
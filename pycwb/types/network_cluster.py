@@ -4,7 +4,7 @@ from dataclasses import dataclass
 import numpy as np
 from scipy.sparse import coo_array
 
-from pycwb.types.network_pixel import Pixel
+from pycwb.types.network_pixel import PixelTable
 from pycwb.utils.image import resize_resolution, align_images, merge_images
 
 
@@ -116,8 +116,8 @@ class Cluster:
 
     Parameters
     ----------
-    pixels : list of Pixel
-        list of pixels
+    pixel_table : PixelTable
+        columnar storage of the pixels
     cluster_meta : ClusterMeta
         cluster metadata
     cluster_status : int
@@ -137,7 +137,7 @@ class Cluster:
     sky_time_delay : list of float
         sky time delay
     """
-    pixels: list[Pixel]
+    pixel_table: PixelTable
     cluster_meta: ClusterMeta
     cluster_status: int
     cluster_rate: list[int]
@@ -148,6 +148,44 @@ class Cluster:
     sky_pixel_index: list[int]
     sky_time_delay: list[float]
 
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Cluster from a dict loaded from json (e.g. cluster.json), the columns of the pixel table are converted
+        to numpy arrays and the ``pixels`` list of the files written before the pixel table is converted
+        to a PixelTable
+
+        Parameters
+        ----------
+        data : dict
+            cluster fields
+
+        Returns
+        -------
+        Cluster
+            cluster
+        """
+        data = dict(data)
+        if 'pixels' in data:
+            data['pixel_table'] = PixelTable.from_pixel_dicts(data.pop('pixels'))
+        elif not isinstance(data['pixel_table'], PixelTable):
+            data['pixel_table'] = PixelTable(**data['pixel_table'])
+        if not isinstance(data['cluster_meta'], ClusterMeta):
+            data['cluster_meta'] = ClusterMeta(**data['cluster_meta'])
+        return cls(**data)
+
+    @property
+    def pixels(self):
+        """
+        Pixel objects built from the pixel table, use pixel_table directly whenever possible
+
+        Returns
+        -------
+        list of Pixel
+            list of pixels
+        """
+        return self.pixel_table.to_pixels()
+
     def get_pixel_rates(self):
         """
         Get all pixel rates
@@ -157,7 +195,7 @@ class Cluster:
         list of int
             list of pixel rates
         """
-        return [p.rate for p in self.pixels]
+        return self.pixel_table.rate.tolist()
 
     def get_pixels_with_rate(self, rate):
         """
@@ -173,7 +211,7 @@ class Cluster:
         list of Pixel
             list of pixels with selected rate
         """
-        return [p for p in self.pixels if p.rate == rate]
+        return self.pixel_table.take(self.pixel_table.rate == rate).to_pixels()
 
     def get_sparse_map_by_rate(self, key='likelihood'):
         """
@@ -190,15 +228,7 @@ class Cluster:
         dfs: list of float
             list of frequency steps
         """
-        pixels = self.pixels
-
-        # get the sort the rates
-        rates = sorted(set([p.rate for p in pixels]))
-
-        # get the pixels for each rate
-        res_layers = []
-        for r in rates:
-            res_layers.append([p for p in pixels if p.rate == r])
+        table = self.pixel_table
 
         # generate the sparse map for each rate
         v_maps = []
@@ -206,14 +236,14 @@ class Cluster:
         dfs = []
         t_starts = []
 
-        for res in res_layers:
-            one_pixel = res[0]
-            dt = 1 / one_pixel.rate
-            df = one_pixel.rate / 2
-            times = [int(p.time / p.layers) for p in res]
-            freqs = [p.frequency for p in res]
-            values = [getattr(p, key) for p in res]
-            v_map = coo_array((values, (times, freqs)), shape=(max(times) + 1, max(freqs) + 1))
+        for r in np.unique(table.rate):
+            res = table.rate == r
+            dt = 1 / r
+            df = r / 2
+            times = table.time[res] // table.layers[res]
+            freqs = table.frequency[res]
+            values = getattr(table, key)[res]
+            v_map = coo_array((values, (times, freqs)), shape=(times.max() + 1, freqs.max() + 1))
 
             # strip the zeros
             t_start = v_map.nonzero()[0].min()
@@ -314,6 +344,24 @@ class FragmentCluster:
     subnet_threshold: float
     clusters: list[Cluster]
 
+    @classmethod
+    def from_dict(cls, data):
+        """
+        FragmentCluster from a dict loaded from json, see Cluster.from_dict
+
+        Parameters
+        ----------
+        data : dict
+            fragment cluster fields
+
+        Returns
+        -------
+        FragmentCluster
+            fragment cluster
+        """
+        data = dict(data)
+        data['clusters'] = [Cluster.from_dict(c) for c in data['clusters']]
+        return cls(**data)
 
     def event_count(self, event_status=None):
         """
@@ -349,12 +397,23 @@ class FragmentCluster:
         for c in self.clusters:
             if event_status is None:
                 if c.cluster_status < 1:
-                    pixel_count += len(c.pixels)
+                    pixel_count += len(c.pixel_table)
             else:
                 if c.cluster_status == event_status:
-                    pixel_count += len(c.pixels)
+                    pixel_count += len(c.pixel_table)
         return pixel_count
 
+    def pixel_table(self):
+        """
+        Pixels of all the clusters in a single table, the cluster offsets follow the cluster list
+
+        Returns
+        -------
+        PixelTable
+            pixel table
+        """
+        return PixelTable.concatenate([c.pixel_table for c in self.clusters])
+
     def dump_cluster(self, cluster_id):
         """
         Select cluster by id
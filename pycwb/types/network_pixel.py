@@ -1,3 +1,4 @@
+import numpy as np
 from dataclasses import dataclass
 
 
@@ -122,3 +123,329 @@ class Pixel:
     def frequency_in_hz(self):
         df = self.rate / 2
         return self.frequency * df
+
+
+@dataclass
+class PixelTable:
+    """
+    Columnar storage of network pixels, one row for each pixel and one column for each detector in the
+    per-detector fields. The time domain amplitudes are stored as a ragged block: the amplitudes of pixel k
+    in detector n are ``td_amp[td_offsets[k * n_ifo + n]:td_offsets[k * n_ifo + n + 1]]``, the neighbours
+    of pixel k are ``neighbors[neighbor_offsets[k]:neighbor_offsets[k + 1]]``.
+    The pixels of cluster c are the rows ``cluster_offsets[c]:cluster_offsets[c + 1]``.
+
+    :param time: time index for master detector, shape (n_pix,)
+    :param frequency: frequency index (layer), shape (n_pix,)
+    :param layers: number of frequency layers, shape (n_pix,)
+    :param rate: wavelet layer rate, shape (n_pix,)
+    :param likelihood: likelihood, shape (n_pix,)
+    :param null: null, shape (n_pix,)
+    :param theta: source angle theta index, shape (n_pix,)
+    :param phi: source angle phi index, shape (n_pix,)
+    :param ellipticity: waveform ellipticity, shape (n_pix,)
+    :param polarisation: waveform polarisation, shape (n_pix,)
+    :param core: pixel type: true - core , false - halo, shape (n_pix,)
+    :param noise_rms: average noise rms, shape (n_pix, n_ifo)
+    :param wave: 00 pixel's wavelet amplitudes, shape (n_pix, n_ifo)
+    :param w_90: 90 pixel's wavelet amplitudes, shape (n_pix, n_ifo)
+    :param asnr: 00 pixel's whitened amplitudes, shape (n_pix, n_ifo)
+    :param a_90: 90 pixel's whitened amplitudes, shape (n_pix, n_ifo)
+    :param rank: pixel's rank amplitudes, shape (n_pix, n_ifo)
+    :param index: index in wavearray, shape (n_pix, n_ifo)
+    :param td_amp: time domain amplitudes of all the pixels and detectors
+    :param td_offsets: offsets in td_amp, shape (n_pix * n_ifo + 1,)
+    :param neighbors: neighbours of all the pixels
+    :param neighbor_offsets: offsets in neighbors, shape (n_pix + 1,)
+    :param cluster_offsets: first row of each cluster, shape (n_cluster + 1,)
+    """
+    time: np.ndarray
+    frequency: np.ndarray
+    layers: np.ndarray
+    rate: np.ndarray
+    likelihood: np.ndarray
+    null: np.ndarray
+    theta: np.ndarray
+    phi: np.ndarray
+    ellipticity: np.ndarray
+    polarisation: np.ndarray
+    core: np.ndarray
+    noise_rms: np.ndarray
+    wave: np.ndarray
+    w_90: np.ndarray
+    asnr: np.ndarray
+    a_90: np.ndarray
+    rank: np.ndarray
+    index: np.ndarray
+    td_amp: np.ndarray
+    td_offsets: np.ndarray
+    neighbors: np.ndarray
+    neighbor_offsets: np.ndarray
+    cluster_offsets: np.ndarray
+
+    # columns with one value for each pixel, and with one value for each (pixel, detector)
+    PIXEL_FIELDS = ('time', 'frequency', 'layers', 'rate', 'likelihood', 'null', 'theta', 'phi',
+                    'ellipticity', 'polarisation', 'core')
+    IFO_FIELDS = ('noise_rms', 'wave', 'w_90', 'asnr', 'a_90', 'rank', 'index')
+    DTYPES = {'time': np.int64, 'frequency': np.int64, 'layers': np.int64, 'core': np.bool_, 'index': np.int64,
+              'rank': np.float32, 'td_amp': np.float32, 'neighbors': np.int64}
+
+    def __post_init__(self):
+        # accept lists, e.g. when loaded from json
+        for name in self.PIXEL_FIELDS + self.IFO_FIELDS + ('td_amp', 'neighbors'):
+            setattr(self, name, np.asarray(getattr(self, name), dtype=self.DTYPES.get(name, np.float64)))
+        for name in ('td_offsets', 'neighbor_offsets', 'cluster_offsets'):
+            setattr(self, name, np.asarray(getattr(self, name), dtype=np.int64))
+        n_pix = len(self.time)
+        for name in self.IFO_FIELDS:
+            column = getattr(self, name)
+            if column.ndim != 2:
+                setattr(self, name, column.reshape(n_pix, -1) if n_pix else column.reshape(0, 0))
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def n_ifo(self):
+        return self.index.shape[1]
+
+    @property
+    def n_cluster(self):
+        return len(self.cluster_offsets) - 1
+
+    @property
+    def nbytes(self):
+        """
+        memory held by the arrays in bytes
+        """
+        return sum(getattr(self, f).nbytes for f in self.__dataclass_fields__)
+
+    @classmethod
+    def empty(cls, n_ifo=0):
+        """
+        Table without pixels
+
+        :param n_ifo: number of detectors
+        :type n_ifo: int
+        :rtype: PixelTable
+        """
+        columns = {name: np.zeros(0) for name in cls.PIXEL_FIELDS}
+        columns.update({name: np.zeros((0, n_ifo)) for name in cls.IFO_FIELDS})
+        return cls(**columns, td_amp=np.zeros(0), td_offsets=np.zeros(1), neighbors=np.zeros(0),
+                   neighbor_offsets=np.zeros(1), cluster_offsets=np.zeros(1))
+
+    @classmethod
+    def from_columns(cls, n_ifo, td_amp=None, neighbors=None, neighbor_offsets=None, cluster_offsets=None,
+                     **columns):
+        """
+        Build a table from its columns, the missing columns are filled with the netpixel defaults
+
+        :param n_ifo: number of detectors
+        :type n_ifo: int
+        :param td_amp: time domain amplitudes of each (pixel, detector), by default empty
+        :type td_amp: list[numpy.ndarray], optional
+        :param neighbors: neighbours of each pixel, by default empty, or all the neighbours with neighbor_offsets
+        :type neighbors: list[list[int]] or numpy.ndarray, optional
+        :param neighbor_offsets: offsets of the neighbours of each pixel in a flat neighbors array
+        :type neighbor_offsets: numpy.ndarray, optional
+        :param cluster_offsets: first row of each cluster, by default a single cluster
+        :type cluster_offsets: numpy.ndarray, optional
+        :param columns: columns of the table
+        :return: pixel table
+        :rtype: PixelTable
+        """
+        n_pix = len(columns['time'])
+        defaults = {'time': 0, 'frequency': 0, 'layers': 0, 'rate': 1., 'likelihood': 0., 'null': 0., 'theta': -1., 'phi': -1.,
+                    'ellipticity': 0., 'polarisation': 0., 'core': False}
+        for name in cls.PIXEL_FIELDS:
+            if name not in columns:
+                columns[name] = np.full(n_pix, defaults[name])
+        for name in cls.IFO_FIELDS:
+            if name not in columns:
+                columns[name] = np.zeros((n_pix, n_ifo))
+        td_amp, td_offsets = _ragged(td_amp, n_pix * n_ifo)
+        if neighbor_offsets is None:
+            neighbors, neighbor_offsets = _ragged(neighbors, n_pix)
+        if cluster_offsets is None:
+            cluster_offsets = [0, n_pix]
+        return cls(**columns, td_amp=td_amp, td_offsets=td_offsets, neighbors=neighbors,
+                   neighbor_offsets=neighbor_offsets, cluster_offsets=cluster_offsets)
+
+    @classmethod
+    def from_pixels(cls, pixels, n_ifo=None):
+        """
+        Build a table (single cluster) from Pixel objects
+
+        :param pixels: pixels
+        :type pixels: list[Pixel]
+        :param n_ifo: number of detectors, needed only if there are no pixels
+        :type n_ifo: int, optional
+        :rtype: PixelTable
+        """
+        if not pixels:
+            return cls.empty(n_ifo or 0)
+        n_ifo = len(pixels[0].data)
+        columns = {name: [getattr(p, name) for p in pixels] for name in cls.PIXEL_FIELDS}
+        columns.update({name: [[getattr(d, name) for d in p.data] for p in pixels] for name in cls.IFO_FIELDS})
+        td_amp = [a for p in pixels for a in _td_amp_per_ifo(p.td_amp, n_ifo)]
+        return cls.from_columns(n_ifo, td_amp=td_amp, neighbors=[p.neighbors for p in pixels], **columns)
+
+    @classmethod
+    def from_pixel_dicts(cls, pixels, n_ifo=None):
+        """
+        Build a table (single cluster) from pixels stored as dicts, e.g. the ``pixels`` list of a cluster.json
+        written before the pixel table
+
+        :param pixels: pixels, with the PixelData of each detector in ``data``
+        :type pixels: list[dict]
+        :param n_ifo: number of detectors, needed only if there are no pixels
+        :type n_ifo: int, optional
+        :rtype: PixelTable
+        """
+        return cls.from_pixels([Pixel(**{**p, 'data': [PixelData(**d) for d in p['data']]}) for p in pixels], n_ifo)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Stack tables, each input table becomes one cluster of the output table
+
+        :param tables: tables to stack
+        :type tables: list[PixelTable]
+        :rtype: PixelTable
+        """
+        if not tables:
+            return cls.empty()
+        sizes = [len(t) for t in tables]
+        td_sizes = [int(t.td_offsets[-1] - t.td_offsets[0]) for t in tables]
+        nb_sizes = [int(t.neighbor_offsets[-1] - t.neighbor_offsets[0]) for t in tables]
+        columns = {name: np.concatenate([getattr(t, name) for t in tables])
+                   for name in cls.PIXEL_FIELDS + cls.IFO_FIELDS}
+        td_offsets = np.concatenate([[0]] + [t.td_offsets[1:] - t.td_offsets[0] + o
+                                             for t, o in zip(tables, np.cumsum([0] + td_sizes[:-1]))])
+        neighbor_offsets = np.concatenate([[0]] + [t.neighbor_offsets[1:] - t.neighbor_offsets[0] + o
+                                                   for t, o in zip(tables, np.cumsum([0] + nb_sizes[:-1]))])
+        td_amp = np.concatenate([t.td_amp[t.td_offsets[0]:t.td_offsets[-1]] for t in tables])
+        neighbors = np.concatenate([t.neighbors[t.neighbor_offsets[0]:t.neighbor_offsets[-1]] for t in tables])
+        return cls(**columns, td_amp=td_amp, td_offsets=td_offsets, neighbors=neighbors,
+                   neighbor_offsets=neighbor_offsets, cluster_offsets=np.concatenate([[0], np.cumsum(sizes)]))
+
+    def rows(self, start, stop):
+        """
+        View of the rows start:stop as a single cluster table, the arrays are shared with this table
+
+        :rtype: PixelTable
+        """
+        n_ifo = self.n_ifo
+        td_offsets = self.td_offsets[start * n_ifo:stop * n_ifo + 1]
+        neighbor_offsets = self.neighbor_offsets[start:stop + 1]
+        columns = {name: getattr(self, name)[start:stop] for name in self.PIXEL_FIELDS + self.IFO_FIELDS}
+        return PixelTable(**columns,
+                          td_amp=self.td_amp[td_offsets[0]:td_offsets[-1]], td_offsets=td_offsets - td_offsets[0],
+                          neighbors=self.neighbors[neighbor_offsets[0]:neighbor_offsets[-1]],
+                          neighbor_offsets=neighbor_offsets - neighbor_offsets[0],
+                          cluster_offsets=np.array([0, stop - start]))
+
+    def cluster(self, c):
+        """
+        Pixels of cluster c
+
+        :param c: cluster index
+        :type c: int
+        :rtype: PixelTable
+        """
+        return self.rows(int(self.cluster_offsets[c]), int(self.cluster_offsets[c + 1]))
+
+    def take(self, rows):
+        """
+        Copy of the selected rows as a single cluster table
+
+        :param rows: row indices or boolean mask
+        :type rows: numpy.ndarray
+        :rtype: PixelTable
+        """
+        rows = np.arange(len(self))[rows]
+        n_ifo = self.n_ifo
+        td_ids = (rows[:, None] * n_ifo + np.arange(n_ifo)).ravel()
+        columns = {name: getattr(self, name)[rows] for name in self.PIXEL_FIELDS + self.IFO_FIELDS}
+        return PixelTable(**columns,
+                          td_amp=_gather(self.td_amp, self.td_offsets, td_ids),
+                          td_offsets=_gathered_offsets(self.td_offsets, td_ids),
+                          neighbors=_gather(self.neighbors, self.neighbor_offsets, rows),
+                          neighbor_offsets=_gathered_offsets(self.neighbor_offsets, rows),
+                          cluster_offsets=np.array([0, len(rows)]))
+
+    def get_td_amp(self, k, n):
+        """
+        time domain amplitudes of pixel k in detector n
+        """
+        i = k * self.n_ifo + n
+        return self.td_amp[self.td_offsets[i]:self.td_offsets[i + 1]]
+
+    def td_amp_matrix(self):
+        """
+        time domain amplitudes as a (n_pix, n_ifo, size) array, all the pixels must have the same size
+
+        :rtype: numpy.ndarray
+        """
+        sizes = np.diff(self.td_offsets)
+        if len(sizes) == 0:
+            return np.zeros((len(self), self.n_ifo, 0))
+        if np.any(sizes != sizes[0]):
+            raise ValueError("time domain amplitudes have different sizes")
+        return self.td_amp[self.td_offsets[0]:self.td_offsets[-1]].reshape(len(self), self.n_ifo, sizes[0])
+
+    def get_neighbors(self, k):
+        """
+        neighbours of pixel k
+        """
+        return self.neighbors[self.neighbor_offsets[k]:self.neighbor_offsets[k + 1]]
+
+    def pixel(self, k):
+        """
+        Pixel object of row k
+        """
+        n_ifo = self.n_ifo
+        return Pixel(time=int(self.time[k]), frequency=int(self.frequency[k]), layers=int(self.layers[k]),
+                     rate=float(self.rate[k]), likelihood=float(self.likelihood[k]), null=float(self.null[k]),
+                     theta=float(self.theta[k]), phi=float(self.phi[k]), ellipticity=float(self.ellipticity[k]),
+                     polarisation=float(self.polarisation[k]), core=bool(self.core[k]),
+                     data=[PixelData(float(self.noise_rms[k, n]), float(self.wave[k, n]), float(self.w_90[k, n]),
+                                     float(self.asnr[k, n]), float(self.a_90[k, n]), float(self.rank[k, n]),
+                                     int(self.index[k, n])) for n in range(n_ifo)],
+                     td_amp=np.array([self.get_td_amp(k, n) for n in range(n_ifo)]) if self.td_amp.size else [],
+                     neighbors=self.get_neighbors(k).tolist())
+
+    def to_pixels(self):
+        """
+        Pixel objects of all the rows, for the code still working on single pixels
+
+        :rtype: list[Pixel]
+        """
+        return [self.pixel(k) for k in range(len(self))]
+
+
+def _td_amp_per_ifo(td_amp, n_ifo):
+    if td_amp is None or len(td_amp) == 0:
+        return [np.zeros(0)] * n_ifo
+    return [np.asarray(a, dtype=np.float64) for a in td_amp]
+
+
+def _ragged(values, n):
+    """
+    flat array and offsets of a list of n sequences, empty if values is None
+    """
+    if values is None:
+        return np.zeros(0), np.zeros(n + 1, dtype=np.int64)
+    sizes = np.fromiter((len(v) for v in values), dtype=np.int64, count=n)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    flat = np.concatenate([np.asarray(v, dtype=np.float64).ravel() for v in values]) if offsets[-1] else np.zeros(0)
+    return flat, offsets
+
+
+def _gathered_offsets(offsets, ids):
+    return np.concatenate([[0], np.cumsum(offsets[ids + 1] - offsets[ids])]).astype(np.int64)
+
+
+def _gather(flat, offsets, ids):
+    if len(ids) == 0:
+        return flat[:0]
+    return np.concatenate([flat[offsets[i]:offsets[i + 1]] for i in ids])
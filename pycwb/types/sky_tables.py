@@ -0,0 +1,264 @@
+import logging
+import os
+import uuid
+
+import numpy as np
+import ROOT
+
+from pycwb.modules.cwb_conversions import convert_wavearray_to_nparray
+
+logger = logging.getLogger(__name__)
+
+# stores shared by the networks created in this process, one for each cache directory
+_stores = {}
+
+
+class SkyTables:
+    """
+    Antenna patterns and detector delays of a network at one HEALPix order, with the delay indices
+    of each TD rate. The arrays are (n_ifo, n_sky) and can be memory mapped from the disk cache.
+
+    Parameters
+    ----------
+    healpix : int
+        HEALPix order
+    m_ifo : int
+        index of the reference detector set by network::setDelay
+    fp : numpy.ndarray
+        F+ antenna patterns
+    fx : numpy.ndarray
+        Fx antenna patterns
+    tau : numpy.ndarray
+        detector delays with respect to the reference frame
+    path : str, optional
+        cache directory of the tables, None to keep them only in memory
+    """
+
+    def __init__(self, healpix, m_ifo, fp, fx, tau, path=None):
+        self.healpix = healpix
+        self.m_ifo = m_ifo
+        self.fp = fp
+        self.fx = fx
+        self.tau = tau
+        self.path = path
+        self._delay_index = {}
+
+    @property
+    def n_sky(self):
+        return self.fp.shape[1]
+
+    @classmethod
+    def from_network(cls, network, healpix, path=None):
+        """
+        Read the tables from a network after network::setSkyMaps, network::setAntenna and network::setDelay
+
+        Parameters
+        ----------
+        network : Network
+            network
+        healpix : int
+            HEALPix order of the network sky maps
+        path : str, optional
+            cache directory where the tables are saved
+
+        Returns
+        -------
+        SkyTables
+            tables
+        """
+        n_ifo = network.ifo_size
+        fp = np.array([convert_wavearray_to_nparray(network.get_ifo(i).fp) for i in range(n_ifo)])
+        fx = np.array([convert_wavearray_to_nparray(network.get_ifo(i).fx) for i in range(n_ifo)])
+        tau = np.array([ROOT.pycwb_get_skymap_data(network.get_ifo(i).tau) for i in range(n_ifo)])
+        tables = cls(healpix, int(network.net.mIFO), fp, fx, tau, path)
+        if path is not None:
+            _save_arrays(path, {'fp': fp, 'fx': fx, 'tau': tau, 'm_ifo': np.array(tables.m_ifo)})
+        return tables
+
+    @classmethod
+    def load(cls, healpix, path):
+        """
+        Memory map the tables saved in a cache directory
+
+        Parameters
+        ----------
+        healpix : int
+            HEALPix order
+        path : str
+            cache directory
+
+        Returns
+        -------
+        SkyTables or None
+            tables, None if they are not in the cache
+        """
+        arrays = _load_arrays(path, ['fp', 'fx', 'tau', 'm_ifo'])
+        if arrays is None:
+            return None
+        return cls(healpix, int(arrays['m_ifo']), arrays['fp'], arrays['fx'], arrays['tau'], path)
+
+    def apply(self, network):
+        """
+        Set the sky maps, antenna patterns and delays of the network from the tables,
+        replaces network::setSkyMaps, network::setAntenna and network::setDelay
+
+        Parameters
+        ----------
+        network : Network
+            network
+        """
+        ROOT.pycwb_set_sky_tables(network.net, self.healpix, self.m_ifo, _c_array(self.fp, np.float64),
+                                  _c_array(self.fx, np.float64), _c_array(self.tau, np.float64))
+
+    def delay_index(self, network, rate):
+        """
+        Delay indices (ml) and penalty factors for a TD rate, computed with network::setDelayIndex
+        on the first call and cached. The network must be set to these tables.
+
+        Parameters
+        ----------
+        network : Network
+            network
+        rate : float
+            TD rate
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            delay indices (n_ifo, n_sky) and penalty factors (n_sky)
+        """
+        key = f"{float(rate):g}"
+        if key not in self._delay_index:
+            arrays = None if self.path is None else _load_arrays(self.path, [f'ml_{key}', f'penalty_{key}'])
+            if arrays is not None:
+                self._delay_index[key] = (arrays[f'ml_{key}'], arrays[f'penalty_{key}'])
+            else:
+                network.net.setDelayIndex(rate)
+                ml = np.array([convert_wavearray_to_nparray(network.get_ifo(i).index, short=True)
+                               for i in range(network.ifo_size)])
+                penalty = np.array(ROOT.pycwb_get_skymap_data(network.net.nPenalty))
+                if self.path is not None:
+                    _save_arrays(self.path, {f'ml_{key}': ml, f'penalty_{key}': penalty})
+                self._delay_index[key] = (ml, penalty)
+        return self._delay_index[key]
+
+    def apply_delay_index(self, network, rate):
+        """
+        Set the delay indices of the network, replaces network::setDelayIndex
+
+        Parameters
+        ----------
+        network : Network
+            network
+        rate : float
+            TD rate
+        """
+        ml, penalty = self.delay_index(network, rate)
+        ROOT.pycwb_set_delay_index(network.net, rate, _c_array(ml, np.int16), _c_array(penalty, np.float64))
+
+
+class SkyTableStore:
+    """
+    Store of the sky tables keyed by (detectors, reference detector, HEALPix order), the delay indices
+    of each TD rate are kept with the tables. The tables are kept in memory and, if a cache directory
+    is given, saved as .npy files which are memory mapped by the following jobs.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        cache directory, None to keep the tables only in memory
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._tables = {}
+
+    @staticmethod
+    def key(ifos, ref_ifo, healpix):
+        """
+        key of the tables
+
+        Parameters
+        ----------
+        ifos : list[str]
+            detector names
+        ref_ifo : str
+            reference detector or frame
+        healpix : int
+            HEALPix order
+
+        Returns
+        -------
+        str
+            key, used as directory name in the cache
+        """
+        return f"{'_'.join(ifos)}-{ref_ifo}-healpix{int(healpix)}"
+
+    def get(self, network, ifos, ref_ifo, healpix):
+        """
+        Get the tables, from memory, from the disk cache or computed with the network
+
+        Parameters
+        ----------
+        network : Network
+            network, its sky maps are overwritten if the tables are computed
+        ifos : list[str]
+            detector names
+        ref_ifo : str
+            reference detector or frame
+        healpix : int
+            HEALPix order
+
+        Returns
+        -------
+        SkyTables
+            tables
+        """
+        key = self.key(ifos, ref_ifo, healpix)
+        if key in self._tables:
+            return self._tables[key]
+
+        path = None if not self.cache_dir else os.path.join(self.cache_dir, key)
+        tables = None if path is None else SkyTables.load(healpix, path)
+        if tables is None:
+            logger.info("Computing sky tables %s", key)
+            network.net.setSkyMaps(int(healpix))
+            network.net.setAntenna()
+            network.net.setDelay(ref_ifo)
+            tables = SkyTables.from_network(network, healpix, path)
+        self._tables[key] = tables
+        return tables
+
+
+def get_sky_table_store(cache_dir=None):
+    """
+    Get the sky table store of this process for a cache directory
+
+    :param cache_dir: cache directory, None to keep the tables only in memory
+    :type cache_dir: str, optional
+    :return: sky table store
+    :rtype: SkyTableStore
+    """
+    if cache_dir not in _stores:
+        _stores[cache_dir] = SkyTableStore(cache_dir)
+    return _stores[cache_dir]
+
+
+def _c_array(values, dtype):
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def _save_arrays(path, arrays):
+    # write to a temporary file and rename, so that concurrent jobs never read a partial file
+    os.makedirs(path, exist_ok=True)
+    for name, value in arrays.items():
+        tmp = os.path.join(path, f".{name}.{uuid.uuid4().hex}.npy")
+        np.save(tmp, value)
+        os.replace(tmp, os.path.join(path, f"{name}.npy"))
+
+
+def _load_arrays(path, names):
+    files = [os.path.join(path, f"{name}.npy") for name in names]
+    if not all(os.path.exists(f) for f in files):
+        return None
+    return {name: np.load(f, mmap_mode='r') for name, f in zip(names, files)}
@@ -0,0 +1,98 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+# sky maps of the likelihood statistics saved for each event, in the order of pycwb_export_sky_maps
+SKYMAP_STATISTICS = ('nSensitivity', 'nAlignment', 'nLikelihood', 'nNullEnergy', 'nCorrEnergy', 'nCorrelation',
+                     'nSkyStat', 'nProbability', 'nDisbalance', 'nNetIndex', 'nEllipticity', 'nPolarisation')
+
+
+class SkymapStatistics(Mapping):
+    """
+    Sky maps of the likelihood statistics of an event, stored as float32. In the sparse mode only the
+    sky pixels with the largest probability are kept and the other pixels read as 0.
+
+    The maps are read on access, so a mapping of lazily loaded arrays (e.g. the members of an npz file)
+    is read only for the plotted statistics.
+
+    Parameters
+    ----------
+    n_sky : int
+        number of sky pixels
+    maps : Mapping[str, numpy.ndarray]
+        full sky maps, or the values at ``indices`` in the sparse mode
+    indices : numpy.ndarray, optional
+        sky pixels of the sparse mode, None for full sky maps
+    """
+
+    def __init__(self, n_sky, maps, indices=None):
+        self.n_sky = int(n_sky)
+        self.indices = indices
+        self._maps = maps
+
+    @classmethod
+    def from_network(cls, net, top_n=0):
+        """
+        Copy the sky maps of the last likelihood call from the native network
+
+        Parameters
+        ----------
+        net : ROOT.network
+            native network
+        top_n : int, optional
+            keep only the top_n sky pixels with the largest probability, by default 0 (full sky maps)
+
+        Returns
+        -------
+        SkymapStatistics
+            sky maps
+        """
+        import ROOT
+
+        n_sky = int(net.nProbability.size())
+        data = np.empty((len(SKYMAP_STATISTICS), n_sky), dtype=np.float32)
+        ROOT.pycwb_export_sky_maps(net, data)
+        maps = dict(zip(SKYMAP_STATISTICS, data))
+        if not 0 < top_n < n_sky:
+            return cls(n_sky, maps)
+
+        probability = maps['nProbability']
+        indices = np.sort(np.argpartition(probability, n_sky - top_n)[n_sky - top_n:]).astype(np.int32)
+        return cls(n_sky, {key: value[indices] for key, value in maps.items()}, indices)
+
+    @property
+    def sparse(self):
+        """
+        True if only the top sky pixels are stored
+        """
+        return self.indices is not None
+
+    def stored(self, key):
+        """
+        stored values of a statistic, the values at ``indices`` in the sparse mode
+
+        Parameters
+        ----------
+        key : str
+            statistic
+
+        Returns
+        -------
+        numpy.ndarray
+            values
+        """
+        return np.asarray(self._maps[key])
+
+    def __getitem__(self, key):
+        values = self.stored(key)
+        if self.indices is None:
+            return values
+        skymap = np.zeros(self.n_sky, dtype=np.float32)
+        skymap[self.indices] = values
+        return skymap
+
+    def __iter__(self):
+        return (key for key in SKYMAP_STATISTICS if key in self._maps)
+
+    def __len__(self):
+        return sum(1 for _ in self)
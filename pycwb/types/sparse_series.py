@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.sparse import coo_array
+from scipy.sparse import csr_array
 
 
 class SparseTimeFrequencySeries:
@@ -29,16 +29,32 @@ class SparseTimeFrequencySeries:
         self.layer_halo = layer_halo
         self.net_delay = net_delay
 
-    def from_fragment_cluster(self, wdm, tf_map, fragment_cluster, td_size, m_tau, ifo_id):
+    def from_fragment_cluster(self, wdm, tf_map, core_pixels, td_size, m_tau, ifo_id):
         wdm.set_td_filter(td_size, 1)
         ws = tf_map.copy()
         ws.wavelet = wdm
         ws.forward()
 
+        return self.from_transformed_map(ws, core_pixels, m_tau, ifo_id)
+
+    def from_transformed_map(self, ws, core_pixels, m_tau, ifo_id):
+        """Create the sparse table from an already forward transformed map
+
+        :param ws: forward transformed time-frequency map with the time delay filters set,
+                   it is only read, so a map shared by :class:`TFMapCache` can be passed
+        :type ws: TimeFrequencySeries
+        :param core_pixels: rate and detector indices of the core pixels, see NetClusterHandle.core_pixels
+        :type core_pixels: (numpy.ndarray, numpy.ndarray)
+        :param m_tau: maximum network delay (sec)
+        :type m_tau: float
+        :param ifo_id: detector index
+        :type ifo_id: int
+        :return: self
+        :rtype: SparseTimeFrequencySeries
+        """
         self.set_map(ws)
         self.set_halo(m_tau)
-        for cluster in fragment_cluster.clusters:
-            self.add_core(ifo_id, cluster)
+        self.add_core_pixels(ifo_id, *core_pixels)
         self.update_sparse_table()
         return self
 
@@ -114,20 +130,31 @@ class SparseTimeFrequencySeries:
         :type cluster: Cluster
         """
 
-        r = int(self.w_rate + 0.1)
-
         # skip rejected clusters
         if cluster.cluster_status == 1:
             return False
 
-        # loop over pixels
-        for pixel in cluster.pixels:
-            # skip pixel with bad rate, TODO: why the rate can be bad?
-            if int(pixel.rate + 0.01) != r:
-                continue
+        table = cluster.pixel_table
+        self.add_core_pixels(ifo_id, table.rate, table.index)
+
+    def add_core_pixels(self, ifo_id, rate, index):
+        """ Add core pixels of the detector ID=ifoID from the pixel columns
 
-            # store pixel index
-            self.core.append(pixel.data[ifo_id].index)
+        :param ifo_id: detector ID
+        :type ifo_id: int
+        :param rate: wavelet layer rate of the pixels, shape (n_pix,)
+        :type rate: numpy.ndarray
+        :param index: index in wavearray of the pixels, shape (n_pix, n_ifo)
+        :type index: numpy.ndarray
+        """
+        if not len(rate):
+            return
+
+        r = int(self.w_rate + 0.1)
+
+        # store pixel index, skip pixel with bad rate, TODO: why the rate can be bad?
+        selected = (rate + 0.01).astype(int) == r
+        self.core.extend(index[selected, ifo_id].tolist())
 
     def update_sparse_table(self):
         """
@@ -142,60 +169,61 @@ class SparseTimeFrequencySeries:
         h_slice = self.time_halo + extra_halo  # halo slices
         layer_halo = self.layer_halo  # halo layers
 
-        cluster = []
         n_layer = self.wavelet.max_level + 1  # number of WDM layers
         n_slice = self.wavelet.size_at_zero_layer  # number of samples in wavelet layer
 
-        # start_time = time.perf_counter()
-        for core_pixel in self.core:
-            # i,j index of the core pixel
-            t = core_pixel // n_layer  # slice
-            l = core_pixel % n_layer  # layer
-
-            # Calculate the starting and ending indices for the time and layer axes
-            start_t = max(0, t - h_slice)
-            start_l = max(0, l - layer_halo)
-            end_t = min(n_slice - 1, t + h_slice)
-            end_l = min(n_layer - 1, l + layer_halo)
-
-            # Calculate the block indices in 1D array
-            cluster += [(ll, tt) for ll in range(start_l, end_l + 1) for tt in range(start_t, end_t + 1)]
+        # occupancy mask of the core pixels, dilated by the halo along the layer and the time axes
+        core = np.asarray(self.core, dtype=np.int64)
+        core = core[(core >= 0) & (core < n_layer * n_slice)]
+        mask = np.zeros((n_layer, n_slice), dtype=bool)
+        mask[core % n_layer, core // n_layer] = True
+        mask = _dilate(mask, layer_halo, axis=0)
+        mask = _dilate(mask, h_slice, axis=1)
 
-        # remove duplicates
-        cluster = sorted(set(cluster))
+        # the halo pixels sorted by (layer, time), as the sparse tables are layer-major
+        layer, time = np.nonzero(mask)
+        tf_index = time * n_layer + layer
+        pWWS = self.wavelet.as_array()
+        sparse_map_00 = pWWS[tf_index]
+        sparse_map_90 = pWWS[tf_index + self.wavelet.max_index + 1]
 
-        # get the sparse maps
-        sparse_map_00 = [self.wavelet.get_map_00(ll * n_layer + tt) for tt, ll in cluster]
-        sparse_map_90 = [self.wavelet.get_map_90(ll * n_layer + tt) for tt, ll in cluster]
-
-        self.set_sparse_table(cluster, sparse_map_00, sparse_map_90)
+        self._set_sparse_table(layer, time, sparse_map_00, sparse_map_90)
 
     def set_sparse_table(self, sparse_index, sparse_map_00, sparse_map_90):
+        """Set the sparse tables from the (layer, time) pairs of the pixels and their amplitudes
+
+        :param sparse_index: (layer, time) of each pixel
+        :type sparse_index: list[tuple[int, int]]
+        :param sparse_map_00: 00 phase amplitudes
+        :type sparse_map_00: list[float]
+        :param sparse_map_90: 90 phase amplitudes
+        :type sparse_map_90: list[float]
+        """
+        sparse_index = np.asarray(sparse_index, dtype=np.int64).reshape(-1, 2)
+        order = np.lexsort((sparse_index[:, 1], sparse_index[:, 0]))
+        self._set_sparse_table(sparse_index[order, 0], sparse_index[order, 1],
+                               np.asarray(sparse_map_00)[order], np.asarray(sparse_map_90)[order])
+
+    def _set_sparse_table(self, layer, time, sparse_map_00, sparse_map_90):
         n_layer = self.wavelet.max_level + 1  # number of WDM layers
         n_slice = self.wavelet.size_at_zero_layer  # number of samples in wavelet layer
 
-        # cluster = np.array(sparse_index)
-        # time = cluster // n_layer
-        # layer = cluster % n_layer
-        # list comprehension is faster than zip
-        layer = [i[0] for i in sparse_index]
-        time = [i[1] for i in sparse_index]
-
-        # create sparse table
-        self.sparse_table_00 = coo_array((sparse_map_00, (layer, time)), shape=(n_layer, n_slice))
-        self.sparse_table_90 = coo_array((sparse_map_90, (layer, time)), shape=(n_layer, n_slice))
+        # create the layer-major CSR tables, the pixels must be sorted by (layer, time)
+        layer = np.asarray(layer, dtype=np.int64)
+        if np.any(np.diff(layer) < 0):
+            raise ValueError("sparse table pixels must be sorted by layer")
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(layer, minlength=n_layer))]).astype(np.int32)
+        indices = np.asarray(time, dtype=np.int32)
+        self.sparse_table_00 = csr_array((np.asarray(sparse_map_00, dtype=np.float64), indices, indptr),
+                                         shape=(n_layer, n_slice))
+        self.sparse_table_90 = csr_array((np.asarray(sparse_map_90, dtype=np.float64), indices, indptr),
+                                         shape=(n_layer, n_slice))
 
     @property
     def sparse_lookup(self):
-        """Get the sparse lookup
+        """Get the sparse lookup, the first pixel of each layer (CSR index pointer)
         """
-        sparse_lookup = []
-        n = 0
-        n_layer = self.sparse_table_00.shape[0]
-        for i in range(n_layer + 1):
-            sparse_lookup.append(n)
-            n += np.count_nonzero(self.sparse_table_00.row == i)
-        return sparse_lookup
+        return self.sparse_table_00.indptr
 
     @property
     def sparse_map_00(self):
@@ -214,4 +242,22 @@ class SparseTimeFrequencySeries:
         """Get the sparse index
         """
         n_layer = self.sparse_table_00.shape[0]
-        return self.sparse_table_00.col * n_layer + self.sparse_table_00.row
+        layer = np.repeat(np.arange(n_layer), np.diff(self.sparse_table_00.indptr))
+        return self.sparse_table_00.indices.astype(np.int64) * n_layer + layer
+
+
+def _dilate(mask, halo, axis):
+    """
+    binary dilation of a 2D mask by halo samples on both sides along one axis, clipped at the edges
+    """
+    if halo <= 0:
+        return mask
+    counts = np.cumsum(mask, axis=axis, dtype=np.int64)
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (1, 0)
+    counts = np.pad(counts, pad)
+    n = mask.shape[axis]
+    i = np.arange(n)
+    upper = np.take(counts, np.minimum(i + halo, n - 1) + 1, axis=axis)
+    lower = np.take(counts, np.maximum(i - halo, 0), axis=axis)
+    return upper > lower
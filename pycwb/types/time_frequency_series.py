@@ -74,6 +74,20 @@ class TimeFrequencySeries:
         else:
             raise ValueError('Wavelet transform failed')
 
+    def load_transform(self, data):
+        """
+        Load the orthonormal transform (forward(-1)) of the data computed elsewhere, e.g. in a worker process
+
+        :param data: sliced array of the transform, the 00 phase followed by the 90 phase
+        :type data: numpy.ndarray
+        """
+        if self.wavelet.allocate():
+            self.wavelet.nSTS = self.wavelet.nWWS
+            self.wavelet.load(data)
+            self.w_rate = float(self.wavelet.get_slice_size(0) / (self.stop - self.start))
+        else:
+            raise ValueError('Wavelet workspace is not allocated')
+
     @property
     def wavelet(self):
         """
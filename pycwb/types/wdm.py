@@ -5,15 +5,22 @@ from pycwb.modules.cwb_conversions import convert_wavearray_to_pycbc_timeseries
 
 
 def declare_function():
-    cppyy.cppdef("""
-        double* _to_double_malloc(double* data, int n) {
-            double* new_data = (double *)malloc(n*sizeof(double));
-            for (int i=0; i<n; i++) {
-                new_data[i] = data[i];
-            }
-            return new_data;
-        };
-        """)
+    if not hasattr(cppyy.gbl, '_to_double_malloc'):
+        cppyy.cppdef("""
+            double* _to_double_malloc(double* data, int n) {
+                double* new_data = (double *)malloc(n*sizeof(double));
+                for (int i=0; i<n; i++) {
+                    new_data[i] = data[i];
+                }
+                return new_data;
+            };
+            """)
+    if not hasattr(cppyy.gbl, '_free_double_malloc'):
+        cppyy.cppdef("""
+            void _free_double_malloc(double* data) {
+                free(data);
+            };
+            """)
 
 
 class WDM:
@@ -99,6 +106,35 @@ class WDM:
         """
         self.wavelet.release()
 
+    def free(self):
+        """
+        free the malloced WDM sliced array and release it, only for workspaces allocated by :meth:`allocate`
+        """
+        if not hasattr(cppyy.gbl, '_free_double_malloc'):
+            declare_function()
+
+        if self.wavelet.allocate():
+            cppyy.gbl._free_double_malloc(self.wavelet.pWWS)
+        self.wavelet.release()
+
+    def load(self, data):
+        """
+        replace the workspace with an orthonormal transform (t2w(-1)) computed elsewhere, e.g. in a worker process,
+        the workspace must have been allocated by :meth:`allocate`
+
+        :param data: sliced array of the transform, the 00 phase followed by the 90 phase
+        :type data: numpy.ndarray
+        """
+        if not hasattr(cppyy.gbl, '_to_double_malloc'):
+            declare_function()
+
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        self.free()
+        self.wavelet.allocate(len(data), cppyy.gbl._to_double_malloc(data, len(data)))
+        # state set by t2w(-1)
+        self.wavelet.m_L = self.wavelet.m_H
+        self.wavelet.m_Level = self.wavelet.m_Layer
+
     def clone(self):
         """
         clone the WDM object
@@ -204,6 +240,17 @@ class WDM:
         """
         return self.wavelet.pWWS
 
+    def as_array(self):
+        """
+        numpy view of the WDM sliced array, the 00 phase is followed by the 90 phase (offset max_index + 1),
+        valid until the wavelet is released
+
+        :return: sliced array
+        :rtype: numpy.ndarray
+        """
+        self.wavelet.pWWS.reshape((self.nWWS,))
+        return np.frombuffer(self.wavelet.pWWS, dtype=np.float64, count=self.nWWS)
+
     def get_map_00(self, index):
         """
         get map00/90 value from index
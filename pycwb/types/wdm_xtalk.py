@@ -16,6 +16,23 @@ class WDMXTalkCatalog:
         else:
             raise ValueError("catalog must be a string or a ROOT.monster object")
 
+    @classmethod
+    def from_header(cls, file):
+        """
+        Catalog with only the header of a MRA catalog file (tag, beta order, precision and layers),
+        read without loading the cross-talk coefficients. get_wdmMRA is not available.
+
+        :param file: path of the MRA catalog
+        :type file: str
+        :return: catalog
+        :rtype: WDMXTalkCatalog
+        """
+        from pycwb.modules.xtalk.monster import read_catalog_header
+
+        catalog = cls.__new__(cls)
+        catalog.catalog = read_catalog_header(file)
+        return catalog
+
     def load_MRA(self, file):
         logger.info("Loading catalog of WDM cross-talk coefficients: %s", file)
         self.catalog.read(file)
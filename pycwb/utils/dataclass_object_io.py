@@ -1,6 +1,10 @@
 import orjson
 import gzip
-from dacite import from_dict
+import struct
+import zipfile
+from collections.abc import Mapping
+import numpy as np
+from dacite import from_dict, Config
 
 
 def save_dataclass_to_json(dataclass_object, output_file, compress_json=False):
@@ -44,4 +48,350 @@ def load_dataclass_from_json(dataclass_object, input_file):
         with open(input_file, 'rb') as f:
             data = orjson.loads(f.read())
 
-    return from_dict(dataclass_object, data)
\ No newline at end of file
+    # the clusters convert the pixel tables (and the pixel lists of older files) themselves
+    if hasattr(dataclass_object, 'from_dict'):
+        return dataclass_object.from_dict(data)
+    # numpy arrays are stored as lists
+    return from_dict(dataclass_object, data, config=Config(type_hooks={np.ndarray: np.asarray}))
+
+
+# binary container: an npz file with a json header and columnar arrays, the members are stored
+# uncompressed by default so that they can be memory-mapped and sliced without reading the whole file
+NPZ_FORMAT = 'pycwb-npz'
+NPZ_VERSION = 1
+
+_CLUSTER_RAGGED_FIELDS = {'cluster_rate': np.int64, 'sky_area': np.float64, 'sky_pixel_map': np.float64,
+                          'sky_pixel_index': np.int64, 'sky_time_delay': np.float64}
+_FRAGMENT_HEADER_FIELDS = ('rate', 'start', 'stop', 'bpp', 'shift', 'f_low', 'f_high', 'n_pix', 'run', 'pair',
+                           'subnet_threshold')
+
+
+def save_clusters_to_npz(fragment_clusters, output_file, compress=False):
+    """
+    Save fragment clusters to a binary npz container
+
+    The pixels of all the clusters are stored in the columns of a single PixelTable (``pixel/<field>``),
+    the cluster metadata as one row per cluster (``cluster/<field>``) and the fragment cluster headers
+    in the json header.
+
+    :param fragment_clusters: fragment clusters, a NetClusterHandle is saved through its view
+    :type fragment_clusters: FragmentCluster or list[FragmentCluster]
+    :param output_file: output file
+    :type output_file: str
+    :param compress: deflate the members, defaults to False. Compressed members can not be memory-mapped
+    :type compress: bool, optional
+    """
+    from pycwb.types.network_cluster import ClusterMeta
+    from pycwb.types.network_pixel import PixelTable
+
+    if not isinstance(fragment_clusters, (list, tuple)):
+        fragment_clusters = [fragment_clusters]
+    fragment_clusters = [getattr(fc, 'view', fc) for fc in fragment_clusters]
+    clusters = [c for fc in fragment_clusters for c in fc.clusters]
+    table = PixelTable.concatenate([c.pixel_table for c in clusters])
+    meta_fields = list(ClusterMeta.__dataclass_fields__)
+
+    header = {
+        'format': NPZ_FORMAT,
+        'version': NPZ_VERSION,
+        'kind': 'FragmentCluster',
+        'n_ifo': int(table.n_ifo),
+        'fragments': [{name: getattr(fc, name) for name in _FRAGMENT_HEADER_FIELDS} for fc in fragment_clusters],
+        'cluster_meta_fields': meta_fields,
+    }
+    arrays = {'pixel/' + name: getattr(table, name) for name in table.__dataclass_fields__}
+    arrays['cluster/fragment_offsets'] = np.cumsum([0] + [len(fc.clusters) for fc in fragment_clusters])
+    arrays['cluster/status'] = np.array([c.cluster_status for c in clusters], dtype=np.int32)
+    arrays['cluster/time'] = np.array([c.cluster_time for c in clusters], dtype=np.float64)
+    arrays['cluster/freq'] = np.array([c.cluster_freq for c in clusters], dtype=np.float64)
+    arrays['cluster/meta'] = np.array([[getattr(c.cluster_meta, name) for name in meta_fields] for c in clusters],
+                                      dtype=np.float64).reshape(len(clusters), len(meta_fields))
+    for name, dtype in _CLUSTER_RAGGED_FIELDS.items():
+        values = [getattr(c, name) for c in clusters]
+        arrays[f'cluster/{name}'] = np.concatenate([np.asarray(v, dtype=dtype) for v in values]) \
+            if any(len(v) for v in values) else np.zeros(0, dtype=dtype)
+        arrays[f'cluster/{name}_offsets'] = np.cumsum([0] + [len(v) for v in values])
+
+    _save_npz(output_file, header, arrays, compress)
+
+
+def load_clusters_from_npz(input_file, metadata_only=False, mmap=False):
+    """
+    Load fragment clusters from a binary npz container
+
+    :param input_file: path to the npz file
+    :type input_file: str
+    :param metadata_only: load only the cluster metadata, the pixel tables are left empty, defaults to False
+    :type metadata_only: bool, optional
+    :param mmap: memory-map the pixel columns instead of reading them, only for uncompressed files,
+        defaults to False
+    :type mmap: bool, optional
+    :return: fragment clusters
+    :rtype: list[FragmentCluster]
+    """
+    from pycwb.types.network_cluster import FragmentCluster
+
+    with _NpzReader(input_file, kind='FragmentCluster') as reader:
+        table = None if metadata_only else reader.pixel_table(mmap)
+        clusters = [reader.cluster(c, table) for c in range(reader.n_clusters)]
+        offsets = reader['cluster/fragment_offsets']
+        return [FragmentCluster(**fragment, clusters=clusters[offsets[i]:offsets[i + 1]])
+                for i, fragment in enumerate(reader.header['fragments'])]
+
+
+def load_cluster_from_npz(input_file, cluster_id, fragment_id=0, mmap=False):
+    """
+    Load one cluster from a binary npz container, only its rows of the pixel columns are read
+
+    :param input_file: path to the npz file
+    :type input_file: str
+    :param cluster_id: cluster index in the fragment cluster
+    :type cluster_id: int
+    :param fragment_id: fragment cluster index, defaults to 0
+    :type fragment_id: int, optional
+    :param mmap: keep the pixel columns memory-mapped instead of copying the rows, defaults to False
+    :type mmap: bool, optional
+    :return: cluster
+    :rtype: Cluster
+    """
+    with _NpzReader(input_file, kind='FragmentCluster') as reader:
+        offsets = reader['cluster/fragment_offsets']
+        c = int(offsets[fragment_id]) + cluster_id
+        if cluster_id < 0 or c >= offsets[fragment_id + 1]:
+            raise IndexError(f"cluster {cluster_id} not found in fragment cluster {fragment_id}")
+        return reader.cluster(c, reader.pixel_table(mmap=True), copy=not mmap)
+
+
+def save_events_to_npz(events, output_file, compress=False):
+    """
+    Save events to a binary npz container, the list fields are stored as flat arrays with offsets
+
+    :param events: events
+    :type events: Event or list[Event]
+    :param output_file: output file
+    :type output_file: str
+    :param compress: deflate the members, defaults to False
+    :type compress: bool, optional
+    """
+    from pycwb.types.network_event import Event
+
+    if not isinstance(events, (list, tuple)):
+        events = [events]
+    header = {'format': NPZ_FORMAT, 'version': NPZ_VERSION, 'kind': 'Event', 'n_events': len(events),
+              'strings': {}}
+    arrays = {}
+    for name, f in Event.__dataclass_fields__.items():
+        values = [getattr(e, name) for e in events]
+        if f.type == list[str]:
+            header['strings'][name] = [list(v) for v in values]
+        elif f.type in (list[int], list[float]):
+            dtype = np.int64 if f.type == list[int] else np.float64
+            arrays[f'event/{name}'] = np.concatenate([np.asarray(v, dtype=dtype).ravel() for v in values]) \
+                if any(len(v) for v in values) else np.zeros(0, dtype=dtype)
+            arrays[f'event/{name}_offsets'] = np.cumsum([0] + [np.size(v) for v in values])
+        else:
+            arrays[f'event/{name}'] = np.array(values, dtype=np.int64 if f.type is int else np.float64)
+
+    _save_npz(output_file, header, arrays, compress)
+
+
+def load_events_from_npz(input_file):
+    """
+    Load events from a binary npz container
+
+    :param input_file: path to the npz file
+    :type input_file: str
+    :return: events
+    :rtype: list[Event]
+    """
+    from pycwb.types.network_event import Event
+
+    with _NpzReader(input_file, kind='Event') as reader:
+        header = reader.header
+        columns = {}
+        for name, f in Event.__dataclass_fields__.items():
+            if name in header['strings']:
+                columns[name] = header['strings'][name]
+            elif f.type in (list[int], list[float]):
+                flat, offsets = reader[f'event/{name}'].tolist(), reader[f'event/{name}_offsets']
+                columns[name] = [flat[offsets[i]:offsets[i + 1]] for i in range(header['n_events'])]
+            else:
+                columns[name] = reader[f'event/{name}'].tolist()
+        return [Event(**{name: values[i] for name, values in columns.items()}) for i in range(header['n_events'])]
+
+
+def save_skymap_statistics_to_npz(statistics, output_file, compress=True):
+    """
+    Save the sky maps of the likelihood statistics of an event to a binary npz container, as float32
+
+    :param statistics: sky maps
+    :type statistics: SkymapStatistics
+    :param output_file: output file
+    :type output_file: str
+    :param compress: deflate the members, defaults to True
+    :type compress: bool, optional
+    """
+    header = {'format': NPZ_FORMAT, 'version': NPZ_VERSION, 'kind': 'SkymapStatistics',
+              'n_sky': statistics.n_sky, 'sparse': statistics.sparse, 'keys': list(statistics)}
+    arrays = {f'skymap/{key}': np.asarray(statistics.stored(key), dtype=np.float32) for key in statistics}
+    if statistics.sparse:
+        arrays['skymap/indices'] = np.asarray(statistics.indices, dtype=np.int32)
+
+    _save_npz(output_file, header, arrays, compress)
+
+
+def load_skymap_statistics_from_npz(input_file):
+    """
+    Load the sky maps of the likelihood statistics of an event from a binary npz container,
+    each sky map is read on first access
+
+    :param input_file: path to the npz file
+    :type input_file: str
+    :return: sky maps
+    :rtype: SkymapStatistics
+    """
+    from pycwb.types.skymap_statistics import SkymapStatistics
+
+    with _NpzReader(input_file, kind='SkymapStatistics') as reader:
+        header = reader.header
+        indices = reader['skymap/indices'] if header['sparse'] else None
+    return SkymapStatistics(header['n_sky'], _NpzMembers(input_file, 'skymap/', header['keys']), indices)
+
+
+def read_npz_header(input_file):
+    """
+    Read the json header of a binary npz container without loading any array
+
+    :param input_file: path to the npz file
+    :type input_file: str
+    :return: header with the format, version, kind and the metadata of the stored objects
+    :rtype: dict
+    """
+    with _NpzReader(input_file) as reader:
+        return reader.header
+
+
+def _save_npz(output_file, header, arrays, compress):
+    arrays = {'__header__': np.frombuffer(orjson.dumps(header, option=orjson.OPT_SERIALIZE_NUMPY), dtype=np.uint8),
+              **arrays}
+    with open(output_file, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+
+
+class _NpzReader:
+    """
+    lazy reader of a binary npz container, the uncompressed members are memory-mapped on request
+    """
+
+    def __init__(self, input_file, kind=None):
+        self.input_file = input_file
+        self._npz = np.load(input_file, allow_pickle=False)
+        self.header = orjson.loads(self._npz['__header__'].tobytes())
+        if self.header.get('format') != NPZ_FORMAT:
+            raise ValueError(f"{input_file} is not a {NPZ_FORMAT} file")
+        if self.header['version'] > NPZ_VERSION:
+            raise ValueError(f"{input_file} has format version {self.header['version']}, "
+                             f"only versions up to {NPZ_VERSION} are supported")
+        if kind is not None and self.header['kind'] != kind:
+            raise ValueError(f"{input_file} stores {self.header['kind']} objects, not {kind}")
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._npz.close()
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            self._cache[name] = self._npz[name]
+        return self._cache[name]
+
+    @property
+    def n_clusters(self):
+        return len(self['cluster/status'])
+
+    def pixel_table(self, mmap=False):
+        from pycwb.types.network_pixel import PixelTable
+
+        stored = _stored_members(self.input_file) if mmap else {}
+        columns = {}
+        for name in PixelTable.__dataclass_fields__:
+            key = 'pixel/' + name
+            columns[name] = _memmap_member(self.input_file, stored[key]) if key in stored else self[key]
+        return PixelTable(**columns)
+
+    def cluster(self, c, table=None, copy=False):
+        from pycwb.types.network_cluster import Cluster, ClusterMeta
+        from pycwb.types.network_pixel import PixelTable
+
+        meta = dict(zip(self.header['cluster_meta_fields'], self['cluster/meta'][c].tolist()))
+        ragged = {}
+        for name in _CLUSTER_RAGGED_FIELDS:
+            offsets = self[f'cluster/{name}_offsets']
+            ragged[name] = self[f'cluster/{name}'][offsets[c]:offsets[c + 1]].tolist()
+        if table is None:
+            pixel_table = PixelTable.empty(self.header['n_ifo'])
+        else:
+            pixel_table = table.cluster(c)
+            if copy:
+                pixel_table = PixelTable(**{name: np.array(getattr(pixel_table, name))
+                                            for name in PixelTable.__dataclass_fields__})
+        return Cluster(pixel_table=pixel_table, cluster_meta=ClusterMeta(**meta),
+                       cluster_status=int(self['cluster/status'][c]), cluster_time=float(self['cluster/time'][c]),
+                       cluster_freq=float(self['cluster/freq'][c]), **ragged)
+
+
+class _NpzMembers(Mapping):
+    """
+    members of an npz file with a common prefix, each member is read on first access
+    """
+
+    def __init__(self, input_file, prefix, keys):
+        self.input_file = input_file
+        self.prefix = prefix
+        self._keys = list(keys)
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._cache:
+            with np.load(self.input_file, allow_pickle=False) as npz:
+                self._cache[key] = npz[self.prefix + key]
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _stored_members(input_file):
+    """
+    location of the uncompressed array members of an npz file: {name: (offset, dtype, shape, fortran_order)}
+    """
+    members = {}
+    with zipfile.ZipFile(input_file) as zf, open(input_file, 'rb') as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith('.npy'):
+                continue
+            # local file header: 30 bytes, then the file name and the extra field
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+                else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            members[info.filename[:-4]] = (f.tell(), dtype, shape, fortran_order)
+    return members
+
+
+def _memmap_member(input_file, member):
+    offset, dtype, shape, fortran_order = member
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(input_file, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
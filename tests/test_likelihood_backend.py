@@ -0,0 +1,74 @@
+"""
+Regression test of the numba likelihoodWP against network::likelihoodWP (ROOT backend).
+
+The injection example is analysed up to the supercluster stage and the likelihood of every cluster is
+computed with both backends on the same network. The test needs ROOT, pycbc and the WAT filters
+($HOME_WAT_FILTERS), it is skipped otherwise.
+"""
+import os
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+pytest.importorskip("pycbc")
+
+if 'HOME_WAT_FILTERS' not in os.environ:
+    pytest.skip("HOME_WAT_FILTERS is not set", allow_module_level=True)
+
+from pycwb.config import Config
+from pycwb.types.network import Network
+from pycwb.types.netcluster_handle import NetClusterHandle
+from pycwb.modules.read_data import generate_injection
+from pycwb.modules.data_conditioning import data_conditioning
+from pycwb.modules.coherence import coherence
+from pycwb.modules.multi_resolution_wdm import TFMapCache
+from pycwb.modules.super_cluster import supercluster
+from pycwb.modules.job_segment import create_job_segment_from_config
+from pycwb.modules.likelihood.likelihood import _setup_network, _likelihood_sky, _likelihood
+from pycwb.modules.likelihoodWP.likelihood import validate_likelihood
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'examples', 'injection', 'user_parameters_injection.yaml')
+
+
+@pytest.fixture(scope='module')
+def analysis():
+    config = Config(EXAMPLE)
+    config.nproc = 1
+    config.likelihood_backend = 'numba'
+    config.likelihood_validate = False
+    config.likelihood_precision = 'float64'
+    config.likelihood_precision_validate = False
+
+    job_seg = create_job_segment_from_config(config)[0]
+    data = generate_injection(config, job_seg, None)
+    tf_maps, nRMS_list = data_conditioning(config, data)
+
+    tf_map_cache = TFMapCache(config)
+    fragment_clusters = coherence(config, tf_maps, nRMS_list, tf_map_cache=tf_map_cache)
+    network = Network(config, tf_maps, nRMS_list)
+    pwc_list = supercluster(config, network, fragment_clusters, tf_maps, tf_map_cache=tf_map_cache)
+    tf_map_cache.release()
+
+    _setup_network(config, network)
+    sky = _likelihood_sky(config, network)
+    if sky is None:
+        pytest.skip("the numba likelihood does not support this configuration")
+    return config, network, [NetClusterHandle.wrap(pwc) for pwc in pwc_list], sky
+
+
+def test_numba_likelihood_matches_root(analysis):
+    config, network, handles, sky = analysis
+
+    n_compared = 0
+    for lag, handle in enumerate(handles):
+        for k in range(handle.n_clusters):
+            if handle.cluster_status(k) > 0:
+                continue
+            reference, reference_cluster = _likelihood(config, network, lag, k + 1, handle, k)
+            event, cluster = _likelihood(config, network, lag, k + 1, handle, k, sky)
+
+            assert cluster.cluster_status == reference_cluster.cluster_status
+            if cluster.cluster_status == -1:
+                assert validate_likelihood(event, reference) == []
+                n_compared += 1
+
+    assert n_compared > 0
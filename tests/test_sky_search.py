@@ -0,0 +1,83 @@
+"""
+Tests of the coarse-to-fine sky search (pycwb.modules.likelihoodWP.sky_search) against the exhaustive scan.
+
+The HEALPix hierarchy of ROOT.pycwb_sky_hierarchy is replaced by the nested scheme, the parent cell of a sky
+location is its nested index shifted by two bits per order, so the tests do not need ROOT.
+"""
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from pycwb.modules.likelihoodWP.sky_search import SkyHierarchy
+
+HEALPIX = 5
+N_SKY = 12 * 4 ** HEALPIX
+
+
+class NestedSkymap:
+    def getOrder(self):
+        return HEALPIX
+
+    def size(self):
+        return N_SKY
+
+
+def nested_sky_hierarchy(skymap, order, parent, representative):
+    shift = 2 * (skymap.getOrder() - order)
+    parent[:] = np.arange(len(parent)) >> shift
+    representative[:] = (np.arange(len(representative)) << shift) + (1 << shift) // 2
+
+
+@pytest.fixture
+def hierarchy(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'ROOT', types.SimpleNamespace(pycwb_sky_hierarchy=nested_sky_hierarchy))
+    return SkyHierarchy(NestedSkymap(), 1, top=8, margin=0.1)
+
+
+def peaked_statistic(peak):
+    # statistic decreasing with the distance to the peak
+    return -np.abs(np.arange(N_SKY) - peak).astype(float)
+
+
+def test_hierarchy_levels(hierarchy):
+    assert hierarchy.orders == list(range(1, HEALPIX))
+    sky_mask = np.ones(N_SKY, dtype=bool)
+    assert np.array_equal(hierarchy.start(sky_mask), np.arange(48))
+    children = hierarchy.refine(0, np.array([5]), np.array([1.]), sky_mask)
+    assert np.array_equal(children, np.arange(20, 24))
+
+    with pytest.raises(ValueError):
+        SkyHierarchy(NestedSkymap(), HEALPIX)
+
+
+@pytest.mark.parametrize('peak', [0, 1234, N_SKY - 1])
+def test_search_finds_exhaustive_maximum(hierarchy, peak):
+    rng = np.random.default_rng(peak)
+    sky_mask = rng.random(N_SKY) < 0.8
+    sky_mask[peak] = True
+    statistic = peaked_statistic(peak)
+
+    locations, n_evaluated = hierarchy.search(lambda l: statistic[l], sky_mask)
+    assert sky_mask[locations].all()
+    assert locations[np.argmax(statistic[locations])] == peak
+    assert n_evaluated < sky_mask.sum()
+
+
+def test_search_batch_matches_search(hierarchy):
+    rng = np.random.default_rng(0)
+    shared_mask = rng.random(N_SKY) < 0.8
+    sky_masks = [shared_mask, shared_mask, np.zeros(N_SKY, dtype=bool), rng.random(N_SKY) < 0.5]
+    statistics = [peaked_statistic(peak) for peak in [10, 9000, 0, 4000]]
+
+    candidates, n_evaluated = hierarchy.search_batch(
+        lambda locations: [s[l] for s, l in zip(statistics, locations)], sky_masks)
+    for k, (statistic, sky_mask) in enumerate(zip(statistics, sky_masks)):
+        locations, n = hierarchy.search(lambda l: statistic[l], sky_mask)
+        assert n_evaluated[k] == n
+        if locations is None:
+            assert candidates[k] is None
+        else:
+            assert np.array_equal(candidates[k], locations)
+    assert candidates[2] is None
@@ -0,0 +1,119 @@
+"""
+Tests of the MRA catalog tools (pycwb.modules.xtalk.monster) on a synthetic catalog, they do not need ROOT.
+"""
+import struct
+
+import numpy as np
+import pytest
+
+from pycwb.modules.xtalk import monster
+
+LAYERS = [8, 16, 32]
+
+
+def write_catalog(fn, rng, layers=LAYERS):
+    """
+    write a catalog in the format of the ROOT monster with random coefficients, each bucket holds distinct
+    indices in random order. Return the records of each bucket (nRes, nRes, freq, odd) in the order of the file.
+    """
+    records = {}
+    with open(fn, "wb") as f:
+        f.write(struct.pack('f', -len(layers)))
+        f.write(struct.pack('4f', 1, 4, 8, 2))
+        for layer in layers:
+            f.write(struct.pack('f', layer))
+        for i in range(len(layers)):
+            for j in range(i + 1):
+                for k in range(layers[i] + 1):
+                    for l in range(2):
+                        n = int(rng.integers(0, 30))
+                        f.write(struct.pack('f', n))
+                        records[i, j, k, l] = []
+                        for index in rng.permutation(200)[:n] - 100:
+                            cc = rng.normal(size=4).astype(np.float32)
+                            f.write(struct.pack('i4f', index, *cc))
+                            records[i, j, k, l].append((int(index), cc))
+    return records
+
+
+def random_pixels(rng, n, n_time=40):
+    # pixels (layers, time index) of the resolutions of the catalog
+    n_layers = rng.choice([layer + 1 for layer in LAYERS], n)
+    return np.stack([n_layers, rng.integers(0, n_time * 33, n)], axis=1).astype(np.int64)
+
+
+def reference_xtalk(records, layers, pixel1, pixel2):
+    # linear scan of the records of the bucket, as the ROOT monster::getXTalk
+    r1, r2 = layers.index(pixel1[0] - 1), layers.index(pixel2[0] - 1)
+    indx1, indx2 = pixel1[1], pixel2[1]
+    swap = r1 < r2
+    if swap:
+        r1, r2, indx1, indx2 = r2, r1, indx2, indx1
+    time1, freq1 = divmod(indx1, layers[r1] + 1)
+    odd = time1 & 1
+    index = indx2 - (time1 - odd) * (layers[r1] // layers[r2]) * (layers[r2] + 1)
+    for entry, cc in records[r1, r2, freq1, odd]:
+        if entry == index:
+            return cc[[0, 2, 1, 3]] if swap else cc
+    return np.full(4, 3, dtype=np.float32)
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(monster, '_catalogs', {})
+    fn = str(tmp_path / "catalog.bin")
+    write_catalog(fn, np.random.default_rng(0))
+    return fn
+
+
+def test_pruned_xtalk_matches_full_scan(catalog):
+    xtalk_coeff, lookup_table, layers, _ = monster.load_catalog(catalog)
+    support = monster.xtalk_support(layers, xtalk_coeff, lookup_table)
+
+    rng = np.random.default_rng(1)
+    for _ in range(30):
+        pixels = random_pixels(rng, int(rng.integers(1, 200)), n_time=int(rng.integers(1, 40)))
+        lookup, xtalk = monster.getXTalk_pixels_np(pixels, True, layers, xtalk_coeff, lookup_table)
+        pruned_lookup, pruned_xtalk = monster.getXTalk_pixels_pruned(pixels, layers, xtalk_coeff, lookup_table,
+                                                                     support)
+        np.testing.assert_array_equal(pruned_lookup, lookup)
+        np.testing.assert_array_equal(pruned_xtalk, xtalk)
+
+
+def test_read_catalog_header(catalog):
+    header = monster.read_catalog_header(catalog)
+    assert header.nRes == len(LAYERS)
+    assert list(header.layers) == LAYERS
+    assert (header.tag, header.BetaOrder, header.precision, header.KWDM) == (1, 4, 8, 2)
+
+
+def test_get_xtalk_matches_catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(monster, '_catalogs', {})
+    fn = str(tmp_path / "catalog.bin")
+    records = write_catalog(fn, np.random.default_rng(2))
+    xtalk_coeff, lookup_table, layers, n_res = monster.load_catalog(fn)
+    assert n_res == len(LAYERS)
+
+    rng = np.random.default_rng(3)
+    pixels = random_pixels(rng, 2000, n_time=4)
+    n_found = 0
+    for pixel1, pixel2 in zip(pixels[::2], pixels[1::2]):
+        expected = reference_xtalk(records, LAYERS, pixel1, pixel2)
+        ret = monster.getXTalk(pixel1[0], pixel1[1], pixel2[0], pixel2[1], layers, xtalk_coeff, lookup_table)
+        np.testing.assert_array_equal(ret, expected)
+        n_found += expected[0] < 2
+    assert n_found > 0
+
+
+def test_load_catalog_cache(catalog, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    converted = monster.load_catalog(catalog)
+    assert monster.load_catalog(catalog, cache_dir) is not converted
+
+    # a new process memory maps the converted catalog
+    monkeypatch.setattr(monster, '_catalogs', {})
+    cached = monster.load_catalog(catalog, cache_dir)
+    assert isinstance(cached[0], np.memmap)
+    for a, b in zip(converted, cached):
+        np.testing.assert_array_equal(a, b)
+    assert monster.load_catalog(catalog, cache_dir) is cached